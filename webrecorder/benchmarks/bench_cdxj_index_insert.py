@@ -0,0 +1,94 @@
+"""
+Compare the per-line CDXJ fan-out previously done by
+WebRecRedisIndexer.add_urls_to_index() against the single
+pipelined WebRecRedisIndexer.update_indexes()
+
+Requires a running redis, eg:
+
+    REDIS_BASE_URL=redis://localhost:6379/2 python bench_cdxj_index_insert.py -n 500
+"""
+
+import os
+import time
+
+from argparse import ArgumentParser
+
+from pywb.utils.format import res_template
+
+from webrecorder.utils import load_wr_config, redis_pipeline
+
+
+# ============================================================================
+def init_indexer():
+    os.environ.setdefault('REDIS_BASE_URL', 'redis://localhost:6379/2')
+    os.environ.setdefault('WARCSERVER_HOST', 'http://localhost:8010')
+    os.environ.setdefault('RECORD_ROOT', '/tmp/bench-warcs/')
+
+    from webrecorder.rec.webrecrecorder import WebRecRecorder
+    return WebRecRecorder.make_wr_indexer(load_wr_config())
+
+
+# ============================================================================
+def legacy_update(indexer, cdx_list, params, length):
+    r = indexer.redis
+
+    rec_cdxj_key = res_template(indexer.redis_key_template, params)
+    for cdx in cdx_list:
+        r.zadd(rec_cdxj_key, 0, cdx)
+
+    coll_cdxj_key = res_template(indexer.coll_cdxj_key, params)
+    if r.exists(coll_cdxj_key):
+        for cdx in cdx_list:
+            r.zadd(coll_cdxj_key, 0, cdx)
+
+    with redis_pipeline(r) as pi:
+        indexer._add_size_updates(pi, params, length, True, '2018-01-01', '0')
+
+
+# ============================================================================
+def make_cdx_list(count, prefix):
+    templ = ('com,example)/{prefix}/{i} 20180101000000 '
+             '{{"url": "http://example.com/{prefix}/{i}", "mime": "text/html", '
+             '"status": "200", "digest": "ABCDEF", "length": "1234", '
+             '"offset": "{i}", "filename": "rec.warc.gz"}}')
+
+    return [templ.format(prefix=prefix, i=i).encode('utf-8') for i in range(count)]
+
+
+def run(name, func, indexer, lines, iters):
+    params = {'param.user': 'bench', 'param.coll': 'coll', 'param.rec': name}
+
+    r = indexer.redis
+    coll_key = res_template(indexer.coll_cdxj_key, params)
+    r.delete(coll_key)
+    r.zadd(coll_key, 0, b'')
+
+    start = time.time()
+    for i in range(iters):
+        func(make_cdx_list(lines, name + str(i)), params, lines * 1000)
+
+    elapsed = time.time() - start
+    print('{0:>10}: {1:.3f}s total, {2:.2f}ms per response ({3} lines)'.format(
+          name, elapsed, elapsed * 1000 / iters, lines))
+
+    for key in r.scan_iter('*:bench:*'):
+        r.delete(key)
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--lines', type=int, default=200,
+                        help='cdx lines per response')
+    parser.add_argument('-i', '--iters', type=int, default=50)
+
+    r = parser.parse_args()
+
+    indexer = init_indexer()
+
+    run('legacy', lambda *args: legacy_update(indexer, *args), indexer, r.lines, r.iters)
+    run('pipelined', indexer.update_indexes, indexer, r.lines, r.iters)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare reloading a committed CDXJ index into a collection replay key
+with the previous per-line ZADD loop against the streaming, batched
+CollManagerMixin._do_download_cdxj(), in lines per second.
+
+By default a local CDXJ file is generated. Pass --s3-url to also copy it
+to S3 and benchmark loading from there (requires S3 credentials), eg:
+
+    REDIS_BASE_URL=redis://localhost:6379/2 python bench_cdxj_reload.py -n 200000 \\
+        --s3-url s3://my-bucket/bench/index.cdxj
+"""
+
+import os
+import time
+import tempfile
+
+from argparse import ArgumentParser
+
+from pywb.utils.loaders import load
+
+
+# ============================================================================
+def init_manager():
+    os.environ.setdefault('REDIS_BASE_URL', 'redis://localhost:6379/2')
+    os.environ.setdefault('RECORD_ROOT', '/tmp/bench-warcs/')
+
+    from webrecorder.redisman import init_manager_for_cli
+    return init_manager_for_cli()
+
+
+# ============================================================================
+def write_cdxj(filename, count):
+    templ = ('com,example)/page/{i:08d} 20180101000000 '
+             '{{"url": "http://example.com/page/{i:08d}", "mime": "text/html", '
+             '"status": "200", "digest": "ABCDEF", "length": "1234", '
+             '"offset": "{i}", "filename": "rec.warc.gz"}}\n')
+
+    with open(filename, 'wt') as fh:
+        for i in range(count):
+            fh.write(templ.format(i=i))
+
+
+def upload_s3(filename, s3_url):
+    import boto
+    from six.moves.urllib.parse import urlsplit
+
+    parts = urlsplit(s3_url)
+    bucket = boto.connect_s3().get_bucket(parts.netloc)
+    key = bucket.new_key(parts.path.lstrip('/'))
+    key.set_contents_from_filename(filename)
+
+
+# ============================================================================
+def legacy_load(manager, url, output_key):
+    fh = load(url)
+    try:
+        buff = fh.read()
+
+        for cdxj_line in buff.splitlines():
+            manager.redis.zadd(output_key, 0, cdxj_line)
+    finally:
+        fh.close()
+
+
+def streaming_load(manager, url, output_key):
+    rec_cdxj_key = 'r:bench:coll:rec:cdxj'
+    manager.redis.hset('r:bench:coll:rec:warc', manager.info_index_key, url)
+    manager._do_download_cdxj(rec_cdxj_key, output_key)
+
+
+def run(name, func, manager, url, count):
+    output_key = 'c:bench:coll:cdxj'
+    manager.redis.delete(output_key)
+
+    start = time.time()
+    func(manager, url, output_key)
+    elapsed = time.time() - start
+
+    assert manager.redis.zcard(output_key) == count
+
+    print('{0}: {1} lines in {2:.3f}s, {3:.0f} lines/sec'.format(name, count, elapsed,
+                                                                count / elapsed))
+
+    manager.redis.delete(output_key)
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser(description='CDXJ reload into collection index')
+    parser.add_argument('-n', '--lines', type=int, default=100000)
+    parser.add_argument('--s3-url')
+    r = parser.parse_args()
+
+    manager = init_manager()
+
+    with tempfile.NamedTemporaryFile(suffix='.cdxj', delete=False) as fh:
+        filename = fh.name
+
+    try:
+        write_cdxj(filename, r.lines)
+
+        urls = [('local', filename)]
+
+        if r.s3_url:
+            upload_s3(filename, r.s3_url)
+            urls.append(('s3', r.s3_url))
+
+        for source, url in urls:
+            run(source + ' per-line', legacy_load, manager, url, r.lines)
+            run(source + ' batched', streaming_load, manager, url, r.lines)
+
+    finally:
+        os.remove(filename)
+        manager.redis.delete('r:bench:coll:rec:warc')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare the previous has_user_email full scan of the users table against
+the email -> username index, for a registration check (email lookup) at
+a realistic number of users, in lookups per second.
+
+Runs against a local redis by default, or fakeredis with --fake, eg:
+
+    python bench_email_lookup.py -u 200000 -n 1000
+"""
+
+import json
+import time
+import random
+
+from argparse import ArgumentParser
+
+from webrecorder.redisutils import RedisTable, RedisUserTable
+
+
+# ============================================================================
+def scan_has_email(redis, email):
+    all_users = RedisTable(redis, 'h:users')
+    for n, userdata in all_users.items():
+        if userdata['email_addr'] == email:
+            return True
+
+    return False
+
+
+def index_has_email(redis, email):
+    return RedisUserTable(redis, 'h:users').get_user_for_email(email) is not None
+
+
+# ============================================================================
+def create_users(redis, num_users, batch_size=10000):
+    pi = redis.pipeline(transaction=False)
+
+    for i in range(num_users):
+        user = {'role': 'archivist',
+                'hash': 'x' * 60,
+                'email_addr': 'user{0}@example.com'.format(i),
+                'desc': '{"name": "User"}',
+                'creation_date': '2018-01-01 00:00:00.000000',
+                'last_login': '2018-01-01 00:00:00.000000'}
+
+        pi.hset('h:users', 'user{0}'.format(i), json.dumps(user))
+
+        if i % batch_size == 0:
+            pi.execute()
+
+    pi.execute()
+
+
+def run(func, redis, emails):
+    start = time.time()
+    for email in emails:
+        func(redis, email)
+
+    elapsed = time.time() - start
+    return len(emails) / elapsed
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-u', '--users', type=int, default=100000)
+    parser.add_argument('-n', '--lookups', type=int, default=1000)
+    parser.add_argument('--scan-lookups', type=int, default=5)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--fake', action='store_true')
+
+    r = parser.parse_args()
+
+    if r.fake:
+        from fakeredis import FakeStrictRedis
+        redis = FakeStrictRedis(decode_responses=True)
+    else:
+        import redis as redis_mod
+        redis = redis_mod.StrictRedis.from_url(r.redis_url, decode_responses=True)
+
+    redis.delete('h:users', RedisUserTable.EMAIL_INDEX_KEY)
+
+    print('Creating {0} users'.format(r.users))
+    create_users(redis, r.users)
+
+    # half of lookups are for new emails, as on registration
+    emails = ['user{0}@example.com'.format(random.randrange(r.users * 2))
+              for i in range(r.lookups)]
+
+    start = time.time()
+    RedisUserTable(redis, 'h:users').rebuild_email_index()
+    print('Index build: {0:.2f}s'.format(time.time() - start))
+
+    print('Full scan: {0:.2f} lookups/sec'.format(run(scan_has_email, redis, emails[:r.scan_lookups])))
+    print('Index: {0:.2f} lookups/sec'.format(run(index_has_email, redis, emails)))
+
+    redis.delete('h:users', RedisUserTable.EMAIL_INDEX_KEY)
+
+
+if __name__ == '__main__':
+    main()
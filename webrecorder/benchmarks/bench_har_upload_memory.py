@@ -0,0 +1,112 @@
+"""
+Compare peak memory and time for converting a large HAR to WARC by
+loading the whole HAR with json.loads() (previous upload path) against
+StreamingHarParser, which converts one entry at a time.
+
+Generates a synthetic HAR with base64 encoded bodies, eg:
+
+    python bench_har_upload_memory.py --entries 2000 --body-size 500000
+"""
+
+import os
+import json
+import time
+import base64
+import tempfile
+import tracemalloc
+
+from argparse import ArgumentParser
+
+from har2warc.har2warc import HarParser
+from warcio.warcwriter import WARCWriter
+
+from webrecorder.harparser import StreamingHarParser
+
+
+# ============================================================================
+def write_har(filename, num_entries, body_size):
+    with open(filename, 'wt') as fh:
+        fh.write('{"log": {"version": "1.2", "creator": {"name": "bench", "version": "1.0"}, ')
+        fh.write('"pages": [{"title": "http://example.com/", "startedDateTime": "2018-01-01T00:00:00.000Z"}], ')
+        fh.write('"entries": [')
+
+        for i in range(num_entries):
+            body = base64.b64encode(os.urandom(body_size)).decode('utf-8')
+
+            entry = {'startedDateTime': '2018-01-01T00:00:00.000Z',
+                     'request': {'method': 'GET',
+                                 'url': 'http://example.com/{0}'.format(i),
+                                 'headers': [],
+                                 'bodySize': 0},
+                     'response': {'status': 200,
+                                  'headers': [{'name': 'Content-Type', 'value': 'application/octet-stream'}],
+                                  'content': {'text': body, 'encoding': 'base64'}}}
+
+            if i:
+                fh.write(', ')
+
+            fh.write(json.dumps(entry))
+
+        fh.write(']}}')
+
+
+# ============================================================================
+def convert_loaded(filename, out):
+    with open(filename, 'rb') as fh:
+        buff_list = []
+        while True:
+            buff = fh.read()
+            if not buff:
+                break
+
+            buff_list.append(buff.decode('utf-8'))
+
+        har = json.loads(''.join(buff_list))
+        HarParser(har, WARCWriter(out)).parse('bench.warc.gz', 'Bench')
+
+
+def convert_streaming(filename, out):
+    with open(filename, 'rb') as fh:
+        StreamingHarParser(fh, WARCWriter(out)).parse('bench.warc.gz', 'Bench')
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser(description='HAR to WARC conversion memory')
+    parser.add_argument('--entries', type=int, default=500)
+    parser.add_argument('--body-size', type=int, default=100000)
+    r = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    har_filename = os.path.join(root, 'bench.har')
+
+    try:
+        write_har(har_filename, r.entries, r.body_size)
+        print('HAR size: {0} bytes'.format(os.path.getsize(har_filename)))
+
+        for name, func in (('json.loads', convert_loaded), ('streaming', convert_streaming)):
+            out_filename = os.path.join(root, name + '.warc.gz')
+
+            tracemalloc.start()
+            start = time.time()
+
+            with open(out_filename, 'wb') as out:
+                func(har_filename, out)
+
+            elapsed = time.time() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print('{0}: {1:.2f}s, peak {2:.1f} MB, WARC {3} bytes'.format(name, elapsed,
+                                                                        peak / 1000000.0,
+                                                                        os.path.getsize(out_filename)))
+
+    finally:
+        for name in os.listdir(root):
+            os.remove(os.path.join(root, name))
+
+        os.rmdir(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare a cold start (parse and index every archive, saving index
+segments) against a warm start (load every segment from the cache) for
+the standalone player's per-file index cache.
+
+Generates a set of test WARCs, eg:
+
+    python bench_player_index_cache.py --files 200 --records 500
+"""
+
+import os
+import time
+import shutil
+import tempfile
+
+from io import BytesIO
+from argparse import ArgumentParser
+
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+from webrecorder.uploadcontroller import index_archive_file
+from webrecorder.standalone.indexcache import IndexSegmentCache
+
+
+# ============================================================================
+def create_warc(filename, num_records):
+    with open(filename, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=True)
+
+        for i in range(num_records):
+            payload = ('<html><body>Page {0}</body></html>'.format(i)).encode('utf-8')
+
+            headers_list = [('Content-Type', 'text/html; charset="UTF-8"'),
+                            ('Content-Length', str(len(payload)))]
+
+            http_headers = StatusAndHeaders('200 OK', headers_list, protocol='HTTP/1.0')
+
+            url = 'http://example.com/{0}/page-{1}'.format(os.path.basename(filename), i)
+
+            rec = writer.create_warc_record(url, 'response',
+                                            payload=BytesIO(payload),
+                                            length=len(payload),
+                                            http_headers=http_headers)
+
+            writer.write_record(rec)
+
+
+# ============================================================================
+def run_cold(files, cache):
+    for filename in files:
+        result = index_archive_file(filename, filename, os.path.basename(filename))
+        cache.save(filename, result)
+
+
+def run_warm(files, cache):
+    for filename in files:
+        assert cache.load(filename)
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser(description='Player index cache, cold vs warm start')
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--records', type=int, default=500)
+    r = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+
+    try:
+        files = []
+        for i in range(r.files):
+            filename = os.path.join(root, 'bench-{0}.warc.gz'.format(i))
+            create_warc(filename, r.records)
+            files.append(filename)
+
+        cache = IndexSegmentCache(os.path.join(root, 'segments'))
+
+        for name, func in (('cold', run_cold), ('warm', run_warm)):
+            start = time.time()
+            func(files, cache)
+            elapsed = time.time() - start
+
+            print('{0}: {1} files, {2} records each: {3:.3f}s'.format(name, r.files,
+                                                                   r.records, elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
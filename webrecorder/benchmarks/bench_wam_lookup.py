@@ -0,0 +1,99 @@
+"""
+Compare the previous linear prefix scan in WAMLoader.find_archive_for_url
+against the compiled longest-prefix regex, with and without the lookup
+cache, in lookups per second.
+
+Uses the full webarchives registry (the merged webarchives.yaml, or
+--webarchives path). Lookups are a mix of urls from every archive and
+live web urls that match no archive, eg:
+
+    python bench_wam_lookup.py -n 200000 --unique 2000
+"""
+
+import time
+import random
+
+from argparse import ArgumentParser
+
+from webrecorder.load.wamloader import WAMLoader
+
+
+# ============================================================================
+def linear_find(wam_loader, url):
+    schemeless_url = wam_loader.STRIP_SCHEME.sub('', url)
+    for pk, info in wam_loader.replay_info.items():
+        if schemeless_url.startswith(info['replay_prefix']):
+            orig_url = schemeless_url[len(info['replay_prefix']):]
+            if info.get('parse_collection'):
+                coll, orig_url = orig_url.split('/', 1)
+                id_ = pk + ':' + coll
+            else:
+                id_ = pk
+
+            return pk, orig_url, id_
+
+
+# ============================================================================
+def make_urls(wam_loader, num_unique):
+    urls = []
+    infos = list(wam_loader.replay_info.values())
+
+    for i in range(num_unique):
+        orig_url = 'http://example.com/page/{0}'.format(i)
+
+        # half of lookups are for live web urls
+        if i % 2 == 0 or not infos:
+            urls.append(orig_url)
+            continue
+
+        info = infos[i % len(infos)]
+        prefix = 'http://' + info['replay_prefix']
+        if info.get('parse_collection'):
+            prefix += 'coll/'
+
+        urls.append(prefix + '20180101000000/' + orig_url)
+
+    return urls
+
+
+def run(func, urls, count):
+    start = time.time()
+    for i in range(count):
+        func(urls[i % len(urls)])
+
+    return time.time() - start
+
+
+# ============================================================================
+def main():
+    parser = ArgumentParser(description='WAMLoader archive lookup')
+    parser.add_argument('-n', '--num', type=int, default=100000)
+    parser.add_argument('--unique', type=int, default=1000)
+    parser.add_argument('--webarchives')
+    r = parser.parse_args()
+
+    wam_loader = WAMLoader()
+    if r.webarchives:
+        wam_loader.replay_info = {}
+        wam_loader.load_all(r.webarchives)
+
+    print('Archives: {0}'.format(len(wam_loader.replay_info)))
+
+    urls = make_urls(wam_loader, r.unique)
+    random.shuffle(urls)
+
+    # overlapping prefixes may now resolve to the longer match
+    for url in urls:
+        assert (linear_find(wam_loader, url) is None) == (wam_loader._find_archive_for_url(url) is None), url
+
+    tests = (('linear scan', lambda url: linear_find(wam_loader, url)),
+             ('compiled', wam_loader._find_archive_for_url),
+             ('compiled + cache', wam_loader.find_archive_for_url))
+
+    for name, func in tests:
+        elapsed = run(func, urls, r.num)
+        print('{0}: {1:.3f}s, {2:.0f} lookups/s'.format(name, elapsed, r.num / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -64,7 +64,7 @@ class Install(install):
         from webrecorder.standalone.assetsutils import default_build
         from webrecorder.load.wamloader import WAMLoader
         default_build()
-        WAMLoader.merge_webarchives()
+        WAMLoader.load_registry(WAMLoader.merge_webarchives())
         generate_git_hash_py('webrecorder')
         super(Install, self).initialize_options()
 
@@ -108,6 +108,7 @@ setup(
         'WebTest',
         'pytest-cov',
         'fakeredis',
+        'lupa',
         'mock',
        ],
     cmdclass={'test': PyTest,
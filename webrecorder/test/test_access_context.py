@@ -0,0 +1,100 @@
+from .testutils import FullStackTests
+
+import os
+
+from contextlib import contextmanager
+
+from mock import patch
+
+from webrecorder.redisutils import CountingRedis
+
+
+# ============================================================================
+class TestAccessContext(FullStackTests):
+    @classmethod
+    def setup_class(cls):
+        os.environ['RATE_LIMIT_MAX'] = '100000'
+        os.environ['RATE_LIMIT_HOURS'] = '2'
+        super(TestAccessContext, cls).setup_class()
+
+        manager = cls.appcont.manager
+
+        # one entry per round trip, the command name or 'pipeline'
+        cls.calls = []
+        manager.redis = CountingRedis(manager.redis, cls.calls.append)
+
+        cls.check_calls = []
+
+        orig_access_context = manager.access_context
+
+        @contextmanager
+        def access_context(*args, **kwargs):
+            start = len(cls.calls)
+            with orig_access_context(*args, **kwargs) as ctx:
+                yield ctx
+
+            cls.check_calls.append(cls.calls[start:])
+
+        manager.access_context = access_context
+
+    @classmethod
+    def teardown_class(cls):
+        os.environ.pop('RATE_LIMIT_MAX', '')
+        os.environ.pop('RATE_LIMIT_HOURS', '')
+        super(TestAccessContext, cls).teardown_class()
+
+    def get_check_calls(self, url, **kwargs):
+        self.check_calls[:] = []
+        res = self.testapp.get(url.format(user=self.anon_user), **kwargs)
+        res.charset = 'utf-8'
+
+        assert len(self.check_calls) == 1
+        return res, self.check_calls[0]
+
+    def test_record(self):
+        res = self.testapp.get('/_new/temp/rec/record/mp_/http://httpbin.org/get?food=bar')
+        res = res.follow()
+
+        res, calls = self.get_check_calls('/{user}/temp/rec/record/mp_/http://httpbin.org/get?food=bar2')
+        assert '"food": "bar2"' in res.text, res.text
+
+        # open recording ttl refreshed after access checks
+        assert calls == ['pipeline', 'expire']
+
+    def test_record_no_write_access(self):
+        open_key = 'r:{user}:temp:rec:open'.format(user=self.anon_user)
+        self.redis.expire(open_key, 2)
+
+        with patch.object(self.appcont.manager, 'can_write_coll', return_value=False):
+            res, calls = self.get_check_calls('/{user}/temp/rec/record/mp_/http://httpbin.org/get?food=bar',
+                                              status=404)
+
+        # open recording ttl not refreshed without write access
+        assert calls == ['pipeline']
+        assert self.redis.ttl(open_key) <= 2
+
+        self.redis.expire(open_key, self.appcont.manager.open_rec_ttl)
+
+    def test_replay(self):
+        res, calls = self.get_check_calls('/{user}/temp/rec/replay/mp_/http://httpbin.org/get?food=bar')
+        assert '"food": "bar"' in res.text, res.text
+
+        assert calls == ['pipeline']
+
+    def test_replay_coll(self):
+        res, calls = self.get_check_calls('/{user}/temp/mp_/http://httpbin.org/get?food=bar')
+        assert '"food": "bar"' in res.text, res.text
+
+        assert calls == ['pipeline']
+
+    def test_record_missing_rec(self):
+        res, calls = self.get_check_calls('/{user}/temp/no-such-rec/record/mp_/http://httpbin.org/get',
+                                          status=404)
+
+        assert calls == ['pipeline']
+
+    def test_context_cleared_after_request(self):
+        manager = self.appcont.manager
+
+        # no stale context once checks are done, later lookups go to redis
+        assert manager._get_access_context(self.anon_user, 'temp') is None
@@ -0,0 +1,123 @@
+from fakeredis import FakeStrictRedis
+
+from webrecorder.utils import BatchedHashCounter, UploadProgressTracker, SizeTrackingReader
+from webrecorder.rec.webrecrecorder import TempWriteBuffer
+
+from io import BytesIO
+
+import os
+import time
+
+
+# ============================================================================
+class TestBatchedCounters(object):
+    def setup_method(self):
+        self.redis = FakeStrictRedis(decode_responses=True)
+        self.redis.flushdb()
+
+    def test_flush_size(self):
+        counter = BatchedHashCounter(self.redis, 'h:test', 'size', flush_size=10, flush_secs=60)
+
+        counter.incr(4)
+        assert self.redis.hget('h:test', 'size') == None
+        assert counter.pending == 4
+
+        counter.incr(6)
+        assert self.redis.hget('h:test', 'size') == '10'
+        assert counter.pending == 0
+        assert counter.flushed == 10
+
+    def test_flush_secs(self):
+        counter = BatchedHashCounter(self.redis, 'h:test', 'size', flush_size=1000, flush_secs=0.1)
+
+        counter.incr(1)
+        assert self.redis.hget('h:test', 'size') == None
+
+        time.sleep(0.15)
+
+        counter.incr(1)
+        assert self.redis.hget('h:test', 'size') == '2'
+        assert counter.flushed == 2
+
+    def test_temp_buffer_close(self):
+        buff = TempWriteBuffer(self.redis, 'r:test:info', 'Test', 'http://example.com/',
+                               flush_size=10, flush_secs=60)
+
+        for i in range(5):
+            buff.write(b'12345')
+
+        # flushed at 10 and 20, last 5 bytes still pending locally
+        assert self.redis.hget('r:test:info', 'pending_size') == '20'
+        assert self.redis.hget('r:test:info', 'pending_count') == '1'
+
+        buff.close()
+
+        assert self.redis.hget('r:test:info', 'pending_size') == '0'
+        assert self.redis.hget('r:test:info', 'pending_count') == '0'
+
+    def test_temp_buffer_close_concurrent(self):
+        buff = TempWriteBuffer(self.redis, 'r:test:info', 'Test', 'http://example.com/',
+                               flush_size=10, flush_secs=60)
+
+        buff_2 = TempWriteBuffer(self.redis, 'r:test:info', 'Test', 'http://example.com/2',
+                                 flush_size=10, flush_secs=60)
+
+        buff.write(b'1234567890')
+        buff_2.write(b'1234567890abcdef')
+        buff.write(b'123')
+
+        assert self.redis.hget('r:test:info', 'pending_size') == '26'
+
+        # only first buffer's flushed amount removed
+        buff.close()
+        assert self.redis.hget('r:test:info', 'pending_size') == '16'
+        assert self.redis.hget('r:test:info', 'pending_count') == '1'
+
+        buff_2.close()
+        assert self.redis.hget('r:test:info', 'pending_size') == '0'
+        assert self.redis.hget('r:test:info', 'pending_count') == '0'
+
+    def test_upload_tracker_shared(self):
+        data = os.urandom(25000)
+
+        self.redis.hset('u:test:upload', 'size', 0)
+        self.redis.hset('u:test:upload', 'total_size', len(data) * 2)
+
+        tracker = UploadProgressTracker(self.redis, 'u:test:upload', flush_size=4096, flush_secs=60)
+
+        # write path
+        stream = BytesIO(data)
+        while True:
+            buff = stream.read(1000)
+            if not buff:
+                break
+
+            tracker.incr(len(buff))
+
+        tracker.flush()
+
+        assert self.redis.hget('u:test:upload', 'size') == str(len(data))
+
+        # index path, same tracker
+        reader = SizeTrackingReader(BytesIO(data), len(data), self.redis, 'u:test:upload',
+                                    tracker=tracker)
+
+        assert reader.tracker is tracker
+
+        while reader.read(1000):
+            pass
+
+        reader.tracker.flush()
+
+        upload = self.redis.hgetall('u:test:upload')
+        assert upload['size'] == upload['total_size']
+
+    def test_size_tracking_reader_own_tracker(self):
+        data = os.urandom(5000)
+
+        reader = SizeTrackingReader(BytesIO(data), len(data), self.redis, 'u:test:upload')
+
+        assert reader.read() == data
+
+        reader.tracker.flush()
+        assert self.redis.hget('u:test:upload', 'size') == str(len(data))
@@ -2,6 +2,8 @@ from .testutils import FullStackTests
 import time
 import os
 
+from io import BytesIO
+
 import gevent
 from webrecorder.rec.storagecommitter import StorageCommitter
 from webrecorder.rec.worker import Worker
@@ -77,6 +79,14 @@ class TestCDXJCache(FullStackTests):
 
         self.sleep_try(0.1, 3.0, assert_files_closed)
 
+    def test_commit_stats(self):
+        def assert_committed():
+            stats = self.redis.hgetall('h:commit-stats')
+            assert int(stats['committed']) >= 1
+            assert int(stats['queue_depth']) == 0
+
+        self.sleep_try(0.2, 3.0, assert_committed)
+
     def test_download(self):
         assert self.redis.hget('r:{user}:temp:rec:warc'.format(user=self.anon_user), '@index_file') != None
 
@@ -100,7 +110,10 @@ class TestCDXJCache(FullStackTests):
         self.sleep_try(0.1, 0.5, self.assert_exists('c:{user}:temp:cdxj', True))
 
         assert len(self.redis.zrange('c:{user}:temp:cdxj'.format(user=self.anon_user), 0, -1)) == 2
+        self.assert_exists('c:{user}:temp:cdxj:ready', True)()
+
         self.sleep_try(1.0, 1.0, self.assert_exists('c:{user}:temp:cdxj', False))
+        self.assert_exists('c:{user}:temp:cdxj:ready', False)()
 
     @patch('webrecorder.redisman.load', slow_load)
     def test_sync_avoid_double_load(self):
@@ -113,6 +126,9 @@ class TestCDXJCache(FullStackTests):
 
         self.assert_exists('r:{user}:temp:rec:cdxj:_', True)()
 
+        # download lock has a lease
+        assert self.redis.ttl('r:{user}:temp:rec:cdxj:_'.format(user=self.anon_user)) > 0
+
         self.m.sync_coll_index(self.anon_user, 'temp', exists=True, do_async=True)
 
         time.sleep(0.1)
@@ -123,6 +139,177 @@ class TestCDXJCache(FullStackTests):
 
         assert load_counter == 1
 
+    @patch('webrecorder.redisman.load', slow_load)
+    def test_sync_wait_for_build(self):
+        self.sleep_try(0.5, 3.0, self.assert_exists('c:{user}:temp:cdxj', False))
+
+        self.m.sync_coll_index(self.anon_user, 'temp', exists=False, do_async=True)
+
+        time.sleep(0.1)
+        self.assert_exists('c:{user}:temp:cdxj:_', True)()
+
+        # waits for the in-progress build instead of starting another
+        self.m.sync_coll_index(self.anon_user, 'temp', exists=False, do_async=False)
+
+        self.assert_exists('c:{user}:temp:cdxj:ready', True)()
+        self.assert_exists('c:{user}:temp:cdxj:_', False)()
+
+        assert len(self.redis.zrange('c:{user}:temp:cdxj'.format(user=self.anon_user), 0, -1)) == 2
+
+        assert load_counter == 2
+
+    def test_load_cdxj_batched(self):
+        lines = [('com,example)/{0} 2018 {{}}'.format(i)).encode('utf-8') for i in range(25)]
+        fh = BytesIO(b'\n'.join(lines) + b'\n')
+
+        self.m.cdxj_load_batch_size = 10
+        self.m.CDXJ_LOAD_CHUNK_SIZE = 17
+
+        assert self.m._load_cdxj_lines(fh, 'c:test:batch:cdxj', 'c:test:batch:_') == 25
+
+        assert self.redis.zrange('c:test:batch:cdxj', 0, -1) == sorted(line.decode('utf-8') for line in lines)
+        assert self.redis.get('c:test:batch:_') == '25'
+
+        # total lines loaded into output index
+        assert self.m.get_cdxj_load_progress('c:test:batch:cdxj') == 25
+
+        # retry after partial load, already added lines not counted again
+        self.redis.zremrangebyrank('c:test:batch:cdxj', 0, 4)
+        self.redis.decr('c:test:batch:cdxj:_n', 5)
+
+        fh.seek(0)
+        assert self.m._load_cdxj_lines(fh, 'c:test:batch:cdxj', 'c:test:batch:_') == 25
+
+        assert self.redis.zcard('c:test:batch:cdxj') == 25
+        assert self.m.get_cdxj_load_progress('c:test:batch:cdxj') == 25
+
+        self.redis.delete('c:test:batch:cdxj', 'c:test:batch:_', 'c:test:batch:cdxj:_n')
+
+    def test_lock_token(self):
+        token = self.m.acquire_lock('c:test:lock:_')
+        assert token
+        assert self.m.acquire_lock('c:test:lock:_') == None
+        assert self.redis.ttl('c:test:lock:_') > 0
+
+        # only released or renewed by holder
+        assert not self.m.release_lock('c:test:lock:_', 'other')
+        assert not self.m.renew_lock('c:test:lock:_', 'other')
+        assert self.redis.get('c:test:lock:_') == token
+
+        assert self.m.renew_lock('c:test:lock:_', token)
+        assert self.m.release_lock('c:test:lock:_', token)
+        assert not self.redis.exists('c:test:lock:_')
+
+    def test_lease_expires_mid_build(self):
+        coll_cdxj_key = 'c:{user}:temp:cdxj'.format(user=self.anon_user)
+        self.redis.delete(coll_cdxj_key, coll_cdxj_key + ':ready')
+
+        add_cdxj_batch = self.m._add_cdxj_batch
+
+        # lease expires after first batch and another build takes the lock
+        def expire_lease(*args, **kwargs):
+            self.redis.set(coll_cdxj_key + ':_', 'other', ex=60)
+            return add_cdxj_batch(*args, **kwargs)
+
+        self.m.cdxj_load_batch_size = 1
+
+        with patch.object(self.m, '_add_cdxj_batch', expire_lease):
+            self.m.sync_coll_index(self.anon_user, 'temp')
+
+        # stopped after first batch, not marked ready, other build's lock kept
+        assert self.redis.zcard(coll_cdxj_key) == 1
+        self.assert_exists('c:{user}:temp:cdxj:ready', False)()
+        assert self.redis.get(coll_cdxj_key + ':_') == 'other'
+        self.assert_exists('r:{user}:temp:rec:cdxj:_', False)()
+
+        assert self.m.release_lock(coll_cdxj_key + ':_', 'other')
+
+        self.m.sync_coll_index(self.anon_user, 'temp')
+
+        assert self.redis.zcard(coll_cdxj_key) == 2
+        self.assert_exists('c:{user}:temp:cdxj:ready', True)()
+        self.assert_exists('c:{user}:temp:cdxj:_', False)()
+
+        self.m.cdxj_load_batch_size = 10
+
+    def test_failed_download_not_ready(self):
+        coll_cdxj_key = 'c:{user}:temp:cdxj'.format(user=self.anon_user)
+        self.redis.delete(coll_cdxj_key, coll_cdxj_key + ':ready')
+
+        with patch('webrecorder.redisman.load', side_effect=IOError('not found')):
+            self.m.sync_coll_index(self.anon_user, 'temp')
+
+        # recording's lines missing, not marked ready
+        self.assert_exists('c:{user}:temp:cdxj:ready', False)()
+        self.assert_exists('c:{user}:temp:cdxj:_', False)()
+
+    def test_empty_coll_ready(self):
+        self.m.create_collection(self.anon_user, 'empty-coll', 'Empty Coll')
+
+        self.m.sync_coll_index(self.anon_user, 'empty-coll')
+        self.assert_exists('c:{user}:empty-coll:cdxj:empty', True)()
+
+        # no build while known to be empty
+        with patch.object(self.m, 'acquire_lock') as acquire_lock:
+            self.m.sync_coll_index(self.anon_user, 'empty-coll')
+
+        assert not acquire_lock.called
+
+        self.m.create_recording(self.anon_user, 'empty-coll', 'rec', 'Rec')
+        self.assert_exists('c:{user}:empty-coll:cdxj:empty', False)()
+
+    def test_commit_lock_token(self):
+        committer = self.worker.worker
+        lock_key = 'r:test:temp:rec:cdxj:commit_lock'
+
+        # lock held by another committer
+        self.redis.set(lock_key, 'other', ex=60)
+
+        with patch.object(committer, 'process_cdxj_key') as process:
+            assert not committer.commit_recording('r:test:temp:rec:cdxj')
+
+        assert not process.called
+        assert self.redis.get(lock_key) == 'other'
+
+        self.redis.delete(lock_key)
+
+        # lock taken over mid-commit not released by previous holder
+        def take_over(cdxj_key, lease):
+            self.redis.set(lock_key, 'other', ex=60)
+
+        with patch.object(committer, 'process_cdxj_key', take_over):
+            assert committer.commit_recording('r:test:temp:rec:cdxj')
+
+        assert self.redis.get(lock_key) == 'other'
+
+        self.redis.delete(lock_key)
+
+    def test_commit_lease_renewed(self):
+        committer = self.worker.worker
+        lock_key = 'r:test:temp:rec:cdxj:commit_lock'
+
+        leases = []
+
+        # commit takes longer than lock lease
+        def slow_process(cdxj_key, lease):
+            time.sleep(2.5)
+            assert self.redis.exists(lock_key)
+            assert not lease.lost
+
+            self.redis.set(lock_key, 'other', ex=60)
+            time.sleep(1.0)
+            leases.append(lease)
+
+        with patch.object(committer, 'commit_lock_secs', 1):
+            with patch.object(committer, 'process_cdxj_key', slow_process):
+                assert committer.commit_recording('r:test:temp:rec:cdxj')
+
+        # lock taken over, lease marked lost
+        assert leases[0].lost
+        assert self.redis.get(lock_key) == 'other'
+
+        self.redis.delete(lock_key)
+
     def test_ensure_all_files_delete(self):
         user_dir = os.path.join(self.warcs_dir, self.anon_user)
         files = os.listdir(user_dir)
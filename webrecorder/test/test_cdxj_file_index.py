@@ -0,0 +1,108 @@
+from .testutils import FullStackTests
+
+import os
+import gevent
+
+from webrecorder.rec.storagecommitter import StorageCommitter
+from webrecorder.rec.worker import Worker
+from webrecorder.load.tieredindex import TieredCDXJIndexSource
+
+
+# ============================================================================
+class TestCDXJFileIndex(FullStackTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestCDXJFileIndex, cls).setup_class(extra_config_file='test_cdxj_file_index_config.yaml')
+
+        cls.worker = Worker(StorageCommitter)
+        gevent.spawn(cls.worker.run)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.worker.stop()
+        super(TestCDXJFileIndex, cls).teardown_class()
+
+    def assert_exists(self, key, exists):
+        def func():
+            assert exists == self.redis.exists(key.format(user=self.anon_user))
+
+        return func
+
+    def test_record(self):
+        res = self.testapp.get('/_new/temp/rec/record/mp_/http://httpbin.org/get?food=bar')
+        res = res.follow()
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+        res = self.testapp.get('/{user}/temp/rec/record/mp_/http://httpbin.org/get?bood=far'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"bood": "far"' in res.text, res.text
+
+    def test_replay_before_commit(self):
+        self.sleep_try(0.1, 2.0, self.assert_exists('r:{user}:temp:rec:cdxj', True))
+
+        res = self.testapp.get('/{user}/temp/mp_/http://httpbin.org/get?food=bar'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+        # no collection index built
+        self.assert_exists('c:{user}:temp:cdxj', False)()
+
+    def test_commit(self):
+        self.sleep_try(0.5, 10.0, self.assert_exists('r:{user}:temp:rec:cdxj', False))
+
+        assert self.redis.hget('r:{user}:temp:rec:warc'.format(user=self.anon_user), '@index_file')
+
+    def test_replay_coll_from_index_file(self):
+        res = self.testapp.get('/{user}/temp/mp_/http://httpbin.org/get?bood=far'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"bood": "far"' in res.text, res.text
+
+        self.assert_exists('c:{user}:temp:cdxj', False)()
+        self.assert_exists('r:{user}:temp:rec:cdxj', False)()
+
+    def test_replay_rec_from_index_file(self):
+        res = self.testapp.get('/{user}/temp/rec/replay/mp_/http://httpbin.org/get?food=bar'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+    def test_cache_evict_least_recently_used(self):
+        src_dir = os.path.join(self.root_dir, 'cache_src')
+        os.makedirs(src_dir)
+
+        config = {'cdxj_key_templ': '',
+                  'warc_key_templ': '',
+                  'rec_list_key_templ': '',
+                  'info_index_key': '',
+                  'full_warc_prefix': 'remote://',
+                  'cdxj_file_cache_max_size': 45}
+
+        source = TieredCDXJIndexSource(self.redis, config, os.path.join(self.root_dir, 'cache'))
+
+        urls = []
+        for name in ('a', 'b', 'c'):
+            filename = os.path.join(src_dir, name + '.cdxj')
+            with open(filename, 'wb') as fh:
+                fh.write(b'x' * 20)
+
+            urls.append('file://' + filename)
+
+        cached_a = source.get_local_index(urls[0])
+        cached_b = source.get_local_index(urls[1])
+
+        os.utime(cached_a, (100, 100))
+        os.utime(cached_b, (200, 200))
+
+        # a used again, b now least recently used
+        assert source.get_local_index(urls[0]) == cached_a
+
+        cached_c = source.get_local_index(urls[2])
+
+        assert os.path.isfile(cached_a)
+        assert not os.path.isfile(cached_b)
+        assert os.path.isfile(cached_c)
@@ -0,0 +1,130 @@
+from .testutils import FullStackTests
+
+from webrecorder.redisman import init_manager_for_cli
+
+
+# ============================================================================
+class TestCollIndexIncremental(FullStackTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestCollIndexIncremental, cls).setup_class(extra_config_file='test_coll_index_incremental_config.yaml')
+
+        cls.m = init_manager_for_cli()
+
+    def coll_cdxj(self):
+        return self.redis.zrange('c:{user}:temp:cdxj'.format(user=self.anon_user), 0, -1)
+
+    def test_record_1(self):
+        res = self.testapp.get('/_new/temp/rec-a/record/mp_/http://httpbin.org/get?food=bar')
+        res = res.follow()
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+        def assert_cdx():
+            assert len(self.redis.zrange('r:{user}:temp:rec-a:cdxj'.format(user=self.anon_user), 0, -1)) == 1
+
+        self.sleep_try(0.1, 2.0, assert_cdx)
+
+    def test_replay_build_index(self):
+        res = self.testapp.get('/{user}/temp/mp_/http://httpbin.org/get?food=bar'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+        coll_cdxj_key = 'c:{user}:temp:cdxj'.format(user=self.anon_user)
+
+        assert len(self.coll_cdxj()) == 1
+        assert self.redis.exists(coll_cdxj_key + ':ready')
+
+        # no ttl, tracked by last access instead
+        assert self.redis.ttl(coll_cdxj_key) == -1
+        assert self.redis.zscore('z:coll-cdxj-access', coll_cdxj_key) > 0
+
+    def test_record_2_added_to_index(self):
+        res = self.testapp.get('/_new/temp/rec-b/record/mp_/http://httpbin.org/get?bood=far')
+        res = res.follow()
+        res.charset = 'utf-8'
+
+        assert '"bood": "far"' in res.text, res.text
+
+        def assert_cdx():
+            assert len(self.coll_cdxj()) == 2
+
+        self.sleep_try(0.1, 2.0, assert_cdx)
+
+    def test_delete_rec_removed_from_index(self):
+        res = self.testapp.delete('/api/v1/recordings/rec-a?user={user}&coll=temp'.format(user=self.anon_user))
+
+        assert res.json == {'deleted_id': 'rec-a'}
+
+        def assert_cdx():
+            cdxj_lines = self.coll_cdxj()
+            assert len(cdxj_lines) == 1
+            assert 'bood=far' in cdxj_lines[0]
+
+        self.sleep_try(0.1, 2.0, assert_cdx)
+
+        assert self.redis.exists('c:{user}:temp:cdxj:ready'.format(user=self.anon_user))
+
+    def test_evict_by_size(self):
+        coll_cdxj_key = 'c:{user}:temp:cdxj'.format(user=self.anon_user)
+
+        self.m.evict_coll_indexes()
+        assert self.redis.exists(coll_cdxj_key)
+
+        self.m.coll_cdxj_max_lines = 0
+        self.m.evict_coll_indexes()
+
+        assert not self.redis.exists(coll_cdxj_key)
+        assert not self.redis.exists(coll_cdxj_key + ':ready')
+        assert self.redis.zscore('z:coll-cdxj-access', coll_cdxj_key) is None
+
+    def test_rename_coll_moves_access(self):
+        self.m.coll_cdxj_max_lines = 20000000
+
+        # rebuild evicted index
+        res = self.testapp.get('/{user}/temp/mp_/http://httpbin.org/get?bood=far'.format(user=self.anon_user))
+        res.charset = 'utf-8'
+
+        assert '"bood": "far"' in res.text, res.text
+
+        coll_cdxj_key = 'c:{user}:temp:cdxj'.format(user=self.anon_user)
+        last_access = self.redis.zscore('z:coll-cdxj-access', coll_cdxj_key)
+        assert last_access > 0
+
+        res = self.m.rename(user=self.anon_user, coll='temp', new_coll='moved', title='Moved')
+        TestCollIndexIncremental.moved_coll = res['coll_id']
+
+        moved_key = 'c:{user}:{coll}:cdxj'.format(user=self.anon_user, coll=self.moved_coll)
+
+        assert self.redis.exists(moved_key)
+        assert self.redis.zscore('z:coll-cdxj-access', coll_cdxj_key) is None
+        assert self.redis.zscore('z:coll-cdxj-access', moved_key) == last_access
+
+    def test_evict_on_access(self):
+        # index not accessed since 1970
+        self.redis.zadd('c:other:coll:cdxj', 0, 'com,example)/ 2018 {}')
+        self.redis.zadd('z:coll-cdxj-access', 1, 'c:other:coll:cdxj')
+
+        self.redis.delete('z:coll-cdxj-access:evict')
+
+        self.m.sync_coll_index(self.anon_user, self.moved_coll)
+
+        def assert_evicted():
+            assert not self.redis.exists('c:other:coll:cdxj')
+            assert self.redis.zscore('z:coll-cdxj-access', 'c:other:coll:cdxj') is None
+
+        self.sleep_try(0.1, 2.0, assert_evicted)
+
+        # accessed index kept
+        moved_key = 'c:{user}:{coll}:cdxj'.format(user=self.anon_user, coll=self.moved_coll)
+        assert self.redis.exists(moved_key)
+
+    def test_delete_coll_removes_access(self):
+        moved_key = 'c:{user}:{coll}:cdxj'.format(user=self.anon_user, coll=self.moved_coll)
+
+        assert self.m._send_delete('coll', self.anon_user, self.moved_coll)
+
+        assert not self.redis.exists(moved_key)
+        assert self.redis.zscore('z:coll-cdxj-access', moved_key) is None
@@ -0,0 +1,72 @@
+from .testutils import BaseWRTests
+
+from webrecorder.redisman import init_manager_for_cli
+from webrecorder.redisutils import RedisTable
+
+
+# ============================================================================
+class TestEmailIndex(BaseWRTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestEmailIndex, cls).setup_class(init_anon=False, no_app=True)
+        cls.m = init_manager_for_cli()
+
+    def add_user(self, username, email):
+        self.m.cork._store.users[username] = {'role': 'archivist',
+                                              'hash': '',
+                                              'email_addr': email,
+                                              'desc': '{}'}
+
+    def test_scan_before_build(self):
+        # existing user, added without index
+        RedisTable(self.redis, 'h:users')['existing'] = {'email_addr': 'existing@example.com'}
+
+        assert self.m.has_user_email('existing@example.com')
+        assert not self.m.has_user_email('other@example.com')
+
+        # not built on lookup
+        assert not self.redis.exists('h:user_emails')
+
+    def test_create_user(self):
+        self.add_user('someuser', 'someuser@example.com')
+
+        assert self.m.has_user_email('someuser@example.com')
+
+    def test_update_email(self):
+        self.m.cork.user('someuser').update(email_addr='changed@example.com')
+
+        assert not self.m.has_user_email('someuser@example.com')
+        assert self.m.has_user_email('changed@example.com')
+
+    def test_delete_user(self):
+        self.m.cork.user('someuser').delete()
+
+        assert not self.m.has_user_email('changed@example.com')
+        assert self.m.has_user_email('existing@example.com')
+
+    def test_rebuild(self):
+        self.redis.delete('h:user_emails')
+
+        assert self.m.get_users().rebuild_email_index() == 1
+
+        assert self.redis.hgetall('h:user_emails') == {'@ready': '1',
+                                                       'existing@example.com': 'existing'}
+
+    def test_rebuild_keeps_concurrent_update(self):
+        # written by a user update after the build read the users table
+        self.redis.hset('h:user_emails', 'existing@example.com', 'newowner')
+
+        assert self.m.get_users().rebuild_email_index() == 1
+        assert self.redis.hget('h:user_emails', 'existing@example.com') == 'newowner'
+
+        self.redis.hset('h:user_emails', 'existing@example.com', 'existing')
+
+    def test_lookup_after_build(self):
+        self.add_user('otheruser', 'otheruser@example.com')
+
+        assert self.m.has_user_email('otheruser@example.com')
+        assert self.m.has_user_email('existing@example.com')
+
+        # stale entry not matching user's current email
+        self.redis.hset('h:user_emails', 'stale@example.com', 'existing')
+        assert not self.m.has_user_email('stale@example.com')
@@ -0,0 +1,88 @@
+from webrecorder.harparser import StreamingHarParser, JSONStreamReader
+from har2warc.har2warc import HarParser
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.warcwriter import BufferWARCWriter
+
+from io import BytesIO
+
+import base64
+import json
+
+
+# ============================================================================
+def make_har(num_entries, entries_first=False):
+    entries = []
+    for i in range(num_entries):
+        body = base64.b64encode(('<html>Page {0}</html>'.format(i)).encode('utf-8')).decode('utf-8')
+
+        entries.append({'startedDateTime': '2018-01-01T00:00:00.000Z',
+                        'request': {'method': 'GET',
+                                    'url': 'http://example.com/page-{0}'.format(i),
+                                    'httpVersion': 'HTTP/1.1',
+                                    'headers': [{'name': 'Host', 'value': 'example.com'}],
+                                    'bodySize': 0},
+                        'response': {'status': 200,
+                                     'statusText': 'OK',
+                                     'httpVersion': 'HTTP/1.1',
+                                     'headers': [{'name': 'Content-Type', 'value': 'text/html'}],
+                                     'content': {'text': body, 'encoding': 'base64'}}})
+
+    log = [('version', '1.2'),
+           ('creator', {'name': 'test', 'version': '1.0'}),
+           ('pages', [{'title': 'http://example.com/page-0',
+                       'startedDateTime': '2018-01-01T00:00:00.000Z'}])]
+
+    if entries_first:
+        log.insert(0, ('entries', entries))
+    else:
+        log.append(('entries', entries))
+
+    return '{"log": {' + ', '.join(json.dumps(n) + ': ' + json.dumps(v) for n, v in log) + '}}'
+
+
+def convert(parser_cls, har):
+    writer = BufferWARCWriter(gzip=False)
+    if parser_cls == HarParser:
+        har = json.loads(har)
+    else:
+        har = BytesIO(har.encode('utf-8'))
+
+    parser_cls(har, writer).parse('test.warc.gz', 'Test')
+
+    records = []
+    for record in ArchiveIterator(BytesIO(writer.get_contents())):
+        records.append((record.rec_type,
+                        record.rec_headers.get_header('WARC-Target-URI'),
+                        record.content_stream().read()))
+
+    return records
+
+
+# ============================================================================
+class TestHarStream(object):
+    def test_json_stream_reader(self):
+        doc = {'a': [1, 2.5, {'b': 'c' * 100}], 'd': {}, 'e': 12345678901234}
+        reader = JSONStreamReader(BytesIO(json.dumps(doc).encode('utf-8')), chunk_size=3)
+
+        res = {}
+        for key in reader.iter_object():
+            if key == 'a':
+                res[key] = list(reader.iter_array())
+            else:
+                res[key] = reader.read_value()
+
+        assert res == doc
+
+    def test_same_as_har_parser(self):
+        har = make_har(10)
+
+        records = convert(StreamingHarParser, har)
+        assert records == convert(HarParser, har)
+
+        assert [rec_type for rec_type, _, _ in records[:3]] == ['warcinfo', 'response', 'request']
+        assert len(records) == 21
+
+    def test_entries_before_log_fields(self):
+        records = convert(StreamingHarParser, make_har(10, entries_first=True))
+        assert records == convert(HarParser, make_har(10))
@@ -3,11 +3,14 @@ from .testutils import TempDirTests, BaseTestClass, FakeRedisTests
 from io import BytesIO
 
 from webrecorder.standalone.webrecorder_player import webrecorder_player
+from webrecorder.standalone.indexcache import IndexSegmentCache
+from webrecorder.uploadcontroller import ParallelInplaceLoader
 
 import os
 import requests
 import gzip
 import json
+import shutil
 
 from tempfile import NamedTemporaryFile
 
@@ -139,6 +142,25 @@ class TestPlayer(BaseTestPlayer):
         assert res.headers['Memento-Datetime'] == 'Wed, 01 Jan 2014 00:00:00 GMT'
 
 
+# ============================================================================
+class TestParallelIndexPlayer(TestPlayer):
+    @classmethod
+    def get_player_cmd(cls):
+        return ['--no-browser', cls.warc_path, '--jobs', '2']
+
+    def test_worker_error_per_file(self):
+        class FailedResult(object):
+            def get(self):
+                raise ValueError('worker failed')
+
+        loader = ParallelInplaceLoader.__new__(ParallelInplaceLoader)
+        result = loader._get_worker_result(self.warc_path, FailedResult())
+
+        # handled as an error for that file only
+        assert result['error'] == 'worker failed'
+        assert result['size'] == os.path.getsize(self.warc_path)
+
+
 # ============================================================================
 class TestCacheingPlayer(BaseTestPlayer):
     @classmethod
@@ -151,10 +173,12 @@ class TestCacheingPlayer(BaseTestPlayer):
                             name)
 
         cls.cache_path = path
+        cls.segments_dir = os.path.join(os.path.dirname(path), 'segments')
 
     @classmethod
     def teardown_class(cls):
         os.remove(cls.cache_path)
+        shutil.rmtree(cls.segments_dir)
         super(TestCacheingPlayer, cls).teardown_class()
 
     @classmethod
@@ -169,5 +193,35 @@ class TestCacheingPlayer(BaseTestPlayer):
 
         assert cache['version'] == '1'
 
+    def test_segment_cache_create(self):
+        cache = IndexSegmentCache(self.segments_dir)
+
+        assert os.path.isfile(cache.get_segment_path(self.warc_path))
+
+        result = cache.load(self.warc_path)
+        assert len(result['infos']) == 1
+
+        cdx_list = list(result['cdx_lists'].values())[0]
+        assert len(cdx_list) == 2
+        assert all(cdx.startswith(b'com,example)/') for cdx in cdx_list)
+
+    def test_segment_cache_replace_changed(self):
+        cache = IndexSegmentCache(self.segments_dir)
+
+        old_path = cache.get_segment_path(self.warc_path)
+        result = cache.load(self.warc_path)
+
+        # file changed, old segment no longer used
+        res = os.stat(self.warc_path)
+        os.utime(self.warc_path, (res.st_atime, res.st_mtime + 10))
+
+        new_path = cache.get_segment_path(self.warc_path)
+        assert new_path != old_path
+        assert cache.load(self.warc_path) == None
 
+        # saving new segment removes old one
+        assert cache.save(self.warc_path, result)
 
+        assert os.path.isfile(new_path)
+        assert not os.path.isfile(old_path)
+        assert os.listdir(self.segments_dir) == [os.path.basename(new_path)]
@@ -0,0 +1,64 @@
+from webrecorder.utils import PositionalReader
+
+import tempfile
+
+
+# ============================================================================
+class TestPositionalReader(object):
+    def setup_method(self):
+        self.fh = tempfile.TemporaryFile()
+        self.fh.write(b'0123456789abcdefghij')
+        self.fh.flush()
+
+    def teardown_method(self):
+        self.fh.close()
+
+    def test_interleaved_reads(self):
+        fileno = self.fh.fileno()
+
+        reader = PositionalReader(fileno)
+        reader_2 = PositionalReader(fileno, 10)
+
+        assert reader.read(3) == b'012'
+        assert reader_2.read(3) == b'abc'
+        assert reader.read(3) == b'345'
+        assert reader_2.read(3) == b'def'
+
+        assert reader.tell() == 6
+        assert reader_2.tell() == 16
+
+        # shared descriptor position not used
+        assert self.fh.tell() == 20
+
+    def test_interleaved_seeks(self):
+        fileno = self.fh.fileno()
+
+        reader = PositionalReader(fileno)
+        reader_2 = PositionalReader(fileno)
+
+        assert reader.seek(5) == 5
+        assert reader_2.seek(-4, 2) == 16
+
+        assert reader_2.read(2) == b'gh'
+        assert reader.read(2) == b'56'
+
+        assert reader.seek(2, 1) == 9
+        assert reader_2.seek(0) == 0
+
+        assert reader.read(2) == b'9a'
+        assert reader_2.read(2) == b'01'
+
+        # read to end, then empty
+        assert reader.read() == b'bcdefghij'
+        assert reader.read(5) == b''
+        assert reader_2.read(-1) == b'23456789abcdefghij'
+
+    def test_close_keeps_descriptor(self):
+        reader = PositionalReader(self.fh.fileno())
+        reader.close()
+
+        assert reader.closed
+        assert not self.fh.closed
+
+        self.fh.seek(0)
+        assert self.fh.read(4) == b'0123'
@@ -0,0 +1,122 @@
+from .testutils import BaseWRTests
+
+import os
+
+from mock import patch
+from boto.exception import S3ResponseError
+
+from webrecorder.rec.s3 import S3Storage
+
+
+# ============================================================================
+class FakeKey(object):
+    def __init__(self, name, data=b''):
+        self.name = name
+        self.data = data
+        self.etag = '"{0}"'.format(hash(data))
+
+
+# ============================================================================
+class FakeMultiPartUpload(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.key_name = None
+        self.id = None
+
+    def upload_part_from_file(self, fp, part_num, size=None):
+        if part_num in self.bucket.fail_parts:
+            self.bucket.fail_parts.remove(part_num)
+            raise S3ResponseError(500, 'Part Failed')
+
+        key = FakeKey(self.key_name, fp.read(size))
+        self.bucket.uploads[self.id][part_num] = key
+        return key
+
+    def complete_upload(self):
+        parts = self.bucket.uploads.pop(self.id)
+        data = b''.join(parts[num].data for num in sorted(parts))
+        self.bucket.keys[self.key_name] = FakeKey(self.key_name, data)
+
+
+# ============================================================================
+class FakeBucket(object):
+    def __init__(self):
+        self.keys = {}
+        self.uploads = {}
+        self.fail_parts = set()
+        self.upload_count = 0
+
+    def initiate_multipart_upload(self, key_name):
+        mp = FakeMultiPartUpload(self)
+        mp.key_name = key_name
+        mp.id = 'upload-' + str(self.upload_count)
+        self.upload_count += 1
+        self.uploads[mp.id] = {}
+        return mp
+
+    def get_key(self, key_name):
+        return self.keys.get(key_name)
+
+
+# ============================================================================
+class TestS3Multipart(BaseWRTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestS3Multipart, cls).setup_class(init_anon=False, no_app=True)
+
+        cls.bucket = FakeBucket()
+
+        cls.filename = os.path.join(cls.warcs_dir, 'test.warc.gz')
+        cls.data = os.urandom(2500)
+
+        with open(cls.filename, 'wb') as fh:
+            fh.write(cls.data)
+
+    def get_storage(self):
+        upload_config = {'multipart_threshold': 1000,
+                         'part_size': 1000,
+                         'part_concurrency': 2,
+                         'part_state_templ': 'wp:{filename}',
+                         'part_state_secs': 100}
+
+        config = {'remote_url_templ': 's3://test-bucket/{user}/{obj_type}/{filename}'}
+
+        with patch('boto.connect_s3') as connect_s3:
+            connect_s3.return_value.get_bucket.return_value = self.bucket
+            return S3Storage(config, self.redis, upload_config)
+
+    def test_upload_part_fails(self):
+        self.bucket.fail_parts.add(2)
+
+        storage = self.get_storage()
+        assert not storage.upload_file('user', 'coll', 'rec', 'test.warc.gz', self.filename, 'warcs')
+
+        state = self.redis.hgetall('wp:' + self.filename)
+        assert state['upload_id'] == 'upload-0'
+        assert '1' in state
+        assert '2' not in state
+
+        assert storage.get_valid_remote_url('user', 'coll', 'rec', 'test.warc.gz', 'warcs') is None
+
+    @patch('webrecorder.rec.s3.MultiPartUpload', FakeMultiPartUpload)
+    def test_upload_resume(self):
+        storage = self.get_storage()
+        assert storage.upload_file('user', 'coll', 'rec', 'test.warc.gz', self.filename, 'warcs')
+
+        # same upload resumed and completed
+        assert self.bucket.uploads == {}
+        assert self.bucket.keys['user/warcs/test.warc.gz'].data == self.data
+
+        assert not self.redis.exists('wp:' + self.filename)
+
+        remote_url = storage.get_valid_remote_url('user', 'coll', 'rec', 'test.warc.gz', 'warcs')
+        assert remote_url == 's3://test-bucket/user/warcs/test.warc.gz'
+
+    def test_upload_below_threshold(self):
+        small_filename = os.path.join(self.warcs_dir, 'small.warc.gz')
+        with open(small_filename, 'wb') as fh:
+            fh.write(b'small')
+
+        storage = self.get_storage()
+        assert not storage._use_multipart(small_filename)
+        assert storage._use_multipart(self.filename)
@@ -0,0 +1,78 @@
+from .testutils import FullStackTests
+
+import os
+import base64
+import pickle
+
+from fakeredis import FakeStrictRedis
+
+from webrecorder.session import RedisSessionMiddleware
+
+
+# ============================================================================
+class TestSessionStore(FullStackTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestSessionStore, cls).setup_class()
+        cls.sesh_redis = FakeStrictRedis.from_url(os.environ['REDIS_SESSION_URL'])
+
+    def get_middleware(self, **kwargs):
+        opts = {'session.key': '__test_sesh',
+                'session.secret': 'secret',
+                'session.key_template': 'test_key:{0}',
+                'session.long_sessions_key': 'ls:{0}',
+                'session.durations': {}}
+        opts.update(kwargs)
+        return RedisSessionMiddleware(None, None, self.sesh_redis, opts)
+
+    def test_encode_compact(self):
+        middleware = self.get_middleware()
+
+        data = {'id': 'abc', 'csrf': 'xyz', 'anon': 'temp-ABC'}
+        value = middleware.encode_session(data)
+
+        assert ' ' not in value
+        assert middleware.decode_session(value.encode('utf-8')) == data
+
+    def test_decode_legacy_pickle(self):
+        middleware = self.get_middleware()
+
+        data = {'id': 'abc', 'csrf': 'xyz'}
+        value = base64.b64encode(pickle.dumps(data))
+
+        assert middleware.decode_session(value) == data
+
+    def test_cookie_cache(self):
+        middleware = self.get_middleware(**{'session.cookie_cache_secs': 60})
+
+        cookie = '__test_sesh=' + middleware.id_to_signed_cookie('abc', False)
+
+        assert middleware.signed_cookie_to_id(cookie) == ['abc', False]
+        assert len(middleware.cookie_cache) == 1
+
+        # invalid signatures not cached
+        assert middleware.signed_cookie_to_id(cookie + 'x') is None
+        assert len(middleware.cookie_cache) == 1
+
+        # cached result returned without verifying again
+        middleware.serializer = None
+        assert middleware.signed_cookie_to_id(cookie) == ['abc', False]
+
+    def test_anon_mapping_written_once(self):
+        # create anon session and temp collection
+        res = self.testapp.post('/api/v1/recordings?user={user}&coll=temp'.format(user=self.anon_user),
+                                params={'title': 'Rec'})
+        assert res.json['recording']['id'] == 'rec'
+
+        res = self.testapp.get('/{user}/temp'.format(user=self.anon_user))
+        assert self.sesh_redis.get('t:' + self.anon_user)
+
+        sesh_keys = self.sesh_redis.keys('test_key*')
+        assert len(sesh_keys) == 1
+        assert self.sesh_redis.get(sesh_keys[0]).startswith(b'{')
+
+        # mapping not rewritten on every request
+        self.sesh_redis.delete('t:' + self.anon_user)
+
+        res = self.testapp.get('/{user}/temp'.format(user=self.anon_user))
+        assert not self.sesh_redis.get('t:' + self.anon_user)
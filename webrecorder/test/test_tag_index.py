@@ -0,0 +1,76 @@
+from .testutils import BaseWRTests
+
+from webrecorder.redisman import init_manager_for_cli
+from webrecorder.rec.webrecrecorder import WebRecRecorder
+from webrecorder.utils import load_wr_config, redis_pipeline
+
+
+# ============================================================================
+class TestTagIndex(BaseWRTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestTagIndex, cls).setup_class(init_anon=False, no_app=True)
+        cls.m = init_manager_for_cli()
+
+    def test_tag_pages(self):
+        self.m.tag_page(['foo', 'bar'], 'user', 'coll', 'rec-a', 'http://example.com/ 20170102 chrome:60')
+        self.m.tag_page(['foo'], 'user', 'coll', 'rec-b', 'http://example.com/b 20170101 chrome:60')
+        self.m.tag_page(['foo'], 'user', 'other', 'rec-c', 'http://example.com/c 20170103 chrome:60')
+
+        assert self.redis.smembers('tg:foo') == {'r:user:coll:rec-a:tag:foo',
+                                                 'r:user:coll:rec-b:tag:foo',
+                                                 'r:user:other:rec-c:tag:foo'}
+
+        assert self.redis.smembers('c:user:coll:tags') == {'r:user:coll:rec-a:tag:foo',
+                                                           'r:user:coll:rec-a:tag:bar',
+                                                           'r:user:coll:rec-b:tag:foo'}
+
+    def test_get_tags_in_collection(self):
+        tags = self.m.get_tags_in_collection('user', 'coll')
+        assert tags == {'foo': {'http://example.com/ 20170102 chrome:60',
+                                'http://example.com/b 20170101 chrome:60'},
+                        'bar': {'http://example.com/ 20170102 chrome:60'}}
+
+    def test_get_pages_for_tag(self):
+        pages = self.m.get_pages_for_tag('foo')
+        assert [(page['recording'], page['timestamp']) for page in pages] == [('rec-b', '20170101'),
+                                                                             ('rec-a', '20170102'),
+                                                                             ('rec-c', '20170103')]
+
+    def test_untag_removes_from_index(self):
+        self.m.tag_page(['bar'], 'user', 'coll', 'rec-a', 'http://example.com/ 20170102 chrome:60')
+
+        assert not self.redis.smembers('tg:bar')
+        assert 'r:user:coll:rec-a:tag:bar' not in self.redis.smembers('c:user:coll:tags')
+        assert 'bar' not in self.m.get_tags_in_collection('user', 'coll')
+
+    def test_rename_and_delete(self):
+        recorder = WebRecRecorder(load_wr_config())
+
+        self.redis.rename('r:user:coll:rec-b:tag:foo', 'r:user:other:rec-b:tag:foo')
+
+        with redis_pipeline(recorder.redis) as pi:
+            recorder._move_tag_index(pi, 'r:user:coll:rec-b:tag:foo', 'r:user:other:rec-b:tag:foo')
+
+        assert self.redis.smembers('c:user:other:tags') == {'r:user:other:rec-c:tag:foo',
+                                                            'r:user:other:rec-b:tag:foo'}
+
+        assert self.redis.smembers('c:user:coll:tags') == {'r:user:coll:rec-a:tag:foo'}
+
+        with redis_pipeline(recorder.redis) as pi:
+            recorder._move_tag_index(pi, 'r:user:other:rec-c:tag:foo')
+
+        assert self.redis.smembers('tg:foo') == {'r:user:coll:rec-a:tag:foo',
+                                                 'r:user:other:rec-b:tag:foo'}
+
+    def test_build_tag_indexes(self):
+        self.redis.delete('tg:foo', 'c:user:coll:tags', 'c:user:other:tags')
+
+        assert self.m.build_tag_indexes() >= 3
+
+        assert self.redis.smembers('tg:foo') == {'r:user:coll:rec-a:tag:foo',
+                                                 'r:user:other:rec-b:tag:foo',
+                                                 'r:user:other:rec-c:tag:foo'}
+
+        assert self.redis.smembers('c:user:other:tags') == {'r:user:other:rec-b:tag:foo',
+                                                            'r:user:other:rec-c:tag:foo'}
@@ -0,0 +1,42 @@
+from .testutils import FullStackTests
+
+import logging
+import re
+
+
+# ============================================================================
+class TestTemplateMemo(FullStackTests):
+    @classmethod
+    def setup_class(cls):
+        super(TestTemplateMemo, cls).setup_class(extra_config_file='test_template_stats_config.yaml')
+
+    def _anon_post(self, url, *args, **kwargs):
+        return self.testapp.post(url.format(user=self.anon_user), *args, **kwargs)
+
+    def get_render_calls(self, caplog, url):
+        caplog.clear()
+        with caplog.at_level(logging.INFO):
+            res = self.testapp.get(url.format(user=self.anon_user))
+
+        counts = [int(m.group(1)) for m in
+                  (re.match(r'Template collection_info.html: (\d+) redis calls', r.getMessage())
+                   for r in caplog.records) if m]
+
+        assert len(counts) == 1
+        return res, counts[0]
+
+    def test_create_rec(self):
+        res = self._anon_post('/api/v1/recordings?user={user}&coll=temp', params={'title': 'Rec 0'})
+        assert res.json['recording']['id'] == 'rec-0'
+
+    def test_render_calls_not_per_recording(self, caplog):
+        res, single_count = self.get_render_calls(caplog, '/{user}/temp')
+        assert res.status_code == 200
+
+        for i in range(1, 6):
+            self._anon_post('/api/v1/recordings?user={user}&coll=temp', params={'title': 'Rec ' + str(i)})
+
+        res, count = self.get_render_calls(caplog, '/{user}/temp')
+        assert res.status_code == 200
+
+        assert count == single_count
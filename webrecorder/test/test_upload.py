@@ -5,10 +5,13 @@ import gevent
 from webrecorder.redisman import init_manager_for_cli
 
 from webrecorder.admin import create_user
+from webrecorder.utils import PositionalReader
 import os
 
 import webtest
 
+from mock import patch
+
 from webrecorder.rec.tempchecker import TempChecker
 from webrecorder.rec.worker import Worker
 import gevent
@@ -89,3 +92,39 @@ class TestUpload(FullStackTests):
         res.charset = 'utf-8'
 
         assert '"food": "bar"' in res.text, res.text
+
+    def test_logged_in_record_2(self):
+        res = self.testapp.get('/_new/default-collection/rec-sesh-2/record/mp_/http://httpbin.org/get?bood=far')
+        res = res.follow()
+        res.charset = 'utf-8'
+
+        assert '"bood": "far"' in res.text, res.text
+
+    def test_logged_in_upload_multi_rec(self):
+        res = self.testapp.get('/test/default-collection/$download')
+        warc = self._get_dechunked(res.body)
+
+        with patch('webrecorder.uploadcontroller.PositionalReader', wraps=PositionalReader) as reader_cls:
+            res = self.testapp.put('/_upload?filename=example-multi.warc.gz', params=warc.getvalue())
+            upload_id = res.json['upload_id']
+
+            def assert_finished():
+                res = self.testapp.get('/_upload/' + upload_id + '?user=test')
+                assert res.json['size'] >= res.json['total_size']
+                assert res.json['files'] == 0
+
+            self.sleep_try(0.1, 5.0, assert_finished)
+
+        coll = self.testapp.get('/_upload/' + upload_id + '?user=test').json['coll']
+
+        # recordings uploaded concurrently, each with its own reader
+        assert reader_cls.call_count == 2
+        assert len(self.redis.smembers('c:test:{0}:recs'.format(coll))) == 2
+
+        res = self.testapp.get('/test/{0}/mp_/http://httpbin.org/get?food=bar'.format(coll))
+        res.charset = 'utf-8'
+        assert '"food": "bar"' in res.text, res.text
+
+        res = self.testapp.get('/test/{0}/mp_/http://httpbin.org/get?bood=far'.format(coll))
+        res.charset = 'utf-8'
+        assert '"bood": "far"' in res.text, res.text
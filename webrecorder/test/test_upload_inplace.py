@@ -0,0 +1,91 @@
+from . import test_upload
+
+import os
+
+from mock import patch
+
+from webrecorder.uploadcontroller import UploadController
+
+
+# ============================================================================
+class TestUploadInplace(test_upload.TestUpload):
+    @classmethod
+    def setup_class(cls):
+        super(TestUploadInplace, cls).setup_class(extra_config_file='test_upload_inplace_config.yaml')
+
+    def test_upload_adopted_inplace(self):
+        recs = self.redis.smembers('c:test:default-collection-2:recs')
+        assert len(recs) == 1
+
+        warcs = self.redis.hgetall('r:test:default-collection-2:{0}:warc'.format(recs.pop()))
+        assert len(warcs) == 1
+
+        filename, full_filename = list(warcs.items())[0]
+        assert filename.startswith('upload-')
+        assert filename.endswith('.warc.gz')
+
+        # uploaded file moved into place, not rewritten
+        assert full_filename == os.path.join(self.warcs_dir, 'test', filename)
+        assert os.path.getsize(full_filename) == len(self.warc.getvalue())
+
+        assert not any(name.endswith('.uploading') for name in os.listdir(os.path.join(self.warcs_dir, 'test')))
+
+    def test_upload_indexed_on_complete(self):
+        res = self.testapp.put('/_upload?filename=example-2.warc.gz', params=self.warc.getvalue())
+        upload_id = res.json['upload_id']
+
+        # indexed while receiving, done when upload request completes
+        res = self.testapp.get('/_upload/' + upload_id + '?user=test')
+        assert res.json['files'] == 0
+        assert res.json['size'] >= res.json['total_size']
+
+        coll = res.json['coll']
+
+        res = self.testapp.get('/test/{0}/mp_/http://httpbin.org/get?food=bar'.format(coll))
+        res.charset = 'utf-8'
+
+        assert '"food": "bar"' in res.text, res.text
+
+    def test_upload_multi_rec_inplace_async(self):
+        res = self.testapp.get('/test/default-collection/$download')
+        warc = self._get_dechunked(res.body)
+
+        index_uploaded = UploadController.index_uploaded
+        results = []
+
+        def index_and_keep(*args, **kwargs):
+            res = index_uploaded(*args, **kwargs)
+            results.append(res)
+            return res
+
+        with patch.object(UploadController, 'index_uploaded', index_and_keep):
+            res = self.testapp.put('/_upload?filename=example-multi-2.warc.gz', params=warc.getvalue())
+
+        upload_id = res.json['upload_id']
+
+        # can't be adopted, indexing stopped at second recording
+        infos, cdx_lists = results[0]
+        assert len([info for info in infos if info['type'] == 'recording']) == 2
+        assert cdx_lists is None
+
+        # not adopted, upload request returns before recordings are ingested
+        res = self.testapp.get('/_upload/' + upload_id + '?user=test')
+        assert res.json['files'] == 1
+
+        def assert_finished():
+            res = self.testapp.get('/_upload/' + upload_id + '?user=test')
+            assert res.json['size'] >= res.json['total_size']
+            assert res.json['files'] == 0
+
+        self.sleep_try(0.1, 5.0, assert_finished)
+
+        coll = self.testapp.get('/_upload/' + upload_id + '?user=test').json['coll']
+        assert len(self.redis.smembers('c:test:{0}:recs'.format(coll))) == 2
+
+        assert not any(name.endswith('.uploading') for name in os.listdir(os.path.join(self.warcs_dir, 'test')))
+
+    def test_upload_error_removes_spool(self):
+        with patch.object(UploadController, 'index_uploaded', side_effect=ValueError('invalid archive')):
+            self.testapp.put('/_upload?filename=example-bad.warc.gz', params=self.warc.getvalue(), status=500)
+
+        assert not any(name.endswith('.uploading') for name in os.listdir(os.path.join(self.warcs_dir, 'test')))
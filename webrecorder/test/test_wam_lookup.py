@@ -0,0 +1,118 @@
+from webrecorder.load.wamloader import WAMLoader
+from webrecorder.load.wamsourceloader import WAMSourceLoader
+
+import os
+import time
+import shutil
+import tempfile
+
+
+WEBARCHIVES = """
+webarchives:
+  ex:
+    name: Example Archive
+    apis:
+      wayback:
+        replay:
+          raw: http://archive.example.com/{timestamp}id_/{url}
+"""
+
+
+# ============================================================================
+class TestWAMLookup(object):
+    @classmethod
+    def setup_class(cls):
+        cls.wam_loader = WAMLoader()
+        cls.wam_loader.replay_info = {}
+
+        def wayback(replay):
+            return {'apis': {'wayback': {'replay': {'raw': replay}}}}
+
+        cls.wam_loader.load_archive('ex', wayback('http://archive.example.com/{timestamp}/{url}'))
+        cls.wam_loader.load_archive('ex-sub', wayback('https://archive.example.com/sub/{timestamp}/{url}'))
+
+        colls = wayback('http://colls.example.com/{collection}/{timestamp}/{url}')
+        colls['collections'] = '.*'
+        cls.wam_loader.load_archive('colls', colls)
+
+        cls.wam_loader.compile_prefixes()
+
+    def test_find_archive(self):
+        res = self.wam_loader.find_archive_for_url('http://archive.example.com/2017/http://example.com/')
+        assert res == ('ex', '2017/example.com/', 'ex')
+
+    def test_find_longest_prefix(self):
+        res = self.wam_loader.find_archive_for_url('http://archive.example.com/sub/2017/https://example.com/')
+        assert res == ('ex-sub', '2017/example.com/', 'ex-sub')
+
+    def test_find_collection(self):
+        res = self.wam_loader.find_archive_for_url('https://colls.example.com/foo/2017/http://example.com/')
+        assert res == ('colls', '2017/example.com/', 'colls:foo')
+
+    def test_no_archive(self):
+        assert self.wam_loader.find_archive_for_url('http://example.com/') is None
+
+    def test_cached_lookup(self):
+        self.wam_loader.find_archive_for_url.cache_clear()
+
+        for i in range(3):
+            self.wam_loader.find_archive_for_url('http://archive.example.com/2017/http://example.com/')
+
+        info = self.wam_loader.find_archive_for_url.cache_info()
+        assert info.hits == 2
+        assert info.misses == 1
+
+
+# ============================================================================
+class TestWAMRegistry(object):
+    @classmethod
+    def setup_class(cls):
+        cls.root_dir = tempfile.mkdtemp()
+        cls.yaml_path = os.path.join(cls.root_dir, 'webarchives.yaml')
+        cls.snapshot_path = os.path.join(cls.root_dir, 'webarchives.json')
+
+        with open(cls.yaml_path, 'wt') as fh:
+            fh.write(WEBARCHIVES)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.root_dir)
+
+    def test_snapshot_created(self):
+        entries = WAMLoader.load_registry(self.yaml_path)
+        assert [pk for pk, _ in entries] == ['ex']
+
+        assert os.path.isfile(self.snapshot_path)
+
+        # shared in process
+        assert WAMLoader.load_registry(self.yaml_path) is entries
+
+    def test_snapshot_loaded(self):
+        WAMLoader._registry_cache.clear()
+
+        entries = WAMLoader.load_registry(self.yaml_path)
+        assert entries == [('ex', {'name': 'Example Archive',
+                                   'apis': {'wayback': {'replay': {'raw': 'http://archive.example.com/{timestamp}id_/{url}'}}}})]
+
+    def test_snapshot_stale(self):
+        time.sleep(0.01)
+        with open(self.yaml_path, 'wt') as fh:
+            fh.write(WEBARCHIVES.replace('ex:', 'ex2:'))
+
+        entries = WAMLoader.load_registry(self.yaml_path)
+        assert [pk for pk, _ in entries] == ['ex2']
+
+    def test_lazy_sources(self):
+        wam_loader = WAMSourceLoader()
+        wam_loader.sources = type(wam_loader.sources)()
+        wam_loader.load_all(self.yaml_path)
+
+        assert 'ex2' in wam_loader.sources
+        assert 'ex2' in wam_loader.sources.factories
+
+        source = wam_loader.sources['ex2']
+        assert source is not None
+        assert 'ex2' not in wam_loader.sources.factories
+
+        assert wam_loader.sources['ex2'] is source
+        assert dict(wam_loader.sources.items()) == {'ex2': source}
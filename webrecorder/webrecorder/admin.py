@@ -34,12 +34,20 @@ def main(args=None):
     parser.add_argument('-i', '--invite')
     parser.add_argument('-l', '--list', action='store_true')
     parser.add_argument('-b', '--backlog')
+    parser.add_argument('--build-tag-index', dest='build_tag_index',
+                        action='store_true', help='Build tag indexes for existing tagged pages')
+    parser.add_argument('--rebuild-email-index', dest='rebuild_email_index',
+                        action='store_true', help='Build the email -> username index from existing users, used for lookups once built')
 
     r = parser.parse_args(args=args)
     m = init_manager_for_cli()
 
     if r.backlog:
         do_invite_backlog(m, r.backlog)
+    elif r.build_tag_index:
+        build_tag_index(m)
+    elif r.rebuild_email_index:
+        rebuild_email_index(m)
     elif r.list:
         list_not_invited(m, r.invite_all)
     elif r.invite:
@@ -54,6 +62,18 @@ def main(args=None):
         print('All systems go! See --help for usage')
 
 
+def build_tag_index(m):
+    print('Building tag indexes...')
+    count = m.build_tag_indexes()
+    print('Indexed {0} recording tag keys'.format(count))
+
+
+def rebuild_email_index(m):
+    print('Rebuilding email index...')
+    count = m.get_users().rebuild_email_index()
+    print('Indexed {0} user emails'.format(count))
+
+
 def choose_role(m):
     """Flexible choice prompt for as many roles as the system has"""
     roles = [r for r in m.cork.list_roles()]
@@ -82,7 +102,7 @@ def create_user(m, email=None, username=None, passwd=None, role=None, name=None)
         print('valid email required!')
         return
 
-    if email in [data['email_addr'] for u, data in users.items()]:
+    if m.has_user_email(email):
         print('A user already exists with {0} email!'.format(email))
         return
 
@@ -191,7 +211,7 @@ def modify_user(m):
             print('valid email required!')
             return
 
-        if new_email in [data['email_addr'] for u, data in users.items()]:
+        if m.has_user_email(new_email):
             print('A user already exists with {0} email!'.format(new_email))
             return
 
@@ -271,7 +291,6 @@ def do_invite(m, email, email_template='webrecorder/templates/emailinvite.html')
 
 
 def do_invite_backlog(m, filename):
-    users = m.get_users()
     with open(filename) as fh:
         for line in fh:
             line = line.rstrip('\n "')
@@ -284,14 +303,8 @@ def do_invite_backlog(m, filename):
                 print('Already Registered: ' + email)
                 continue
 
-            skip = False
-            for n, v in iteritems(users):
-                if v['email_addr'] == email:
-                    skip = True
-                    print('Already User: ' + email)
-                    break
-
-            if skip:
+            if m.has_user_email(email):
+                print('Already User: ' + email)
                 continue
 
             print('INVITING: ' + email)
@@ -8,6 +8,8 @@ import re
 import sys
 import os
 
+from functools import wraps
+
 
 from jinja2 import contextfunction
 from pkg_resources import resource_filename
@@ -15,7 +17,8 @@ from pkg_resources import resource_filename
 from six.moves.urllib.parse import urlsplit, urljoin, unquote
 
 from pywb.rewrite.templateview import JinjaEnv
-from webrecorder.utils import load_wr_config, init_logging
+from webrecorder.utils import load_wr_config, init_logging, get_bool
+from webrecorder.redisutils import CountingRedis
 
 from webrecorder.apiutils import CustomJSONEncoder
 from webrecorder.contentcontroller import ContentController
@@ -79,6 +82,11 @@ class AppController(BaseController):
         self.browser_redis = redis.StrictRedis.from_url(os.environ['REDIS_BROWSER_URL'], decode_responses=True)
         self.session_redis = redis.StrictRedis.from_url(os.environ['REDIS_SESSION_URL'])
 
+        # count redis round trips per request, to report calls per template render
+        if get_bool(config.get('template_redis_stats')):
+            self.redis = CountingRedis(self.redis, self.count_redis_call)
+            self.browser_redis = CountingRedis(self.browser_redis, self.count_redis_call)
+
         # Auto Upload on Init Id
         self.init_upload_id = config.get('init_upload_id')
         self.init_upload_user = config.get('init_upload_user')
@@ -150,6 +158,30 @@ class AppController(BaseController):
         jinja_env.globals['metadata'] = config.get('metadata', {})
         jinja_env.globals['static_path'] = 'static'
 
+        def memoized(name, func, *args):
+            """ Call func(*args) at most once per request, as globals are
+            often called many times in one render, eg. once per row
+            """
+            memo = self.get_template_memo()
+            if memo is None:
+                return func(*args)
+
+            key = (name,) + args
+            try:
+                return memo[key]
+            except KeyError:
+                pass
+
+            res = memo[key] = func(*args)
+            return res
+
+        def request_memo(func):
+            @wraps(func)
+            def memo_func(*args):
+                return memoized(func.__name__, func, *args)
+
+            return memo_func
+
         def get_coll(context):
             coll = context.get('coll_orig', '')
             if not coll:
@@ -162,12 +194,15 @@ class AppController(BaseController):
                 u = context.get('curr_user', '')
             return u
 
+        @request_memo
         def get_browsers():
             return self.browser_mgr.get_browsers()
 
+        @request_memo
         def get_tags():
             return self.manager.get_available_tags()
 
+        @request_memo
         def get_tags_in_collection(user, coll):
             return self.manager.get_tags_in_collection(user, coll)
 
@@ -177,6 +212,7 @@ class AppController(BaseController):
         def get_content_host():
             return self.content_host
 
+        @request_memo
         def get_num_collections():
             curr_user = self.manager.get_curr_user()
             count = self.manager.num_collections(curr_user) if curr_user else 0
@@ -185,39 +221,45 @@ class AppController(BaseController):
         def get_archives():
             return self.content_app.client_archives
 
+        @request_memo
         def is_beta():
             return self.manager.is_beta()
 
+        @request_memo
         def can_tag():
             return self.manager.can_tag()
 
+        @request_memo
         def is_public(user, coll):
             return self.manager.is_public(user, coll)
 
         @contextfunction
         def can_admin(context):
-            return self.manager.can_admin_coll(get_user(context), get_coll(context))
+            return memoized('can_admin', self.manager.can_admin_coll,
+                            get_user(context), get_coll(context))
 
         @contextfunction
         def is_owner(context):
-            return self.manager.is_owner(get_user(context))
+            return memoized('is_owner', self.manager.is_owner, get_user(context))
 
         @contextfunction
         def can_write(context):
-            res = self.manager.can_write_coll(get_user(context), get_coll(context))
-            return res
+            return memoized('can_write', self.manager.can_write_coll,
+                            get_user(context), get_coll(context))
 
         @contextfunction
         def can_read(context):
-            return self.manager.can_read_coll(get_user(context), get_coll(context))
+            return memoized('can_read', self.manager.can_read_coll,
+                            get_user(context), get_coll(context))
 
         @contextfunction
         def is_extractable(context):
-            return self.manager.is_extractable(get_user(context), get_coll(context))
+            return memoized('is_extractable', self.manager.is_extractable,
+                            get_user(context), get_coll(context))
 
         @contextfunction
         def is_anon(context):
-            return self.manager.is_anon(get_user(context))
+            return memoized('is_anon', self.manager.is_anon, get_user(context))
 
         def get_announce_list():
             announce_list = os.environ.get('ANNOUNCE_MAILING_LIST', False)
@@ -275,26 +317,41 @@ class AppController(BaseController):
                 url=url
             )
 
-        @contextfunction
-        def get_recs_for_coll(context):
-            user = context.get('user')
-            coll = get_coll(context)
+        def _get_recs_for_coll(user, coll):
             return [{'ts': r['timestamp'], 'url': r['url'], 'br': r.get('browser', '')}
                     for r in self.manager.list_coll_pages(user, coll)]
 
+        @contextfunction
+        def get_recs_for_coll(context):
+            return memoized('get_recs_for_coll', _get_recs_for_coll,
+                            context.get('user'), get_coll(context))
+
         @contextfunction
         def is_out_of_space(context):
-            return self.manager.is_out_of_space(context.get('curr_user', ''))
+            return memoized('is_out_of_space', self.manager.is_out_of_space,
+                            context.get('curr_user', ''))
 
         @contextfunction
         def is_tagged(context, bookmark_id):
             available = context.get('available_tags', [])
             tags = context.get('tags', [])
 
-            for tag in available:
-                if tag in tags and bookmark_id in tags[tag]:
-                    return True
-            return False
+            # tagged ids computed once for the tags of the current render
+            memo = self.get_template_memo()
+            cached = memo.get('is_tagged') if memo is not None else None
+
+            if cached and cached[0] is available and cached[1] is tags:
+                tagged = cached[2]
+            else:
+                tagged = set()
+                for tag in available:
+                    if tag in tags:
+                        tagged.update(tags[tag])
+
+                if memo is not None:
+                    memo['is_tagged'] = (available, tags, tagged)
+
+            return bookmark_id in tagged
 
         def trunc_url_expand(value):
             """ Truncate querystrings, appending an ellipses, expand on click
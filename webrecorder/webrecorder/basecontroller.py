@@ -5,10 +5,14 @@ from webrecorder.utils import sanitize_tag, sanitize_title, get_bool
 
 import re
 import os
+import logging
 
 
 # ============================================================================
 class BaseController(object):
+    TEMPLATE_MEMO_KEY = 'webrec.template_memo'
+    REDIS_CALLS_KEY = 'webrec.redis_calls'
+
     def __init__(self, app, jinja_env, manager, config):
         self.app = app
         self.jinja_env = jinja_env
@@ -19,6 +23,7 @@ class BaseController(object):
         self.content_host = os.environ['CONTENT_HOST']
         self.cache_template = config.get('cache_template')
         self.anon_disabled = get_bool(os.environ.get('ANON_DISABLED'))
+        self.template_redis_stats = get_bool(config.get('template_redis_stats'))
 
         self.init_routes()
 
@@ -158,13 +163,26 @@ class BaseController(object):
             def wrapper(*args, **kwargs):
                 resp = view_func(*args, **kwargs)
 
+                # view may have changed state, don't reuse any memoized results
+                self.clear_template_memo()
+
                 if isinstance(resp, dict):
                     ctx_params = request.environ.get('webrec.template_params')
                     if ctx_params:
                         resp.update(ctx_params)
 
                     template = self.jinja_env.jinja_env.get_or_select_template(template_name)
-                    return template.render(**resp)
+
+                    if not self.template_redis_stats:
+                        return template.render(**resp)
+
+                    start = request.environ.get(self.REDIS_CALLS_KEY, 0)
+                    result = template.render(**resp)
+                    count = request.environ.get(self.REDIS_CALLS_KEY, 0) - start
+
+                    request.environ['webrec.template_redis_calls'] = count
+                    logging.info('Template {0}: {1} redis calls'.format(template_name, count))
+                    return result
                 else:
                     return resp
 
@@ -172,6 +190,27 @@ class BaseController(object):
 
         return decorator
 
+    def get_template_memo(self):
+        """ Per-request cache for results of template globals
+        """
+        try:
+            return request.environ.setdefault(self.TEMPLATE_MEMO_KEY, {})
+        except RuntimeError:
+            # not in a request
+            return None
+
+    def clear_template_memo(self):
+        request.environ.pop(self.TEMPLATE_MEMO_KEY, None)
+
+    @classmethod
+    def count_redis_call(cls, name):
+        try:
+            environ = request.environ
+        except RuntimeError:
+            return
+
+        environ[cls.REDIS_CALLS_KEY] = environ.get(cls.REDIS_CALLS_KEY, 0) + 1
+
     def sanitize_tag(self, tag):
         return sanitize_tag(tag)
 
@@ -444,23 +444,7 @@ class ContentController(BaseController, RewriterApp):
         else:
             return 'patch-of-' + name
 
-    def handle_routing(self, wb_url, user, coll, rec, type,
-                       is_embed=False,
-                       is_display=False,
-                       sources='',
-                       inv_sources='',
-                       redir_route=None):
-
-        wb_url = self.add_query(wb_url)
-        if user == '_new' and redir_route:
-            return self.do_create_new_and_redir(coll, rec, wb_url, redir_route)
-
-        sesh = self.get_session()
-
-        if sesh.is_new() and self.is_content_request():
-            self.redir_set_session()
-
-        remote_ip = None
+    def _check_route_access(self, wb_url, user, coll, rec, type, remote_ip, inv_sources):
         frontend_cache_header = None
         patch_rec = ''
 
@@ -473,17 +457,16 @@ class ContentController(BaseController, RewriterApp):
                 # don't auto create recording for inner frame w/o accessing outer frame
                 raise HTTPError(404, 'No Such Recording')
 
-            elif not self.manager.is_recording_open(user, coll, rec):
+            self.manager.assert_can_write(user, coll)
+
+            # refreshes open recording ttl, only once write access is checked
+            if not self.manager.is_recording_open(user, coll, rec):
                 # force creation of new recording as this one is closed
                 raise HTTPError(404, 'Recording not open')
 
-            self.manager.assert_can_write(user, coll)
-
             if self.manager.is_out_of_space(user):
                 raise HTTPError(402, 'Out of Space')
 
-            remote_ip = self._get_remote_ip()
-
             if self.manager.is_rate_limited(user, remote_ip):
                 raise HTTPError(402, 'Rate Limit')
 
@@ -506,6 +489,43 @@ class ContentController(BaseController, RewriterApp):
             if not self.manager.has_recording(user, coll, rec):
                 raise HTTPError(404, 'No Such Recording')
 
+        return frontend_cache_header, patch_rec
+
+    def handle_routing(self, wb_url, user, coll, rec, type,
+                       is_embed=False,
+                       is_display=False,
+                       sources='',
+                       inv_sources='',
+                       redir_route=None):
+
+        wb_url = self.add_query(wb_url)
+        if user == '_new' and redir_route:
+            return self.do_create_new_and_redir(coll, rec, wb_url, redir_route)
+
+        sesh = self.get_session()
+
+        if sesh.is_new() and self.is_content_request():
+            self.redir_set_session()
+
+        remote_ip = None
+        frontend_cache_header = None
+        patch_rec = ''
+
+        if type != 'live':
+            if type in self.MODIFY_MODES:
+                remote_ip = self._get_remote_ip()
+
+            # prefetch state for all access checks in one round trip
+            with self.manager.access_context(user, coll,
+                                             rec=rec if type != 'replay-coll' else None,
+                                             ip=remote_ip,
+                                             check_open=type in self.MODIFY_MODES):
+
+                res = self._check_route_access(wb_url, user, coll, rec, type,
+                                               remote_ip, inv_sources)
+
+            frontend_cache_header, patch_rec = res
+
         request.environ['SCRIPT_NAME'] = quote(request.environ['SCRIPT_NAME'], safe='/:')
 
         wb_url = self._context_massage(wb_url)
@@ -0,0 +1,193 @@
+from har2warc.har2warc import HarParser
+from warcio.warcwriter import WARCWriter
+
+from tempfile import SpooledTemporaryFile
+
+import codecs
+import json
+import shutil
+
+
+BLOCK_SIZE = 16384 * 8
+
+
+# ============================================================================
+class JSONStreamReader(object):
+    """ Minimal incremental JSON reader over a binary stream, to iterate over
+    members of objects and items of arrays without loading the whole document.
+    Each value returned by read_value() is decoded in full
+    """
+    WHITESPACE = ' \t\n\r'
+    NUMBER_CHARS = '0123456789.eE+-'
+
+    def __init__(self, fh, chunk_size=65536):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+        self.buff = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+
+        buff = self.fh.read(size or self.chunk_size)
+        if not buff:
+            self.eof = True
+            self.buff = self.buff[self.pos:] + self.text_decoder.decode(b'', final=True)
+            self.pos = 0
+            return False
+
+        self.buff = self.buff[self.pos:] + self.text_decoder.decode(buff)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buff) and self.buff[self.pos] in self.WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buff):
+                return self.buff[self.pos]
+
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {0} at {1}'.format(char, self.pos))
+
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buff, self.pos)
+
+                # a number at end of buffer may continue in next chunk
+                if (self.eof or not isinstance(value, (int, float)) or
+                    (end < len(self.buff) and self.buff[end] not in self.NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+
+            except ValueError:
+                if self.eof:
+                    raise
+
+            # grow reads with the size of the pending value, to avoid
+            # re-decoding a large value for every chunk
+            self._fill(max(self.chunk_size, len(self.buff) - self.pos))
+
+    def iter_object(self):
+        """ Yield each key of an object, the caller must read the value
+        (with read_value(), iter_object() or iter_array()) before the next key
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self.expect(':')
+
+            yield key
+
+            if self.peek() == '}':
+                self.pos += 1
+                return
+
+            self.expect(',')
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.read_value()
+
+            if self.peek() == ']':
+                self.pos += 1
+                return
+
+            self.expect(',')
+
+
+# ============================================================================
+class StreamingHarParser(HarParser):
+    """ HarParser which reads the HAR incrementally, converting one entry of
+    log.entries at a time, so that memory use is bounded by the largest entry
+    rather than the whole HAR.
+
+    If entries come before the log fields needed for the warcinfo record,
+    converted entries are spooled to a temp file and copied after the warcinfo
+    """
+    WARCINFO_FIELDS = ('version', 'creator', 'pages')
+
+    def __init__(self, reader, writer, gzip=True):
+        super(StreamingHarParser, self).__init__({'log': {}}, writer, gzip=gzip)
+        self.reader = reader
+
+    def parse(self, out_filename=None, rec_title=None):
+        out_filename = out_filename or 'har.warc.gz'
+        rec_title = rec_title or 'HAR Recording'
+
+        log = self.har['log']
+        json_reader = JSONStreamReader(self.reader)
+
+        writer = self.writer
+        spool = None
+        info_written = False
+
+        try:
+            for key in json_reader.iter_object():
+                if key != 'log':
+                    json_reader.read_value()
+                    continue
+
+                for log_key in json_reader.iter_object():
+                    if log_key != 'entries':
+                        log[log_key] = json_reader.read_value()
+                        continue
+
+                    if info_written or spool:
+                        pass
+
+                    elif all(field in log for field in self.WARCINFO_FIELDS):
+                        self.write_har_warcinfo(log, out_filename, rec_title)
+                        info_written = True
+
+                    else:
+                        spool = SpooledTemporaryFile(max_size=BLOCK_SIZE)
+                        self.writer = WARCWriter(spool, gzip=writer.gzip)
+
+                    for entry in json_reader.iter_array():
+                        self.parse_entry(entry)
+
+            self.writer = writer
+
+            if not info_written:
+                self.write_har_warcinfo(log, out_filename, rec_title)
+
+            if spool:
+                spool.seek(0)
+                shutil.copyfileobj(spool, writer.out)
+
+        finally:
+            self.writer = writer
+            if spool:
+                spool.close()
+
+            if self.fh:
+                self.fh.close()
+
+    def write_har_warcinfo(self, log, out_filename, rec_title):
+        metadata = self.create_wr_metadata(log, rec_title)
+        self.write_warc_info(log, out_filename, metadata)
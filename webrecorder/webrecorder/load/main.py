@@ -13,9 +13,10 @@ from pywb.warcserver.warcserver import BaseWarcServer, init_index_source, regist
 from pywb.utils.wbexception import NotFoundException
 from pywb.utils.loaders import load_yaml_config
 
-from webrecorder.utils import load_wr_config, init_logging
+from webrecorder.utils import load_wr_config, init_logging, get_bool
 
 from webrecorder.load.wamsourceloader import WAMSourceLoader
+from webrecorder.load.tieredindex import TieredCDXJIndexSource
 
 import os
 import json
@@ -59,6 +60,12 @@ class WRWarcServer(object):
                                              redis_url=coll_url,
                                              redis=redis)
 
+        # committed recordings looked up in their index files, not reloaded into redis
+        if get_bool(config['cdxj_file_index']):
+            cache_dir = os.path.join(os.environ['RECORD_ROOT'], config['cdxj_file_cache_dir'])
+            rec_redis_source = TieredCDXJIndexSource(redis, config, cache_dir)
+            coll_redis_source = rec_redis_source
+
         live_rec = DefaultResourceHandler(
                         SimpleAggregator(
                             {'live': LiveIndexSource()},
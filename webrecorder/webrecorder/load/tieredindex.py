@@ -0,0 +1,188 @@
+from pywb.warcserver.index.indexsource import BaseIndexSource
+from pywb.warcserver.index.cdxobject import CDXObject
+
+from pywb.utils.binsearch import iter_range
+from pywb.utils.format import res_template
+from pywb.utils.loaders import load
+
+import os
+import mmap
+import base64
+import heapq
+import hashlib
+import logging
+
+
+# ============================================================================
+class TieredCDXJIndexSource(BaseIndexSource):
+    """ Index source for a single recording, or all recordings in a collection.
+    Recordings that still have a redis index are looked up in redis, committed
+    recordings are looked up by binary search over a memory map of their sorted
+    CDXJ index file, either local or downloaded once to a local cache, limited
+    to cdxj_file_cache_max_size with least recently used files removed first
+    """
+    def __init__(self, redis, config, cache_dir):
+        self.redis = redis
+
+        self.cdxj_key_templ = config['cdxj_key_templ']
+        self.warc_key_templ = config['warc_key_templ']
+        self.rec_list_key_templ = config['rec_list_key_templ']
+        self.info_index_key = config['info_index_key']
+        self.full_warc_prefix = config['full_warc_prefix']
+
+        self.cache_dir = cache_dir
+        self.cache_max_size = int(config['cdxj_file_cache_max_size'])
+
+    def load_index(self, params):
+        user = res_template('{user}', params)
+        coll = res_template('{coll}', params)
+        rec = res_template('{rec}', params)
+
+        if rec and rec != '*':
+            recs = [rec]
+        else:
+            rec_list_key = self.rec_list_key_templ.format(user=user, coll=coll)
+            recs = [rec.decode('utf-8') for rec in self.redis.smembers(rec_list_key)]
+
+        start = params['key']
+        end = params['end_key']
+
+        pi = self.redis.pipeline(transaction=False)
+        for rec in recs:
+            cdxj_key = self.cdxj_key_templ.format(user=user, coll=coll, rec=rec)
+            pi.exists(cdxj_key)
+            pi.zrangebylex(cdxj_key, b'[' + start, b'(' + end)
+            pi.hget(self.warc_key_templ.format(user=user, coll=coll, rec=rec),
+                    self.info_index_key)
+
+        res = pi.execute()
+
+        iters = []
+
+        for i in range(0, len(res), 3):
+            exists, cdxj_lines, index_url = res[i:i + 3]
+
+            if exists:
+                if cdxj_lines:
+                    iters.append(cdxj_lines)
+
+            elif index_url:
+                filename = self.get_local_index(index_url.decode('utf-8'))
+                if filename:
+                    iters.append(self.iter_file_range(filename, start, end))
+
+        def do_load(iters):
+            for line in heapq.merge(*iters):
+                yield CDXObject(line)
+
+        return do_load(iters)
+
+    def iter_file_range(self, filename, start, end):
+        with open(filename, 'rb') as fh:
+            # mmap fails for empty files
+            if not os.fstat(fh.fileno()).st_size:
+                return
+
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for line in iter_range(mm, start, end):
+                yield line
+        finally:
+            mm.close()
+
+    def get_local_index(self, index_url):
+        """ Return local path to committed index file, downloading remote
+        index to local cache, if needed
+        """
+        if index_url.startswith(self.full_warc_prefix):
+            filename = index_url[len(self.full_warc_prefix):]
+            if os.path.isfile(filename):
+                return filename
+
+        if not self.cache_dir:
+            return None
+
+        name = hashlib.sha1(index_url.encode('utf-8')).hexdigest() + '.cdxj'
+        filename = os.path.join(self.cache_dir, name)
+
+        if os.path.isfile(filename):
+            # mtime is last use, for eviction
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+
+            return filename
+
+        randstr = base64.b32encode(os.urandom(5)).decode('utf-8')
+        temp_filename = filename + '.' + randstr + '.tmp'
+
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError:
+            pass
+
+        try:
+            fh = load(index_url)
+            try:
+                with open(temp_filename, 'wb') as out:
+                    while True:
+                        buff = fh.read(65536)
+                        if not buff:
+                            break
+
+                        out.write(buff)
+            finally:
+                fh.close()
+
+            os.rename(temp_filename, filename)
+
+        except Exception as e:
+            logging.error('Could not cache index {0}: {1}'.format(index_url, e))
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+
+            return None
+
+        self.evict_cache(keep=filename)
+        return filename
+
+    def evict_cache(self, keep=None):
+        """ Remove least recently used cached index files, other than keep,
+        until total size is within cache_max_size
+        """
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.cdxj'):
+                continue
+
+            filename = os.path.join(self.cache_dir, name)
+            try:
+                res = os.stat(filename)
+            except OSError:
+                continue
+
+            entries.append((res.st_mtime, res.st_size, filename))
+            total += res.st_size
+
+        # oldest use first
+        for mtime, size, filename in sorted(entries):
+            if total <= self.cache_max_size:
+                break
+
+            if filename == keep:
+                continue
+
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+            total -= size
+
+    def __str__(self):
+        return 'redis'
+
@@ -1,9 +1,12 @@
 import re
 import yaml
 import os
+import json
+import logging
 
 from pywb.utils.loaders import load
 from contextlib import closing
+from functools import lru_cache
 
 
 # ============================================================================
@@ -12,8 +15,19 @@ class WAMLoader(object):
 
     STRIP_SCHEME = re.compile(r'https?://')
 
+    LOOKUP_CACHE_SIZE = 4096
+
+    REGISTRY_VERSION = '1'
+
+    # path -> (source key, [(pk, webarchive)]), shared by all loaders in process
+    _registry_cache = {}
+
     def __init__(self):
         self.replay_info = {}
+        self.prefix_rx = None
+        self.prefix_map = {}
+
+        self.find_archive_for_url = lru_cache(maxsize=self.LOOKUP_CACHE_SIZE)(self._find_archive_for_url)
 
         webarchives_path = self.merge_webarchives()
 
@@ -22,26 +36,119 @@ class WAMLoader(object):
         except IOError:
             print('No Archives Loaded')
 
-    def find_archive_for_url(self, url):
+    def _find_archive_for_url(self, url):
+        if not self.prefix_rx:
+            return None
+
         schemeless_url = self.STRIP_SCHEME.sub('', url)
+
+        m = self.prefix_rx.match(schemeless_url)
+        if not m:
+            return None
+
+        replay_prefix = m.group(0)
+        pk = self.prefix_map[replay_prefix]
+
+        orig_url = schemeless_url[len(replay_prefix):]
+        if self.replay_info[pk].get('parse_collection'):
+            coll, orig_url = orig_url.split('/', 1)
+            id_ = pk + ':' + coll
+        else:
+            id_ = pk
+
+        return pk, orig_url, id_
+
+    def compile_prefixes(self):
+        """ Build a single regex matching the longest known replay prefix,
+        and clear any cached lookups
+        """
+        self.prefix_map = {}
         for pk, info in self.replay_info.items():
-            if schemeless_url.startswith(info['replay_prefix']):
-                orig_url = schemeless_url[len(info['replay_prefix']):]
-                if info.get('parse_collection'):
-                    coll, orig_url = orig_url.split('/', 1)
-                    id_ = pk + ':' + coll
-                else:
-                    id_ = pk
+            self.prefix_map.setdefault(info['replay_prefix'], pk)
+
+        if self.prefix_map:
+            prefixes = sorted(self.prefix_map.keys(), key=len, reverse=True)
+            self.prefix_rx = re.compile('|'.join(re.escape(prefix) for prefix in prefixes))
+        else:
+            self.prefix_rx = None
 
-                return pk, orig_url, id_
+        self.find_archive_for_url.cache_clear()
 
     def load_all(self, webarchives_path):
+        for pk, webarchive in self.load_registry(webarchives_path):
+            self.load_archive(pk, webarchive)
+
+        self.compile_prefixes()
+
+    @classmethod
+    def load_registry(cls, webarchives_path):
+        """ Return list of (pk, webarchive) entries for the registry.
+
+        For a local registry file, the parsed entries are kept in a json
+        snapshot next to the yaml, keyed by the yaml's mtime and size, and
+        are shared by all loaders in the process, so that the yaml is only
+        parsed when it changes
+        """
+        if not os.path.isfile(webarchives_path):
+            return cls.parse_registry(webarchives_path)
+
+        res = os.stat(webarchives_path)
+        key = '{0}:{1}:{2}'.format(cls.REGISTRY_VERSION, res.st_mtime, res.st_size)
+
+        cached = cls._registry_cache.get(webarchives_path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        snapshot_path = os.path.splitext(webarchives_path)[0] + '.json'
+
+        entries = cls.load_snapshot(snapshot_path, key)
+        if entries is None:
+            entries = cls.parse_registry(webarchives_path)
+            cls.save_snapshot(snapshot_path, key, entries)
+
+        cls._registry_cache[webarchives_path] = (key, entries)
+        return entries
+
+    @classmethod
+    def parse_registry(cls, webarchives_path):
+        entries = []
+
         wa_file = load(webarchives_path)
         with closing(wa_file):
             for doc in yaml.load_all(wa_file):
                 webarchives = doc['webarchives']
-                for pk, webarchive in webarchives.items():
-                    self.load_archive(pk, webarchive)
+                entries.extend(webarchives.items())
+
+        return entries
+
+    @classmethod
+    def load_snapshot(cls, snapshot_path, key):
+        try:
+            with open(snapshot_path, 'rt') as fh:
+                snapshot = json.load(fh)
+
+        except (IOError, ValueError):
+            return None
+
+        if snapshot.get('key') != key:
+            return None
+
+        return [tuple(entry) for entry in snapshot['entries']]
+
+    @classmethod
+    def save_snapshot(cls, snapshot_path, key, entries):
+        temp_path = snapshot_path + '.' + str(os.getpid()) + '.tmp'
+
+        try:
+            with open(temp_path, 'wt') as fh:
+                json.dump({'key': key, 'entries': entries}, fh)
+
+            os.rename(temp_path, snapshot_path)
+
+        except Exception as e:
+            logging.debug('Web Archive Snapshot Save Failed: {0}'.format(e))
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
 
     def load_archive(self, pk, webarchive):
         if 'apis' not in webarchive:
@@ -5,10 +5,47 @@ from pywb.warcserver.index.indexsource import WBMementoIndexSource
 from webrecorder.load.wamloader import WAMLoader
 
 
+# ============================================================================
+class LazySourceDict(dict):
+    """ Dict of index sources, each created from its factory
+    on first access
+    """
+    def __init__(self):
+        super(LazySourceDict, self).__init__()
+        self.factories = {}
+
+    def add_factory(self, name, factory):
+        self.factories[name] = factory
+        super(LazySourceDict, self).__setitem__(name, None)
+
+    def __getitem__(self, name):
+        value = super(LazySourceDict, self).__getitem__(name)
+        if value is None and name in self.factories:
+            value = self.factories.pop(name)()
+            super(LazySourceDict, self).__setitem__(name, value)
+
+        return value
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+
+        return default
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
 # ============================================================================
 class WAMSourceLoader(WAMLoader):
     def __init__(self, memento_cls=None, remote_cls=None, wb_memento_cls=None):
-        self.sources = {}
+        self.sources = LazySourceDict()
 
         self.memento_cls = memento_cls or MementoIndexSource
         self.remote_cls = remote_cls or RemoteIndexSource
@@ -44,22 +81,21 @@ class WAMSourceLoader(WAMLoader):
         return True
 
     def add_source(self, replay, apis, pk, collection=''):
+        self.sources.add_factory(pk, lambda: self.create_source(replay, apis, collection))
+
+    def create_source(self, replay, apis, collection=''):
         replay = replay.replace('{collection}', collection)
-        source = None
 
         if 'memento' in apis:
             timegate = apis['memento']['timegate'].replace('{collection}', collection) + '{url}'
             timemap = apis['memento']['timemap'].replace('{collection}', collection) + '{url}'
-            source = self.memento_cls(timegate, timemap, replay)
+            return self.memento_cls(timegate, timemap, replay)
 
         elif 'cdx' in apis:
             query = apis['cdx']['query'].replace('{collection}', collection)
-            source = self.remote_cls(query, replay)
+            return self.remote_cls(query, replay)
 
         else:
-            source = self.wb_memento_cls(replay, '', replay)
-
-        if source:
-            self.sources[pk] = source
+            return self.wb_memento_cls(replay, '', replay)
 
 
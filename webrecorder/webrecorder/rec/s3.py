@@ -1,10 +1,18 @@
 import boto
+import os
+import math
+
+from boto.exception import S3ResponseError
+from boto.s3.multipart import MultiPartUpload
+
+from concurrent.futures import ThreadPoolExecutor
+
 from six.moves.urllib.parse import urlsplit, quote_plus
 
 
 ## ============================================================================
 class S3Storage(object):
-    def __init__(self, config):
+    def __init__(self, config, redis=None, upload_config=None):
         self.remote_url_templ = config['remote_url_templ']
 
         res = self._split_bucket_path(self.remote_url_templ)
@@ -12,6 +20,22 @@ class S3Storage(object):
 
         self.config = config
 
+        # multipart upload state is kept in redis, only enabled if available
+        self.redis = redis
+
+        upload_config = upload_config or {}
+
+        # storage profile may override default upload settings
+        def get_opt(name, default=0):
+            return int(config.get(name, upload_config.get(name, default)))
+
+        self.multipart_threshold = get_opt('multipart_threshold')
+        self.part_size = get_opt('part_size')
+        self.part_concurrency = get_opt('part_concurrency', 1)
+
+        self.part_state_templ = upload_config.get('part_state_templ')
+        self.part_state_secs = int(upload_config.get('part_state_secs', 0))
+
         self.conn = boto.connect_s3(aws_access_key_id=config.get('aws_access_key_id'),
                                     aws_secret_access_key=config.get('aws_secret_access_key'))
 
@@ -58,6 +82,9 @@ class S3Storage(object):
 
         s3_url = self._get_s3_url(remote_path)
 
+        if self._use_multipart(full_filename):
+            return self.upload_multipart(remote_path, full_filename, s3_url)
+
         try:
             new_key = self.bucket.new_key(remote_path)
             print('Uploading {0} -> {1}'.format(full_filename, s3_url))
@@ -70,6 +97,85 @@ class S3Storage(object):
 
         return True
 
+    def _use_multipart(self, full_filename):
+        if not self.redis or not self.part_state_templ:
+            return False
+
+        if not self.multipart_threshold or not self.part_size:
+            return False
+
+        return os.path.getsize(full_filename) >= self.multipart_threshold
+
+    def _resume_multipart(self, remote_path, upload_id):
+        mp = MultiPartUpload(self.bucket)
+        mp.key_name = remote_path
+        mp.id = upload_id
+        return mp
+
+    def upload_multipart(self, remote_path, full_filename, s3_url):
+        """ Upload file in parts, in parallel. Completed parts are recorded
+        in redis so that an interrupted upload resumes on the next attempt
+        """
+        state_key = self.part_state_templ.format(filename=full_filename)
+
+        state = self.redis.hgetall(state_key)
+        upload_id = state.pop('upload_id', None)
+
+        size = os.path.getsize(full_filename)
+        num_parts = int(math.ceil(size / float(self.part_size)))
+
+        try:
+            if upload_id:
+                mp = self._resume_multipart(remote_path, upload_id)
+                print('Resuming Upload {0} -> {1} ({2} of {3} parts done)'.format(
+                      full_filename, s3_url, len(state), num_parts))
+            else:
+                mp = self.bucket.initiate_multipart_upload(remote_path)
+                self.redis.hset(state_key, 'upload_id', mp.id)
+                print('Uploading {0} -> {1} ({2} parts)'.format(full_filename, s3_url, num_parts))
+
+            self.redis.expire(state_key, self.part_state_secs)
+
+            part_nums = [part_num for part_num in range(1, num_parts + 1)
+                         if str(part_num) not in state]
+
+            def upload_part(part_num):
+                self._upload_part(mp, state_key, full_filename, part_num, size)
+
+            with ThreadPoolExecutor(max_workers=max(self.part_concurrency, 1)) as executor:
+                # list() to raise first part error, if any
+                list(executor.map(upload_part, part_nums))
+
+            mp.complete_upload()
+
+        except S3ResponseError as e:
+            print(e)
+            print('Failed to Upload to {0}'.format(s3_url))
+
+            # upload expired or aborted remotely, start over next time
+            if e.error_code == 'NoSuchUpload':
+                self.redis.delete(state_key)
+
+            return False
+
+        except Exception as e:
+            print(e)
+            print('Failed to Upload to {0}'.format(s3_url))
+            return False
+
+        self.redis.delete(state_key)
+        return True
+
+    def _upload_part(self, mp, state_key, full_filename, part_num, size):
+        offset = (part_num - 1) * self.part_size
+        length = min(self.part_size, size - offset)
+
+        with open(full_filename, 'rb') as fh:
+            fh.seek(offset)
+            key = mp.upload_part_from_file(fh, part_num, size=length)
+
+        self.redis.hset(state_key, part_num, key.etag)
+
     def delete(self, delete_list):
         path_list = []
 
@@ -1,12 +1,23 @@
 import os
 import redis
 import base64
+import time
+import threading
+import traceback
+
+from six.moves.queue import PriorityQueue
 
 from warcio.timeutils import sec_to_timestamp, timestamp_now
 
+from webrecorder.utils import iter_zset_lex
+from webrecorder.redisutils import LOCK_SCRIPTS
+
 
 # ============================================================================
 class StorageCommitter(object):
+    # max cdxj lines loaded from redis at a time when writing index file
+    CDXJ_PAGE_SIZE = 10000
+
     def __init__(self, config):
         super(StorageCommitter, self).__init__()
 
@@ -37,8 +48,29 @@ class StorageCommitter(object):
 
         self.temp_prefix = config['temp_prefix']
 
+        self.upload_config = {'multipart_threshold': config['s3_multipart_threshold'],
+                              'part_size': config['s3_part_size'],
+                              'part_concurrency': config['s3_part_concurrency'],
+                              'part_state_templ': config['s3_part_state_templ'],
+                              'part_state_secs': config['s3_part_state_secs'],
+                             }
+
+        # storage instances by profile name, and profile name by collection
+        self.storage_cache = {}
+        self.coll_storage_cache = {}
+        self.storage_lock = threading.Lock()
+        self.storage_cache_secs = int(config['storage_cache_secs'])
+
+        self.commit_lock_secs = int(config['commit_lock_secs'])
+        self.commit_stats_key = config['commit_stats_key']
+
+        self.lock_scripts = dict((name, self.redis.register_script(script))
+                                 for name, script in LOCK_SCRIPTS.items())
+
         self._init_storage()
 
+        self.scheduler = CommitScheduler(self, int(config['commit_concurrency']))
+
         print('Storage Committer Root: ' + self.record_root_dir)
 
     def _init_storage(self):
@@ -79,10 +111,15 @@ class StorageCommitter(object):
 
         commit_wait = self.commit_wait_templ.format(filename=full_filename)
 
-        if self.redis.get(commit_wait) != b'1':
+        if self.redis.get(commit_wait) != '1':
+            start = time.time()
+
             if not storage.upload_file(user, coll, rec, filename, full_filename, obj_type):
                 return False
 
+            self.scheduler.add_upload(os.path.getsize(full_filename),
+                                      time.time() - start)
+
             self.redis.setex(commit_wait, self.commit_wait_secs, 1)
 
         # already uploaded, see if it is accessible
@@ -114,11 +151,19 @@ class StorageCommitter(object):
 
         full_filename = os.path.join(dirname, cdxj_filename)
 
-        cdxj_list = self.redis.zrange(cdxj_key, 0, -1)
+        # write to temp file, rename into place when complete
+        temp_filename = full_filename + '.tmp'
+
+        try:
+            with open(temp_filename, 'wt') as fh:
+                for cdxj in iter_zset_lex(self.redis, cdxj_key, self.CDXJ_PAGE_SIZE):
+                    fh.write(cdxj + '\n')
 
-        with open(full_filename, 'wt') as fh:
-            for cdxj in cdxj_list:
-                fh.write(cdxj + '\n')
+            os.rename(temp_filename, full_filename)
+        except:
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+            raise
 
         full_url = self.full_warc_prefix + full_filename.replace(os.path.sep, '/')
 
@@ -135,12 +180,74 @@ class StorageCommitter(object):
             pass
 
     def __call__(self):
-        for cdxj_key in self.redis.scan_iter(self.cdxj_key):
-            self.process_cdxj_key(cdxj_key)
+        self.prune_storage_cache()
+
+        self.scheduler.schedule(self.get_closed_recordings())
+
+        self.scheduler.save_stats(self.redis, self.commit_stats_key)
 
         self.redis.publish('close_idle', '')
 
-    def process_cdxj_key(self, cdxj_key):
+    def stop(self):
+        self.scheduler.stop()
+
+    def get_closed_recordings(self):
+        """ Return (closed_at, cdxj_key) for all recordings that are no
+        longer open, oldest first
+        """
+        cdxj_keys = list(self.redis.scan_iter(self.cdxj_key))
+
+        pi = self.redis.pipeline(transaction=False)
+        for cdxj_key in cdxj_keys:
+            base_key = cdxj_key.rsplit(':cdxj', 1)[0]
+            pi.exists(base_key + ':open')
+            pi.hget(base_key + ':info', 'updated_at')
+
+        res = pi.execute()
+
+        closed = []
+
+        for i, cdxj_key in enumerate(cdxj_keys):
+            if res[i * 2]:
+                continue
+
+            try:
+                closed_at = int(res[i * 2 + 1])
+            except:
+                closed_at = 0
+
+            closed.append((closed_at, cdxj_key))
+
+        closed.sort()
+        return closed
+
+    def commit_recording(self, cdxj_key):
+        """ Commit recording, holding a per-recording token lock so that only
+        one committer works on a given recording at a time. The lock lease
+        is renewed in the background while files are uploaded
+        """
+        lock_key = cdxj_key + ':commit_lock'
+        token = base64.b32encode(os.urandom(10)).decode('utf-8')
+
+        if not self.redis.set(lock_key, token, ex=self.commit_lock_secs, nx=True):
+            return False
+
+        lease = CommitLease(self, lock_key, token)
+        lease.start()
+
+        try:
+            self.process_cdxj_key(cdxj_key, lease)
+        finally:
+            lease.stop()
+            self.lock_scripts['release'](keys=[lock_key], args=[token])
+
+        return True
+
+    def renew_commit_lock(self, lock_key, token):
+        return bool(self.lock_scripts['renew'](keys=[lock_key],
+                                               args=[token, self.commit_lock_secs]))
+
+    def process_cdxj_key(self, cdxj_key, lease=None):
         base_key = cdxj_key.rsplit(':cdxj', 1)[0]
         if self.redis.exists(base_key + ':open'):
             return
@@ -168,6 +275,10 @@ class StorageCommitter(object):
                                     cdxj_filename, self.info_index_key)
 
         for warc_filename in warcs.keys():
+            if lease and lease.lost:
+                print('Commit Lock Lost: ' + cdxj_key)
+                return
+
             value = warcs[warc_filename]
             done = self.commit_file(user, coll, rec, user_dir,
                                     warc_filename, 'warcs', warc_key,
@@ -175,6 +286,10 @@ class StorageCommitter(object):
 
             all_done = all_done and done
 
+        if lease and lease.lost:
+            print('Commit Lock Lost: ' + cdxj_key)
+            return
+
         if all_done:
             print('Deleting Redis Key: ' + cdxj_key)
             self.redis.delete(cdxj_key)
@@ -196,7 +311,33 @@ class StorageCommitter(object):
 
         info_key = self.info_key_templ['coll'].format(user=user, coll=coll)
 
-        storage_type = self.redis.hget(info_key, 'storage_type')
+        now = time.time()
+
+        with self.storage_lock:
+            entry = self.coll_storage_cache.get(info_key)
+
+        if entry and now - entry[1] < self.storage_cache_secs:
+            storage_type = entry[0]
+        else:
+            storage_type = self.redis.hget(info_key, 'storage_type')
+
+            with self.storage_lock:
+                self.coll_storage_cache[info_key] = (storage_type, now)
+
+        return self.get_profile_storage(storage_type or '')
+
+    def get_profile_storage(self, storage_type):
+        """ Return storage for named profile, or default profile if no name.
+        Storage instances, and their connections, are reused until the profile
+        changes. Profiles are rechecked every storage_cache_secs
+        """
+        now = time.time()
+
+        with self.storage_lock:
+            entry = self.storage_cache.get(storage_type)
+
+        if entry and now - entry[2] < self.storage_cache_secs:
+            return entry[0]
 
         config = None
 
@@ -208,6 +349,25 @@ class StorageCommitter(object):
         if not config:
             config = self.default_storage_profile
 
+        # profile unchanged, keep existing storage
+        if entry and entry[1] == config:
+            storage = entry[0]
+        else:
+            # may connect to remote storage, so not created while holding lock
+            storage = self.create_storage(config)
+
+        with self.storage_lock:
+            curr = self.storage_cache.get(storage_type)
+
+            # storage for same profile added meanwhile by another thread, use that one
+            if curr and curr[1] == config:
+                storage = curr[0]
+
+            self.storage_cache[storage_type] = (storage, config, now)
+
+        return storage
+
+    def create_storage(self, config):
         # storage profile class stored in profile 'type'
         storage_class = self.storage_class_map.get(config['type'])
 
@@ -215,12 +375,151 @@ class StorageCommitter(object):
         if not storage_class:
             return None
 
-        return storage_class(config)
+        return storage_class(config, self.redis, self.upload_config)
+
+    def prune_storage_cache(self):
+        now = time.time()
+
+        with self.storage_lock:
+            for info_key, entry in list(self.coll_storage_cache.items()):
+                if now - entry[1] >= self.storage_cache_secs:
+                    del self.coll_storage_cache[info_key]
 
     def add_storage_class(self, type_, cls):
         self.storage_class_map[type_] = cls
 
 
+# =============================================================================
+class CommitLease(threading.Thread):
+    """ Renew commit lock lease while a recording is being committed,
+    marking it as lost if the lock is no longer held with the token
+    """
+    def __init__(self, committer, lock_key, token):
+        super(CommitLease, self).__init__(name='lease-' + lock_key)
+        self.daemon = True
+
+        self.committer = committer
+        self.lock_key = lock_key
+        self.token = token
+
+        self.interval = committer.commit_lock_secs / 3.0
+
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.committer.renew_commit_lock(self.lock_key, self.token):
+                self.lost = True
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# =============================================================================
+class CommitScheduler(object):
+    """ Bounded pool of commit threads, fed oldest-closed recordings first
+    from the committer's periodic scan
+    """
+    def __init__(self, committer, concurrency):
+        self.committer = committer
+        self.concurrency = max(concurrency, 1)
+
+        self.queue = PriorityQueue()
+
+        # cdxj keys currently queued or being committed
+        self.pending = set()
+
+        self.lock = threading.Lock()
+
+        self.active = 0
+        self.committed = 0
+        self.failed = 0
+
+        self.upload_bytes = 0
+        self.upload_secs = 0.0
+
+        self.threads = []
+
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self.run, name='commit-' + str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def schedule(self, closed_list):
+        for closed_at, cdxj_key in closed_list:
+            with self.lock:
+                if cdxj_key in self.pending:
+                    continue
+
+                self.pending.add(cdxj_key)
+
+            self.queue.put((closed_at, cdxj_key))
+
+    def run(self):
+        while True:
+            closed_at, cdxj_key = self.queue.get()
+
+            # stop sentinel
+            if not cdxj_key:
+                break
+
+            with self.lock:
+                self.active += 1
+
+            try:
+                if self.committer.commit_recording(cdxj_key):
+                    with self.lock:
+                        self.committed += 1
+
+            except:
+                traceback.print_exc()
+                with self.lock:
+                    self.failed += 1
+
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.pending.discard(cdxj_key)
+
+    def stop(self):
+        # sort after any queued recordings
+        for thread in self.threads:
+            self.queue.put((float('inf'), ''))
+
+    def add_upload(self, size, elapsed):
+        with self.lock:
+            self.upload_bytes += size
+            self.upload_secs += elapsed
+
+    def get_stats(self):
+        with self.lock:
+            stats = {'queue_depth': len(self.pending) - self.active,
+                     'active': self.active,
+                     'committed': self.committed,
+                     'failed': self.failed,
+                     'upload_bytes': self.upload_bytes,
+                     'upload_secs': round(self.upload_secs, 3),
+                    }
+
+        if self.upload_secs:
+            stats['upload_bytes_per_sec'] = int(self.upload_bytes / self.upload_secs)
+        else:
+            stats['upload_bytes_per_sec'] = 0
+
+        return stats
+
+    def save_stats(self, redis_obj, stats_key):
+        stats = self.get_stats()
+        redis_obj.hmset(stats_key, stats)
+
+        if stats['queue_depth'] or stats['active']:
+            print('Commit Queue: {queue_depth} queued, {active} active, {upload_bytes_per_sec} bytes/sec'.format(**stats))
+
+
 # =============================================================================
 if __name__ == "__main__":
     from webrecorder.rec.worker import Worker
@@ -8,16 +8,21 @@ from pywb.recorder.filters import WriteRevisitDupePolicy, SkipDupePolicy
 from pywb.recorder.filters import ExcludeHttpOnlyCookieHeaders
 from pywb.recorder.filters import SkipRangeRequestFilter, SkipDefaultFilter
 
-from pywb.indexer.cdxindexer import BaseCDXWriter, CDXJ
+from pywb.indexer.cdxindexer import BaseCDXWriter, CDXJ, write_cdx_index
 
 from pywb.utils.format import res_template
 from pywb.utils.io import BUFF_SIZE
+from pywb.utils.loaders import load
 
-from webrecorder.utils import SizeTrackingReader, redis_pipeline
+from webrecorder.utils import SizeTrackingReader, UploadProgressTracker
+from webrecorder.utils import BatchedHashCounter, redis_pipeline
+from webrecorder.utils import iter_zset_lex, get_bool
 
 from webrecorder.load.wamloader import WAMLoader
 
 import redis
+from redis.exceptions import NoScriptError
+
 import time
 import json
 import glob
@@ -27,6 +32,7 @@ import logging
 
 from bottle import Bottle, request, debug
 from datetime import datetime
+from io import BytesIO
 import os
 from six import iteritems
 from six.moves.urllib.parse import quote
@@ -34,6 +40,9 @@ from six.moves.urllib.parse import quote
 
 # ============================================================================
 class WebRecRecorder(object):
+    # cdxj lines per pipeline when updating collection index
+    COLL_INDEX_BATCH_SIZE = 10000
+
     def __init__(self, config=None):
         self.upstream_url = os.environ['WARCSERVER_HOST']
 
@@ -44,6 +53,11 @@ class WebRecRecorder(object):
 
         self.cdxj_key_templ = config['cdxj_key_templ']
 
+        self.coll_cdxj_key_templ = config['coll_cdxj_key_templ']
+        self.coll_cdxj_incremental = get_bool(config['coll_cdxj_incremental'])
+        self.coll_cdxj_access_key = config['coll_cdxj_access_key']
+        self.info_index_key = config['info_index_key']
+
         self.info_keys = config['info_key_templ']
 
         self.coll_list_key_templ = config['coll_list_key_templ']
@@ -57,10 +71,16 @@ class WebRecRecorder(object):
 
         self.full_warc_prefix = config['full_warc_prefix']
 
+        self.pending_flush_size = int(config['pending_size_flush_bytes'])
+        self.pending_flush_secs = float(config['pending_size_flush_secs'])
+
         self.name = config['recorder_name']
 
         self.del_templ = config['del_templ']
 
+        self.tag_index_key_templ = config['tag_index_key_templ']
+        self.coll_tags_key_templ = config['coll_tags_key_templ']
+
         self.accept_colls = config['recorder_accept_colls']
 
         self.config = config
@@ -131,7 +151,9 @@ class WebRecRecorder(object):
 
     def create_buffer(self, params, name):
         info_key = res_template(self.info_keys['rec'], params)
-        return TempWriteBuffer(self.redis, info_key, name, params['url'])
+        return TempWriteBuffer(self.redis, info_key, name, params['url'],
+                               flush_size=self.pending_flush_size,
+                               flush_secs=self.pending_flush_secs)
 
     def get_profile(self, scheme, profile):
         res = self.redis.hgetall('st:' + profile)
@@ -174,9 +196,11 @@ class WebRecRecorder(object):
                     continue
 
                 if item['channel'] == b'delete':
+                    self.recorder.writer.admission_cache.invalidate()
                     self.handle_delete_local(item['data'].decode('utf-8'))
 
                 elif item['channel'] == b'rename':
+                    self.recorder.writer.admission_cache.invalidate()
                     self.handle_rename_local(item['data'].decode('utf-8'))
 
                 elif item['channel'] == b'close_idle':
@@ -254,6 +278,22 @@ class WebRecRecorder(object):
 
         the_size = int(self.redis.hget(info_key, 'size'))
 
+        # last access of renamed collection indexes, to move with the index
+        access_moves = []
+        if self.coll_cdxj_incremental and to_rec == '*':
+            for from_key, to_key in iteritems(moves):
+                if self._is_coll_cdxj_key(from_key):
+                    score = self.redis.zscore(self.coll_cdxj_access_key, from_key)
+                    access_moves.append((from_key, to_key, score))
+
+        # move recording's entries between collection indexes, if maintained
+        if (self.coll_cdxj_incremental and to_rec != '*' and
+            (from_user != to_user or from_coll != to_coll)):
+
+            self._update_coll_index(from_user, from_coll, from_rec, remove=True)
+            self._update_coll_index(from_user, from_coll, from_rec, remove=False,
+                                    to_user=to_user, to_coll=to_coll)
+
         with redis_pipeline(self.redis) as pi:
             # Fix Id
             pi.hset(info_key, 'id', to_id)
@@ -287,6 +327,15 @@ class WebRecRecorder(object):
                 pi.srem(from_rec_list_key, from_rec)
                 pi.sadd(to_rec_list_key, to_rec)
 
+            # update tag indexes for moved tag keys
+            for from_key, to_key in iteritems(moves):
+                self._move_tag_index(pi, from_key, to_key)
+
+            for from_key, to_key, score in access_moves:
+                pi.zrem(self.coll_cdxj_access_key, from_key)
+                if score is not None:
+                    pi.zadd(self.coll_cdxj_access_key, score, to_key)
+
             # check if usage stats need updating
             if (from_user.startswith(self.temp_prefix) and not
                 to_user.startswith(self.temp_prefix)):
@@ -421,6 +470,10 @@ class WebRecRecorder(object):
         else:
             length = 0
 
+        # remove recording's entries from the collection index, if maintained
+        if type == 'rec' and self.coll_cdxj_incremental:
+            self._update_coll_index(user, coll, rec, remove=True)
+
         with redis_pipeline(self.redis) as pi:
             if type == 'coll':
                 coll_list_key = self.coll_list_key_templ.format(user=user)
@@ -439,7 +492,117 @@ class WebRecRecorder(object):
                     pi.hincrby(coll_key, 'size', -length)
 
             for key in keys_to_del:
+                key = key.decode('utf-8')
                 pi.delete(key)
+                self._move_tag_index(pi, key)
+
+                if self.coll_cdxj_incremental and self._is_coll_cdxj_key(key):
+                    pi.zrem(self.coll_cdxj_access_key, key)
+
+    def _is_coll_cdxj_key(self, key):
+        parts = key.split(':')
+        return len(parts) == 4 and parts[0] == 'c' and parts[3] == 'cdxj'
+
+    def _parse_tag_key(self, key):
+        """ Return (user, coll, tag) for a recording tag key, or None
+        """
+        parts = key.split(':')
+        if len(parts) != 6 or parts[0] != 'r' or parts[4] != 'tag':
+            return None
+
+        return parts[1], parts[2], parts[5]
+
+    def _move_tag_index(self, pi, from_key, to_key=None):
+        """ Remove tag key from tag and collection tag indexes,
+        replacing with to_key if tag key was renamed
+        """
+        parsed = self._parse_tag_key(from_key)
+        if not parsed:
+            return
+
+        from_user, from_coll, tag = parsed
+
+        tag_index_key = self.tag_index_key_templ.format(tag=tag)
+        from_coll_key = self.coll_tags_key_templ.format(user=from_user, coll=from_coll)
+
+        pi.srem(tag_index_key, from_key)
+        pi.srem(from_coll_key, from_key)
+
+        if not to_key:
+            return
+
+        to_user, to_coll, _ = self._parse_tag_key(to_key)
+        to_coll_key = self.coll_tags_key_templ.format(user=to_user, coll=to_coll)
+
+        # collection tag index may itself have been renamed with collection
+        pi.srem(to_coll_key, from_key)
+
+        pi.sadd(tag_index_key, to_key)
+        pi.sadd(to_coll_key, to_key)
+
+    def _iter_rec_cdxj(self, user, coll, rec):
+        """ Iterate over all cdxj lines for a recording, from redis if not
+        yet committed, otherwise from the committed index file
+        """
+        cdxj_key = self.cdxj_key_templ.format(user=user, coll=coll, rec=rec)
+
+        if self.redis.exists(cdxj_key):
+            for cdxj_line in iter_zset_lex(self.redis, cdxj_key, self.COLL_INDEX_BATCH_SIZE):
+                yield cdxj_line
+            return
+
+        warc_key = self.warc_key_templ.format(user=user, coll=coll, rec=rec)
+        cdxj_filename = self.redis.hget(warc_key, self.info_index_key)
+        if not cdxj_filename:
+            return
+
+        fh = load(cdxj_filename.decode('utf-8'))
+        try:
+            while True:
+                cdxj_line = fh.readline()
+                if not cdxj_line:
+                    break
+
+                cdxj_line = cdxj_line.rstrip()
+                if cdxj_line:
+                    yield cdxj_line
+        finally:
+            fh.close()
+
+    def _update_coll_index(self, user, coll, rec, remove, to_user=None, to_coll=None):
+        """ Remove recording's cdxj lines from, or add them to, the
+        collection index for to_user/to_coll. Only updates an existing index
+        """
+        coll_cdxj_key = self.coll_cdxj_key_templ.format(user=to_user or user,
+                                                        coll=to_coll or coll)
+
+        if not self.redis.exists(coll_cdxj_key):
+            return
+
+        def update(batch):
+            with redis_pipeline(self.redis) as pi:
+                if remove:
+                    pi.zrem(coll_cdxj_key, *batch)
+                else:
+                    for cdxj_line in batch:
+                        pi.zadd(coll_cdxj_key, 0, cdxj_line)
+
+        batch = []
+
+        try:
+            for cdxj_line in self._iter_rec_cdxj(user, coll, rec):
+                batch.append(cdxj_line)
+                if len(batch) >= self.COLL_INDEX_BATCH_SIZE:
+                    update(batch)
+                    batch = []
+
+            if batch:
+                update(batch)
+
+        except Exception as e:
+            # fall back to full rebuild on next access
+            print('Error updating collection index, removing: ' + str(e))
+            self.redis.delete(coll_cdxj_key, coll_cdxj_key + ':ready')
 
     def handle_delete_local(self, data):
         data = json.loads(data)
@@ -519,6 +682,17 @@ class CDXJIndexer(CDXJ, BaseCDXWriter):
 
 # ============================================================================
 class WebRecRedisIndexer(WritableRedisIndexer):
+    # add cdx lines (ARGV) to the collection replay index (KEYS[1]) only if it exists
+    COLL_ADD_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    for i = 1, #ARGV do
+        redis.call('zadd', KEYS[1], 0, ARGV[i])
+    end
+    return #ARGV
+end
+return 0
+"""
+
     def __init__(self, *args, **kwargs):
         super(WebRecRedisIndexer, self).__init__(*args, **kwargs)
 
@@ -539,11 +713,21 @@ class WebRecRedisIndexer(WritableRedisIndexer):
 
         self.coll_cdxj_key = config['coll_cdxj_key_templ']
 
+        self.coll_add_sha = self._load_script(self.COLL_ADD_IF_EXISTS)
+
         self.wam_loader = WAMLoader()
 
         # set shared wam_loader for CDXJIndexer index writers
         CDXJIndexer.wam_loader = self.wam_loader
 
+    def _load_script(self, script):
+        try:
+            return self.redis.script_load(script)
+        except Exception as e:
+            # eg. fakeredis, fall back to non-scripted updates
+            logging.debug('Lua scripting not available: ' + str(e))
+            return None
+
     def get_rate_limit_key(self, params):
         if not self.rate_limit_key or not self.rate_limit_ttl:
             return None
@@ -559,49 +743,87 @@ class WebRecRedisIndexer(WritableRedisIndexer):
     def add_urls_to_index(self, stream, params, filename, length):
         upload_key = params.get('param.upid')
         if upload_key:
-            stream = SizeTrackingReader(stream, length, self.redis, upload_key)
+            # reuse the tracker from write_stream_to_file(), if any
+            stream = SizeTrackingReader(stream, length, self.redis, upload_key,
+                                        tracker=params.get('upload_tracker'))
+
+        base_filename = self._get_rel_or_base_name(filename, params)
+
+        cdxout = BytesIO()
+        write_cdx_index(cdxout, stream, base_filename,
+                        cdxj=True, append_post=True,
+                        writer_cls=CDXJIndexer)
+
+        if upload_key:
+            stream.tracker.flush()
+
+        cdx_list = cdxout.getvalue().rstrip().split(b'\n')
 
-        params['writer_cls'] = CDXJIndexer
+        self.update_indexes(cdx_list, params, length)
 
-        cdx_list = (super(WebRecRedisIndexer, self).
-                      add_urls_to_index(stream, params, filename, length))
+        return cdx_list
 
+    def update_indexes(self, cdx_list, params, length):
+        """ Write new cdx lines to the recording index, and to the collection
+        replay index if it exists, along with size, usage and rate limit
+        counters, in a single pipeline
+        """
+        cdx_lines = [cdx for cdx in cdx_list if cdx]
 
-        # if replay key exists, add to it as well!
+        rec_cdxj_key = res_template(self.redis_key_template, params)
         coll_cdxj_key = res_template(self.coll_cdxj_key, params)
-        if self.redis.exists(coll_cdxj_key):
-            for cdx in cdx_list:
-                if cdx:
-                    self.redis.zadd(coll_cdxj_key, 0, cdx)
+
+        # no scripting support, check if replay key exists first
+        add_to_coll = False
+        if cdx_lines and not self.coll_add_sha:
+            add_to_coll = self.redis.exists(coll_cdxj_key)
 
         ts = datetime.now().date().isoformat()
         ts_sec = str(int(time.time()))
 
-        with redis_pipeline(self.redis) as pi:
-            for key_templ in self.size_keys:
-                key = res_template(key_templ, params)
-                pi.hincrby(key, 'size', length)
+        try:
+            with redis_pipeline(self.redis) as pi:
+                for cdx in cdx_lines:
+                    pi.zadd(rec_cdxj_key, 0, cdx)
 
-                if key_templ == self.rec_info_key_templ and cdx_list:
-                    pi.hset(key, 'updated_at', ts_sec)
+                # if replay key exists, add to it as well!
+                if cdx_lines and self.coll_add_sha:
+                    pi.evalsha(self.coll_add_sha, 1, coll_cdxj_key, *cdx_lines)
 
-            # write size to usage hashes
-            if 'param.user' in params:
-                if params['param.user'].startswith(self.temp_prefix):
-                    key = self.temp_usage_key
-                else:
-                    key = self.user_usage_key
+                elif add_to_coll:
+                    for cdx in cdx_lines:
+                        pi.zadd(coll_cdxj_key, 0, cdx)
 
-                # rate limiting
-                rate_limit_key = self.get_rate_limit_key(params)
-                if rate_limit_key:
-                    pi.incrby(rate_limit_key, length)
-                    pi.expire(rate_limit_key, self.rate_limit_ttl)
+                self._add_size_updates(pi, params, length, bool(cdx_lines), ts, ts_sec)
 
-                if key:
-                    pi.hincrby(key, ts, length)
+        except NoScriptError:
+            # script cache flushed, other commands have already been applied
+            self.coll_add_sha = self.redis.script_load(self.COLL_ADD_IF_EXISTS)
+            self.redis.evalsha(self.coll_add_sha, 1, coll_cdxj_key, *cdx_lines)
 
-        return cdx_list
+    def _add_size_updates(self, pi, params, length, has_cdx, ts, ts_sec):
+        for key_templ in self.size_keys:
+            key = res_template(key_templ, params)
+            pi.hincrby(key, 'size', length)
+
+            if key_templ == self.rec_info_key_templ and has_cdx:
+                pi.hset(key, 'updated_at', ts_sec)
+
+        # write size to usage hashes
+        if 'param.user' in params:
+            if params['param.user'].startswith(self.temp_prefix):
+                key = self.temp_usage_key
+            else:
+                key = self.user_usage_key
+
+            # rate limiting
+            rate_limit_key = self.get_rate_limit_key(params)
+            if rate_limit_key:
+                pi.incrby(rate_limit_key, length)
+                pi.expire(rate_limit_key, self.rate_limit_ttl)
+
+            if key:
+                pi.hincrby(key, ts, length)
 
 
 # ============================================================================
@@ -624,7 +846,15 @@ class SkipCheckingMultiFileWARCWriter(MultiFileWARCWriter):
 
         self.user_key = config['info_key_templ']['user']
 
+        # never skip a refresh for longer than the open key would survive
+        admission_ttl = min(float(config['write_admission_ttl']), self.open_rec_ttl / 2.0)
+        self.admission_cache = WriteAdmissionCache(admission_ttl)
+
     def is_rec_open(self, params):
+        rec_key = self.get_dir_key(params)
+        if self.admission_cache.is_open(rec_key):
+            return True
+
         open_key = res_template(self.open_rec_key, params)
 
         # update ttl for open recroding key, if it exists
@@ -634,10 +864,57 @@ class SkipCheckingMultiFileWARCWriter(MultiFileWARCWriter):
             logging.debug('Writing skipped, recording not open for write: ' + open_key)
             return False
 
+        self.admission_cache.set_open(rec_key)
         return True
 
+    def _get_admission(self, params, skip_key=None):
+        """ Check recording is open, refreshing the open key ttl only if the
+        cached open state is stale, and load the user size and quota (and
+        skip_key, if any) in the same pipeline
+        """
+        rec_key = self.get_dir_key(params)
+        is_open = self.admission_cache.is_open(rec_key)
+
+        open_key = res_template(self.open_rec_key, params)
+        user_key = res_template(self.user_key, params)
+
+        pi = self.redis.pipeline(transaction=False)
+        if not is_open:
+            pi.expire(open_key, self.open_rec_ttl)
+
+        pi.hmget(user_key, ['size', 'max_size'])
+
+        if skip_key:
+            pi.get(skip_key)
+
+        res = pi.execute()
+
+        if not is_open:
+            is_open = bool(res.pop(0))
+            if is_open:
+                self.admission_cache.set_open(rec_key)
+            else:
+                logging.debug('Writing skipped, recording not open for write: ' + open_key)
+
+        size, max_size = res[0]
+
+        return {'open': is_open,
+                'size': int(size or 0),
+                'max_size': int(max_size or 0),
+                'skip': res[1] if skip_key else None}
+
+    def close_key(self, dir_key):
+        self.admission_cache.invalidate(dir_key)
+        return super(SkipCheckingMultiFileWARCWriter, self).close_key(dir_key)
+
     def write_stream_to_file(self, params, stream):
         upload_id = params.get('param.upid')
+        tracker = None
+
+        if upload_id:
+            tracker = UploadProgressTracker(self.redis, upload_id)
+            params['upload_tracker'] = tracker
+
         def write_callback(out, filename):
             while True:
                 buff = stream.read(BUFF_SIZE)
@@ -645,20 +922,26 @@ class SkipCheckingMultiFileWARCWriter(MultiFileWARCWriter):
                     break
 
                 out.write(buff)
-                if upload_id:
-                    self.redis.hincrby(upload_id, 'size', len(buff))
+                if tracker:
+                    tracker.incr(len(buff))
 
-        return self._write_to_file(params, write_callback)
+        try:
+            return self._write_to_file(params, write_callback)
+        finally:
+            if tracker:
+                tracker.flush()
 
     def _is_write_resp(self, resp, params):
-        if not self.is_rec_open(params):
-            return False
+        skip_key = None
+        if self.skip_key_template:
+            skip_key = res_template(self.skip_key_template, params)
 
-        user_key = res_template(self.user_key, params)
-        size, max_size = self.redis.hmget(user_key, ['size', 'max_size'])
+        entry = self._get_admission(params, skip_key)
+        if not entry['open']:
+            return False
 
-        size = int(size or 0)
-        max_size = int(max_size or 0)
+        # prefetched for _is_write_req()
+        params['recorder.skip_req'] = entry.get('skip')
 
         length = resp.length or resp.rec_headers.get_header('Content-Length')
         if length is None:
@@ -666,7 +949,7 @@ class SkipCheckingMultiFileWARCWriter(MultiFileWARCWriter):
             resp.length = resp.payload_length
             length = resp.length
 
-        if size + length > max_size:
+        if entry['size'] + length > entry['max_size']:
             print('New Record for {0} exceeds max size, not recording!'.format(params['url']))
             return False
 
@@ -676,29 +959,68 @@ class SkipCheckingMultiFileWARCWriter(MultiFileWARCWriter):
         if not req or not req.rec_headers or not self.skip_key_template:
             return False
 
-        skip_key = res_template(self.skip_key_template, params)
+        if 'recorder.skip_req' in params:
+            skip = params.pop('recorder.skip_req')
+        else:
+            skip_key = res_template(self.skip_key_template, params)
+            skip = self.redis.get(skip_key)
 
-        if self.redis.get(skip_key) == b'1':
+        if skip == b'1':
             print('SKIPPING REQ', params.get('url'))
             return False
 
         return True
 
 
+# ============================================================================
+class WriteAdmissionCache(object):
+    """ Tracks when each recording's open key ttl was last refreshed,
+    keyed by recording info key, so that the open key is only refreshed
+    once per ttl secs while actively recording
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.last_refresh = {}
+
+    def is_open(self, rec_key):
+        last = self.last_refresh.get(rec_key)
+        if last is None:
+            return False
+
+        if time.time() - last >= self.ttl:
+            self.last_refresh.pop(rec_key, None)
+            return False
+
+        return True
+
+    def set_open(self, rec_key):
+        self.last_refresh[rec_key] = time.time()
+
+    def invalidate(self, rec_key=None):
+        if rec_key:
+            self.last_refresh.pop(rec_key, None)
+        else:
+            self.last_refresh.clear()
+
+
 # ============================================================================
 class TempWriteBuffer(tempfile.SpooledTemporaryFile):
-    def __init__(self, redis, info_key, class_name, url):
+    def __init__(self, redis, info_key, class_name, url,
+                 flush_size=1024*1024, flush_secs=0.5):
         super(TempWriteBuffer, self).__init__(max_size=512*1024)
         self.redis = redis
         self.info_key = info_key
         self.redis.hincrby(self.info_key, 'pending_count', 1)
-        self._wsize = 0
+
+        # pending_size updates are coalesced, only what has been
+        # flushed to redis needs to be removed on close
+        self.pending_size = BatchedHashCounter(redis, info_key, 'pending_size',
+                                               flush_size=flush_size,
+                                               flush_secs=flush_secs)
 
     def write(self, buff):
         super(TempWriteBuffer, self).write(buff)
-        length = len(buff)
-        self._wsize += length
-        self.redis.hincrby(self.info_key, 'pending_size', length)
+        self.pending_size.incr(len(buff))
 
     def close(self):
         try:
@@ -706,7 +1028,10 @@ class TempWriteBuffer(tempfile.SpooledTemporaryFile):
         except:
             traceback.print_exc()
 
-        self.redis.hincrby(self.info_key, 'pending_size', -self._wsize)
-        self.redis.hincrby(self.info_key, 'pending_count', -1)
+        with redis_pipeline(self.redis) as pi:
+            if self.pending_size.flushed:
+                pi.hincrby(self.info_key, 'pending_size', -self.pending_size.flushed)
+
+            pi.hincrby(self.info_key, 'pending_count', -1)
 
 
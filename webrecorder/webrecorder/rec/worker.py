@@ -20,6 +20,10 @@ class Worker(object):
     def stop(self):
         self._running = False
 
+        stop_worker = getattr(self.worker, 'stop', None)
+        if stop_worker:
+            stop_worker()
+
     def run(self):
         while self._running:
             try:
@@ -9,12 +9,13 @@ import hashlib
 import gevent
 import logging
 
+from contextlib import contextmanager
 from datetime import datetime
 
 from bottle import template, request, HTTPError
 
 from webrecorder.webreccork import ValidationException
-from webrecorder.redisutils import RedisTable
+from webrecorder.redisutils import RedisTable, RedisUserTable, LOCK_SCRIPTS
 from webrecorder.webreccork import WebRecCork
 from webrecorder.session import Session
 
@@ -30,7 +31,7 @@ from pywb.utils.loaders import load
 
 from warcio.timeutils import timestamp_now
 
-from webrecorder.utils import load_wr_config, redis_pipeline
+from webrecorder.utils import load_wr_config, redis_pipeline, get_bool
 
 import requests
 
@@ -148,7 +149,7 @@ class LoginManagerMixin(object):
         return request.environ['webrec.session']
 
     def get_users(self):
-        return RedisTable(self.redis, 'h:users')
+        return RedisUserTable(self.redis, 'h:users')
 
     def create_user(self, reg):
         try:
@@ -269,9 +270,12 @@ class LoginManagerMixin(object):
         return int(self.redis.hget(user_key, 'size') or 0)
 
     def get_size_remaining(self, user):
-        user_key = self.user_key.format(user=user)
-
-        size, max_size = self.redis.hmget(user_key, ['size', 'max_size'])
+        ctx = self._get_access_context(user)
+        if ctx:
+            size, max_size = ctx.size, ctx.max_size
+        else:
+            user_key = self.user_key.format(user=user)
+            size, max_size = self.redis.hmget(user_key, ['size', 'max_size'])
 
         try:
             if not size:
@@ -303,6 +307,19 @@ class LoginManagerMixin(object):
         if self.is_superuser():
             return False
 
+        rate_keys, limit_max = self.get_rate_limit_keys(ip)
+
+        ctx = self._get_access_context(user)
+        if ctx and ctx.ip == ip and ctx.rate_values is not None:
+            values = ctx.rate_values
+        else:
+            values = self.redis.mget(rate_keys)
+
+        total = sum(int(v) for v in values if v)
+
+        return (total >= limit_max)
+
+    def get_rate_limit_keys(self, ip):
         rate_key = self.rate_limit_key.format(ip=ip, H='')
         h = int(datetime.utcnow().strftime('%H'))
 
@@ -316,19 +333,10 @@ class LoginManagerMixin(object):
         rate_keys = [rate_key + '%02d' % ((h - i) % 24)
                      for i in range(0, limit_hours)]
 
-        values = self.redis.mget(rate_keys)
-        total = sum(int(v) for v in values if v)
-
-        return (total >= limit_max)
+        return rate_keys, limit_max
 
     def has_user_email(self, email):
-        #TODO: implement a email table, if needed?
-        all_users = RedisTable(self.redis, 'h:users')
-        for n, userdata in all_users.items():
-            if userdata['email_addr'] == email:
-                return True
-
-        return False
+        return self.get_users().get_user_for_email(email) is not None
 
     def get_user_email(self, user):
         if not user:
@@ -517,12 +525,84 @@ class LoginManagerMixin(object):
         return (new_size <= size_remaining)
 
 
+# ============================================================================
+class AccessContext(object):
+    """ Request-scoped snapshot of the redis state used by the access checks
+    for a single user/coll/rec route: collection info, recording id, whether
+    recording is open, user quota and rate limit buckets, all loaded
+    in a single pipelined round trip. Read-only, the open recording ttl is
+    only refreshed once the access checks pass
+    """
+    def __init__(self, user, coll, rec=None, ip=None, check_open=False):
+        self.user = user
+        self.coll = coll
+        self.rec = rec
+        self.ip = ip
+        self.check_open = check_open
+
+        self.coll_info = {}
+        self.rec_id = None
+        self.rec_open = None
+        self.size = None
+        self.max_size = None
+        self.rate_values = None
+
+    def load(self, manager):
+        pi = manager.redis.pipeline(transaction=False)
+
+        pi.hgetall(manager.coll_info_key.format(user=self.user, coll=self.coll))
+
+        if self.rec:
+            pi.hget(manager.rec_info_key.format(user=self.user, coll=self.coll, rec=self.rec), 'id')
+
+            if self.check_open:
+                pi.exists(manager.open_rec_key.format(user=self.user, coll=self.coll, rec=self.rec))
+
+        pi.hmget(manager.user_key.format(user=self.user), ['size', 'max_size'])
+
+        load_rates = (self.ip is not None and
+                      manager.rate_limit_hours and manager.rate_limit_max)
+
+        if load_rates:
+            rate_keys, _ = manager.get_rate_limit_keys(self.ip)
+            pi.mget(rate_keys)
+
+        res = iter(pi.execute())
+
+        self.coll_info = next(res) or {}
+
+        if self.rec:
+            self.rec_id = next(res)
+
+            if self.check_open:
+                self.rec_open = next(res)
+
+        self.size, self.max_size = next(res)
+
+        if load_rates:
+            self.rate_values = next(res)
+
+    def matches(self, user, coll=None, rec=None):
+        if user != self.user:
+            return False
+
+        if coll is not None and coll != self.coll:
+            return False
+
+        if rec is not None and rec != self.rec:
+            return False
+
+        return True
+
+
 # ============================================================================
 class AccessManagerMixin(object):
     READ_PREFIX = 'r:'
     WRITE_PREFIX = 'w:'
     PUBLIC = '@public'
 
+    ACCESS_CONTEXT_KEY = 'webrec.access_context'
+
     def __init__(self, *args, **kwargs):
         super(AccessManagerMixin, self).__init__(*args, **kwargs)
 
@@ -548,6 +628,40 @@ class AccessManagerMixin(object):
         sesh = self.get_session()
         return sesh.curr_user
 
+    @contextmanager
+    def access_context(self, user, coll, rec=None, ip=None, check_open=False):
+        """ Prefetch all state needed by the access checks for user/coll/rec
+        in one round trip, checks within the block are answered from it
+        """
+        ctx = AccessContext(user, coll, rec, ip, check_open)
+        ctx.load(self)
+
+        request.environ[self.ACCESS_CONTEXT_KEY] = ctx
+        try:
+            yield ctx
+        finally:
+            request.environ.pop(self.ACCESS_CONTEXT_KEY, None)
+
+    def _get_access_context(self, user, coll=None, rec=None):
+        try:
+            ctx = request.environ.get(self.ACCESS_CONTEXT_KEY)
+        except RuntimeError:
+            # not in a request
+            return None
+
+        if ctx and ctx.matches(user, coll, rec):
+            return ctx
+
+        return None
+
+    def _get_coll_info_field(self, user, coll, field):
+        ctx = self._get_access_context(user, coll)
+        if ctx:
+            return ctx.coll_info.get(field)
+
+        key = self.coll_info_key.format(user=user, coll=coll)
+        return self.redis.hget(key, field)
+
     def _check_write_access(self, user, coll):
         # anon access
         if self.is_anon(user) and coll == 'temp':
@@ -560,8 +674,7 @@ class AccessManagerMixin(object):
             return True
 
         if sesh.curr_user:
-            key = self.coll_info_key.format(user=user, coll=coll)
-            return self.redis.hget(key, self.WRITE_PREFIX + sesh.curr_user) != None
+            return self._get_coll_info_field(user, coll, self.WRITE_PREFIX + sesh.curr_user) != None
 
         return False
 
@@ -580,14 +693,12 @@ class AccessManagerMixin(object):
             return True
 
         if sesh.curr_user:
-            key = self.coll_info_key.format(user=user, coll=coll)
-            return self.redis.hget(key, self.READ_PREFIX + sesh.curr_user) != None
+            return self._get_coll_info_field(user, coll, self.READ_PREFIX + sesh.curr_user) != None
 
         return False
 
     def is_public(self, user, coll):
-        key = self.coll_info_key.format(user=user, coll=coll)
-        res = self.redis.hget(key, self.READ_PREFIX + self.PUBLIC)
+        res = self._get_coll_info_field(user, coll, self.READ_PREFIX + self.PUBLIC)
         return res == '1'
 
     def set_public(self, user, coll, is_public):
@@ -705,32 +816,69 @@ class PageManagerMixin(object):
         self.user_tag_templ = config['user_tag_templ']
         self.tags_key = config['tags_key']
 
+        self.tag_index_key = config['tag_index_key_templ']
+        self.coll_tags_key = config['coll_tags_key_templ']
+
     def tag_page(self, tags, user, coll, rec, pg_id):
+        coll_tags_key = self.coll_tags_key.format(user=user, coll=coll)
+
         for tag in tags:
             k = self.user_tag_templ.format(user=user, coll=coll, rec=rec,
                                            tag=tag)
+            tag_index_key = self.tag_index_key.format(tag=tag)
+
             if self.redis.exists(k):
                 # if exists, untag
                 if self.redis.sismember(k, pg_id):
                     self.redis.srem(k, pg_id)
                     self.redis.zincrby(self.tags_key, tag, -1)
+
+                    # last page untagged, remove from indexes
+                    if not self.redis.scard(k):
+                        with redis_pipeline(self.redis) as pi:
+                            pi.srem(tag_index_key, k)
+                            pi.srem(coll_tags_key, k)
                     continue
 
             # if not previously tagged or a new tag, set and add to tag count
-            self.redis.sadd(k, pg_id)
-            self.redis.zincrby(self.tags_key, tag)
+            with redis_pipeline(self.redis) as pi:
+                pi.sadd(k, pg_id)
+                pi.zincrby(self.tags_key, tag)
+                pi.sadd(tag_index_key, k)
+                pi.sadd(coll_tags_key, k)
+
+    def _load_tag_keys(self, tag_keys):
+        """ Load pages for all tag keys in one round trip
+        """
+        tag_keys = list(tag_keys)
+
+        pi = self.redis.pipeline(transaction=False)
+        for k in tag_keys:
+            pi.smembers(k)
+
+        return zip(tag_keys, pi.execute())
 
     def get_pages_for_tag(self, tag):
+        tag_keys = self.redis.smembers(self.tag_index_key.format(tag=tag))
+
+        can_view = {}
+
         tagged_pages = []
-        for k in self.redis.keys('*:tag:{}'.format(tag)):
+        for k, pages in self._load_tag_keys(tag_keys):
+            if not pages:
+                continue
+
             parts = k.split(':')
             user = parts[1]
             coll = parts[2]
             rec = parts[3]
 
             # display if owner or if collection is public
-            if self.is_owner(user) or self.is_public(user, coll):
-                for i in self.redis.smembers(k):
+            if (user, coll) not in can_view:
+                can_view[(user, coll)] = self.is_owner(user) or self.is_public(user, coll)
+
+            if can_view[(user, coll)]:
+                for i in pages:
                     data = i.split(' ')
                     tagged_pages.append({
                         'user': user,
@@ -743,6 +891,30 @@ class PageManagerMixin(object):
 
         return sorted(tagged_pages, key=lambda x: x['timestamp'])
 
+    def build_tag_indexes(self, batch_size=1000):
+        """ Build tag and collection tag indexes from existing tag keys,
+        scanning incrementally rather than with a blocking KEYS
+        """
+        pattern = self.user_tag_templ.format(user='*', coll='*', rec='*', tag='*')
+
+        count = 0
+        pi = self.redis.pipeline(transaction=False)
+
+        for k in self.redis.scan_iter(match=pattern, count=batch_size):
+            parts = k.split(':')
+            if len(parts) != 6:
+                continue
+
+            pi.sadd(self.tag_index_key.format(tag=parts[5]), k)
+            pi.sadd(self.coll_tags_key.format(user=parts[1], coll=parts[2]), k)
+
+            count += 1
+            if count % batch_size == 0:
+                pi.execute()
+
+        pi.execute()
+        return count
+
 
 # ============================================================================
 class RecManagerMixin(object):
@@ -808,12 +980,21 @@ class RecManagerMixin(object):
         if not self.can_read_coll(user, coll):
             return False
 
+        ctx = self._get_access_context(user, coll, rec)
+        if ctx:
+            return ctx.rec_id != None
+
         key = self.rec_info_key.format(user=user, coll=coll, rec=rec)
 
         # ensure id is valid
         return self.redis.hget(key, 'id') != None
 
     def is_recording_open(self, user, coll, rec):
+        # already closed, nothing to refresh
+        ctx = self._get_access_context(user, coll, rec)
+        if ctx and ctx.check_open and not ctx.rec_open:
+            return False
+
         key = self.open_rec_key.format(user=user, coll=coll, rec=rec)
         return self.redis.expire(key, self.open_rec_ttl)
 
@@ -864,6 +1045,9 @@ class RecManagerMixin(object):
 
             pi.setex(open_key, self.open_rec_ttl, 1)
 
+            # collection index no longer empty
+            pi.delete(self.coll_cdxj_key.format(user=user, coll=coll) + ':empty')
+
         if not self._has_collection_no_access_check(user, coll):
             coll_title = coll_title or coll
             self.create_collection(user, coll, coll_title)
@@ -1184,8 +1368,19 @@ class RecManagerMixin(object):
         return last_cdx['timestamp']
 
 
+# ============================================================================
+class LockLostException(Exception):
+    pass
+
+
 # ============================================================================
 class CollManagerMixin(object):
+    CDXJ_LOAD_CHUNK_SIZE = 65536
+    COLL_INDEX_WAIT_INTERVAL = 0.1
+
+    # collection with no recordings, not rebuilt until new recording added
+    COLL_INDEX_EMPTY_SECS = 60
+
     def __init__(self, config):
         super(CollManagerMixin, self).__init__(config)
 
@@ -1195,6 +1390,17 @@ class CollManagerMixin(object):
         self.coll_cdxj_key = config['coll_cdxj_key_templ']
         self.coll_cdxj_ttl = int(config['coll_cdxj_ttl'])
         self.info_index_key = config['info_index_key']
+        self.cdxj_load_batch_size = int(config['cdxj_load_batch_size'])
+        self.coll_cdxj_lock_secs = int(config['coll_cdxj_lock_secs'])
+        self.coll_cdxj_wait_secs = int(config['coll_cdxj_wait_secs'])
+        self.lock_scripts = {}
+
+        self.coll_cdxj_incremental = get_bool(config['coll_cdxj_incremental'])
+        self.cdxj_file_index = get_bool(config['cdxj_file_index'])
+        self.coll_cdxj_access_key = config['coll_cdxj_access_key']
+        self.coll_cdxj_max_idle_secs = int(config['coll_cdxj_max_idle_secs'])
+        self.coll_cdxj_max_lines = int(config['coll_cdxj_max_lines'])
+        self.coll_cdxj_evict_secs = int(config['coll_cdxj_evict_secs'])
         self.record_root_dir = os.environ['RECORD_ROOT']
 
         self.upload_key = config['upload_key_templ']
@@ -1243,8 +1449,7 @@ class CollManagerMixin(object):
         return result
 
     def _has_collection_no_access_check(self, user, coll):
-        key = self.coll_info_key.format(user=user, coll=coll)
-        return self.redis.hget(key, 'id') != None
+        return self._get_coll_info_field(user, coll, 'id') != None
 
     def has_collection_is_public(self, user, coll):
         res = self._check_read_access_public(user, coll)
@@ -1367,18 +1572,20 @@ class CollManagerMixin(object):
         self.redis.hset(key, prop_name, prop_value)
 
     def get_tags_in_collection(self, user, coll):
-        keys = self.redis.keys('*:{user}:{coll}:*:tag:*'.format(user=user,
-                                                                coll=coll))
+        keys = self.redis.smembers(self.coll_tags_key.format(user=user, coll=coll))
 
         # return pages grouped by tag
         tagged_pages = {}
-        for k in keys:
+        for k, pages in self._load_tag_keys(keys):
+            if not pages:
+                continue
+
             tag = k.split(':')[5]
             if tag in tagged_pages:
-                tagged_pages[tag] |= self.redis.smembers(k)
+                tagged_pages[tag] |= pages
             else:
                 tagged_pages.update({
-                    tag: self.redis.smembers(k)
+                    tag: pages
                 })
 
         return tagged_pages
@@ -1409,70 +1616,405 @@ class CollManagerMixin(object):
         return props
 
     def sync_coll_index(self, user, coll, exists=False, do_async=False):
+        """ Build the collection replay index from all recording indexes,
+        if not already built (or rebuild if exists and it already exists).
+        Only one build runs at a time per collection, other sync callers
+        wait for it to finish unless do_async
+        """
+        # collection replay served from recording indexes directly
+        if self.cdxj_file_index:
+            return
+
         coll_cdxj_key = self.coll_cdxj_key.format(user=user, coll=coll)
-        if exists != self.redis.exists(coll_cdxj_key):
-            self.redis.expire(coll_cdxj_key, self.coll_cdxj_ttl)
+
+        # incremental index already updated by recorder, no rebuild needed
+        if exists and self.coll_cdxj_incremental:
             return
 
-        cdxj_keys = self._get_rec_keys(user, coll, self.cdxj_key)
-        if not cdxj_keys:
+        if not exists:
+            if self._is_coll_index_ready(coll_cdxj_key):
+                return
+
+        elif not self.redis.exists(coll_cdxj_key):
+            return
+
+        token = self.acquire_lock(coll_cdxj_key + ':_')
+        if not token:
+            if not do_async:
+                self._wait_coll_index(user, coll, coll_cdxj_key)
+            return
+
+        if do_async:
+            gevent.spawn(self._build_coll_index, user, coll, coll_cdxj_key, token)
+        else:
+            self._build_coll_index(user, coll, coll_cdxj_key, token)
+
+    def _is_coll_index_ready(self, coll_cdxj_key):
+        """ Cheap readiness check, also refreshing the ttl of the existing index,
+        or updating last access time if incremental, and evicting idle indexes
+        at most once every coll_cdxj_evict_secs
+        """
+        pi = self.redis.pipeline(transaction=False)
+
+        if self.coll_cdxj_incremental:
+            pi.exists(coll_cdxj_key)
+            pi.exists(coll_cdxj_key + ':ready')
+            pi.zadd(self.coll_cdxj_access_key, int(time.time()), coll_cdxj_key)
+            pi.set(self.coll_cdxj_access_key + ':evict', 1, nx=True, ex=self.coll_cdxj_evict_secs)
+        else:
+            pi.expire(coll_cdxj_key, self.coll_cdxj_ttl)
+            pi.expire(coll_cdxj_key + ':ready', self.coll_cdxj_ttl)
+
+        pi.exists(coll_cdxj_key + ':empty')
+
+        res = pi.execute()
+
+        if self.coll_cdxj_incremental and res[3]:
+            gevent.spawn(self.evict_coll_indexes, coll_cdxj_key)
+
+        return bool((res[0] and res[1]) or res[-1])
+
+    def acquire_lock(self, lock_key):
+        """ Acquire lock with a lease of coll_cdxj_lock_secs,
+        return lock token if acquired, otherwise None
+        """
+        token = base64.b32encode(os.urandom(10)).decode('utf-8')
+        if self.redis.set(lock_key, token, nx=True, ex=self.coll_cdxj_lock_secs):
+            return token
+
+        return None
+
+    def renew_lock(self, lock_key, token):
+        """ Extend lock lease, return False if lock is no longer held with token
+        """
+        return bool(self._run_lock_script('renew', lock_key, token, self.coll_cdxj_lock_secs))
+
+    def release_lock(self, lock_key, token):
+        """ Release lock only if still held with token
+        """
+        return bool(self._run_lock_script('release', lock_key, token))
+
+    def _run_lock_script(self, name, lock_key, *args):
+        script = self.lock_scripts.get(name)
+        if not script:
+            script = self.redis.register_script(LOCK_SCRIPTS[name])
+            self.lock_scripts[name] = script
+
+        return script(keys=[lock_key], args=args)
+
+    def _build_coll_index(self, user, coll, coll_cdxj_key, token):
+        """ Build collection index, with build lock already held with token.
+        The index is only marked ready if the lock is still held when done
+        """
+        ready_key = coll_cdxj_key + ':ready'
+        lock_key = coll_cdxj_key + ':_'
+
+        try:
+            self.redis.delete(ready_key, coll_cdxj_key + ':_n')
+
+            cdxj_keys = self._get_rec_keys(user, coll, self.cdxj_key)
+            if not cdxj_keys:
+                self._set_coll_index_empty(user, coll, coll_cdxj_key)
+                return
+
+            self.redis.zunionstore(coll_cdxj_key, cdxj_keys)
+            if not self.coll_cdxj_incremental:
+                self.redis.expire(coll_cdxj_key, self.coll_cdxj_ttl)
+
+            ges = []
+            for cdxj_key in cdxj_keys:
+                if self.redis.exists(cdxj_key):
+                    continue
+
+                ges.append(gevent.spawn(self._do_download_cdxj, cdxj_key, coll_cdxj_key,
+                                        (lock_key, token)))
+
+            gevent.joinall(ges)
+
+            # lease expired during build, another build may have started
+            if not self.renew_lock(lock_key, token):
+                logging.warning('Lost collection index lock: ' + coll_cdxj_key)
+                return
+
+            # each recording must have loaded successfully
+            if not all(ge.value for ge in ges):
+                logging.warning('Incomplete collection index: ' + coll_cdxj_key)
+                return
+
+            # only ready if index exists, new lines are only added to an existing index
+            if not self.redis.exists(coll_cdxj_key):
+                return
+
+            if self.coll_cdxj_incremental:
+                with redis_pipeline(self.redis) as pi:
+                    pi.set(ready_key, 1)
+                    pi.zadd(self.coll_cdxj_access_key, int(time.time()), coll_cdxj_key)
+                    pi.delete(coll_cdxj_key + ':_n')
+
+                self.evict_coll_indexes(keep=coll_cdxj_key)
+            else:
+                with redis_pipeline(self.redis) as pi:
+                    pi.setex(ready_key, self.coll_cdxj_ttl, 1)
+                    pi.delete(coll_cdxj_key + ':_n')
+
+        except Exception as e:
+            logging.error('Error building collection index: ' + str(e))
+
+        finally:
+            self.release_lock(lock_key, token)
+
+    def _set_coll_index_empty(self, user, coll, coll_cdxj_key):
+        """ Mark collection as having no recordings to index, cleared by
+        create_recording(). Recording list is rechecked after setting,
+        in case a recording was added meanwhile
+        """
+        empty_key = coll_cdxj_key + ':empty'
+        self.redis.setex(empty_key, self.COLL_INDEX_EMPTY_SECS, 1)
+
+        if self.redis.scard(self.rec_list_key.format(user=user, coll=coll)):
+            self.redis.delete(empty_key)
+
+    def evict_coll_indexes(self, keep=None):
+        """ Remove incremental collection indexes not accessed within
+        coll_cdxj_max_idle_secs, then least recently accessed indexes until
+        total size is within coll_cdxj_max_lines
+        """
+        idle_time = int(time.time()) - self.coll_cdxj_max_idle_secs
+
+        # oldest access first
+        access_list = self.redis.zrange(self.coll_cdxj_access_key, 0, -1, withscores=True)
+
+        pi = self.redis.pipeline(transaction=False)
+        for coll_cdxj_key, _ in access_list:
+            pi.zcard(coll_cdxj_key)
+
+        sizes = pi.execute()
+        total = sum(sizes)
+
+        evict = []
+
+        for (coll_cdxj_key, last_access), size in zip(access_list, sizes):
+            if coll_cdxj_key == keep:
+                continue
+
+            # already removed, eg. deleted or renamed collection
+            if not size or last_access < idle_time or total > self.coll_cdxj_max_lines:
+                evict.append(coll_cdxj_key)
+                total -= size
+
+        if not evict:
             return
 
-        self.redis.zunionstore(coll_cdxj_key, cdxj_keys)
-        self.redis.expire(coll_cdxj_key, self.coll_cdxj_ttl)
+        logging.debug('Evicting collection indexes: ' + str(evict))
+
+        with redis_pipeline(self.redis) as pi:
+            for coll_cdxj_key in evict:
+                pi.delete(coll_cdxj_key, coll_cdxj_key + ':ready')
+
+            pi.zrem(self.coll_cdxj_access_key, *evict)
+
+    def _wait_coll_index(self, user, coll, coll_cdxj_key):
+        """ Wait for collection index build by another request to finish,
+        for up to coll_cdxj_wait_secs since the build last loaded more lines.
+        If the build lock is released or expires without the index being ready,
+        attempt to build it here
+        """
+        max_time = time.time() + self.coll_cdxj_wait_secs
+        last_progress = None
+
+        while time.time() < max_time:
+            gevent.sleep(self.COLL_INDEX_WAIT_INTERVAL)
+
+            pi = self.redis.pipeline(transaction=False)
+            pi.exists(coll_cdxj_key + ':ready')
+            pi.exists(coll_cdxj_key + ':_')
+
+            ready, building = pi.execute()
+
+            if ready:
+                return True
+
+            if not building:
+                token = self.acquire_lock(coll_cdxj_key + ':_')
+                if token:
+                    self._build_coll_index(user, coll, coll_cdxj_key, token)
+                    return True
 
-        ges = []
-        for cdxj_key in cdxj_keys:
-            if self.redis.exists(cdxj_key):
                 continue
 
-            ges.append(gevent.spawn(self._do_download_cdxj, cdxj_key, coll_cdxj_key))
+            # keep waiting while the build is still loading
+            progress = self.get_cdxj_load_progress(coll_cdxj_key)
+            if progress != last_progress:
+                last_progress = progress
+                max_time = time.time() + self.coll_cdxj_wait_secs
 
-        if not do_async:
-            res = gevent.joinall(ges)
+        logging.warning('Timed out waiting for collection index: ' + coll_cdxj_key)
+        return False
 
-    def _do_download_cdxj(self, cdxj_key, output_key):
+    def _do_download_cdxj(self, cdxj_key, output_key, build_lease=None):
+        """ Reload committed cdxj index for cdxj_key into output_key.
+        If build_lease (lock key, token) is set, the lease is renewed with
+        each batch and the load stops if it is lost.
+        Return True if loaded, or no index to load, otherwise False
+        """
         lock_key = None
+        token = None
         try:
             rec_warc_key = cdxj_key.rsplit(':', 1)[0] + ':warc'
             cdxj_filename = self.redis.hget(rec_warc_key, self.info_index_key)
             if not cdxj_filename:
                 logging.debug('No index for ' + rec_warc_key)
-                return
+                return True
 
             lock_key = cdxj_key + ':_'
             logging.debug('Downloading for {0} file {1}'.format(rec_warc_key, cdxj_filename))
             attempts = 0
 
-            if not self.redis.set(lock_key, 1, nx=True):
-                logging.warning('Already downloading, skipping')
-                lock_key = None
-                return
+            token = self.acquire_lock(lock_key)
+
+            # only held by a build whose lease expired, which stops at its next batch
+            if not token:
+                logging.warning('Already downloading, waiting: ' + cdxj_key)
+                token = self._wait_cdxj_download(cdxj_key, build_lease)
+                if not token:
+                    logging.warning('Timed out waiting for download: ' + cdxj_key)
+                    return False
+
+            leases = [(lock_key, token)]
+            if build_lease:
+                leases.append(build_lease)
 
             while attempts < 10:
+                fh = None
                 try:
                     fh = load(cdxj_filename)
-                    buff = fh.read()
-
-                    for cdxj_line in buff.splitlines():
-                        self.redis.zadd(output_key, 0, cdxj_line)
-
+                    self._load_cdxj_lines(fh, output_key, cdxj_key + ':_n', leases)
                     break
+                except LockLostException:
+                    raise
                 except:
                     logging.error('Could not load: ' + cdxj_filename)
                     attempts += 1
 
                 finally:
-                    fh.close()
+                    if fh:
+                        fh.close()
+
+            if attempts >= 10:
+                return False
 
-            self.redis.expire(output_key, self.coll_cdxj_ttl)
+            if not self.coll_cdxj_incremental:
+                self.redis.expire(output_key, self.coll_cdxj_ttl)
+
+            return True
+
+        except LockLostException as e:
+            logging.warning('Lost lock, stopping download: ' + str(e))
+            return False
 
         except Exception as e:
             logging.error('Error downloading cache: ' + str(e))
+            return False
 
         finally:
-            if lock_key:
-                self.redis.delete(lock_key)
+            if token:
+                self.release_lock(lock_key, token)
+
+    def _wait_cdxj_download(self, cdxj_key, build_lease=None):
+        """ Wait for download lock held by another load to be released,
+        for up to coll_cdxj_wait_secs since that load last made progress,
+        renewing build_lease meanwhile. Return lock token once acquired,
+        or None if timed out
+        """
+        max_time = time.time() + self.coll_cdxj_wait_secs
+        last_progress = None
+
+        while time.time() < max_time:
+            gevent.sleep(self.COLL_INDEX_WAIT_INTERVAL)
+
+            token = self.acquire_lock(cdxj_key + ':_')
+            if token:
+                return token
+
+            if build_lease and not self.renew_lock(*build_lease):
+                raise LockLostException(build_lease[0])
+
+            progress = self.get_cdxj_load_progress(cdxj_key)
+            if progress != last_progress:
+                last_progress = progress
+                max_time = time.time() + self.coll_cdxj_wait_secs
+
+        return None
+
+    def _load_cdxj_lines(self, fh, output_key, progress_key, leases=None):
+        """ Stream cdxj lines from fh into output_key, in batched pipelines.
+        The number of lines loaded so far is stored in progress_key,
+        and each (lock key, token) in leases is renewed with every batch
+        """
+        count = 0
+        batch = []
+
+        for cdxj_line in self._iter_cdxj_lines(fh):
+            batch.append(cdxj_line)
+            if len(batch) >= self.cdxj_load_batch_size:
+                count += len(batch)
+                self._add_cdxj_batch(output_key, batch, progress_key, count, leases)
+                batch = []
+
+        if batch:
+            count += len(batch)
+            self._add_cdxj_batch(output_key, batch, progress_key, count, leases)
+
+        return count
+
+    def _add_cdxj_batch(self, output_key, batch, progress_key, count, leases=None):
+        pi = self.redis.pipeline(transaction=False)
+
+        for cdxj_line in batch:
+            pi.zadd(output_key, 0, cdxj_line)
+
+        pi.set(progress_key, count, ex=self.coll_cdxj_lock_secs)
+
+        res = pi.execute()
+
+        # total lines loaded into output_key, lines already added
+        # by an earlier attempt are not counted again
+        added = sum(res[:len(batch)])
+        if added:
+            with redis_pipeline(self.redis) as pi:
+                pi.incrby(output_key + ':_n', added)
+                pi.expire(output_key + ':_n', self.coll_cdxj_lock_secs)
+
+        for lock_key, token in (leases or []):
+            if not self.renew_lock(lock_key, token):
+                raise LockLostException(lock_key)
+
+    def _iter_cdxj_lines(self, fh):
+        leftover = b''
+
+        while True:
+            buff = fh.read(self.CDXJ_LOAD_CHUNK_SIZE)
+            if not buff:
+                break
+
+            lines = (leftover + buff).split(b'\n')
+            leftover = lines.pop()
+
+            for line in lines:
+                line = line.rstrip(b'\r')
+                if line:
+                    yield line
+
+        leftover = leftover.rstrip(b'\r')
+        if leftover:
+            yield leftover
+
+    def get_cdxj_load_progress(self, cdxj_key):
+        """ Return number of lines loaded so far if cdxj_key is
+        currently being reloaded (or built, for a collection index), otherwise None
+        """
+        count = self.redis.get(cdxj_key + ':_n')
+        return int(count) if count is not None else None
 
 
 # ============================================================================
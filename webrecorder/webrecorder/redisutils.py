@@ -1,6 +1,25 @@
 import json
 
 
+# ============================================================================
+# token locks: only release or renew lock if still held with the same token
+LOCK_SCRIPTS = {
+    'release': """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""",
+
+    'renew': """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+""",
+}
+
+
 # ============================================================================
 class RedisTable(object):
     def __init__(self, redis, key):
@@ -58,6 +77,113 @@ class RedisTable(object):
         return result
 
 
+# ============================================================================
+class RedisUserTable(RedisTable):
+    """ Cork users table, which also maintains an email -> username index hash,
+    for all user create, update and delete paths
+    """
+    EMAIL_INDEX_KEY = 'h:user_emails'
+
+    # set in index once built from all existing users
+    READY_FIELD = '@ready'
+
+    def __init__(self, redis, key='h:users', email_key=None):
+        super(RedisUserTable, self).__init__(redis, key)
+        self.email_key = email_key or self.EMAIL_INDEX_KEY
+
+    def __setitem__(self, name, values):
+        if isinstance(values, RedisHashTable):
+            values = values.thedict
+
+        old_email = self._get_email(name)
+        new_email = values.get('email_addr')
+
+        pi = self.redis.pipeline(transaction=False)
+        pi.hset(self.key, name, json.dumps(values))
+
+        if old_email and old_email != new_email:
+            self._remove_email(pi, old_email, name)
+
+        if new_email:
+            pi.hset(self.email_key, new_email, name)
+
+        return pi.execute()[0]
+
+    def __delitem__(self, name):
+        email = self._get_email(name)
+
+        pi = self.redis.pipeline(transaction=False)
+        pi.hdel(self.key, name)
+
+        if email:
+            self._remove_email(pi, email, name)
+
+        return pi.execute()[0]
+
+    def pop(self, name):
+        result = self[name]
+        if result:
+            del self[name]
+        return result
+
+    def _get_email(self, name):
+        string = self.redis.hget(self.key, name)
+        if not string:
+            return None
+
+        return json.loads(string).get('email_addr')
+
+    def _remove_email(self, pi, email, name):
+        # only remove if still mapped to this user
+        if self.redis.hget(self.email_key, email) == name:
+            pi.hdel(self.email_key, email)
+
+    def get_user_for_email(self, email):
+        """ Look up username for email in the index, or by scanning all users
+        if the index has not yet been built with rebuild_email_index()
+        """
+        pi = self.redis.pipeline(transaction=False)
+        pi.hget(self.email_key, email)
+        pi.hexists(self.email_key, self.READY_FIELD)
+        user, ready = pi.execute()
+
+        if not ready:
+            return self._scan_for_email(email)
+
+        # entry left by a build concurrent with an email change
+        if user and self._get_email(user) != email:
+            return self._scan_for_email(email)
+
+        return user
+
+    def _scan_for_email(self, email):
+        for name, userdata in self.items():
+            if userdata.get('email_addr') == email:
+                return name
+
+        return None
+
+    def rebuild_email_index(self):
+        """ Add all users to the email index, keeping any entries written
+        by concurrent user updates, and mark the index ready.
+        Returns number of user emails indexed
+        """
+        emails = set()
+
+        pi = self.redis.pipeline(transaction=False)
+
+        for name, userdata in self.items():
+            email = userdata.get('email_addr')
+            if email and email not in emails:
+                emails.add(email)
+                pi.hsetnx(self.email_key, email, name)
+
+        pi.hset(self.email_key, self.READY_FIELD, '1')
+        pi.execute()
+
+        return len(emails)
+
+
 # ============================================================================
 class RedisHashTable(object):
     def __init__(self, redistable, key, thedict):
@@ -83,3 +209,48 @@ class RedisHashTable(object):
         return bool(self.thedict)
 
 
+
+
+# ============================================================================
+class CountingRedis(object):
+    """ Redis client wrapper calling on_call(name) once per round trip:
+    with the command name, or with 'pipeline' once per pipeline execute
+    """
+    def __init__(self, redis, on_call):
+        self.redis = redis
+        self.on_call = on_call
+
+    def pipeline(self, *args, **kwargs):
+        return CountingPipeline(self.redis.pipeline(*args, **kwargs), self.on_call)
+
+    def __getattr__(self, name):
+        attr = getattr(self.redis, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.on_call(name)
+            return attr(*args, **kwargs)
+
+        return call
+
+
+# ============================================================================
+class CountingPipeline(object):
+    def __init__(self, pi, on_call):
+        self.pi = pi
+        self.on_call = on_call
+
+    def execute(self, *args, **kwargs):
+        self.on_call('pipeline')
+        return self.pi.execute(*args, **kwargs)
+
+    def __enter__(self):
+        self.pi.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.pi.__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.pi, name)
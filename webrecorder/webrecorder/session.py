@@ -7,6 +7,8 @@ from warcio.timeutils import datetime_to_http_date
 import base64
 import pickle
 import redis
+import json
+import time
 
 from webrecorder.cookieguard import CookieGuard
 from webrecorder.utils import redis_pipeline
@@ -197,6 +199,13 @@ class RedisSessionMiddleware(CookieGuard):
 
         self.durations = session_opts['session.durations']
 
+        self.serializer = URLSafeTimedSerializer(self.secret_key)
+
+        # verified cookie -> session id, to skip repeat signature checks
+        self.cookie_cache = {}
+        self.cookie_cache_secs = int(session_opts.get('session.cookie_cache_secs', 0))
+        self.cookie_cache_max = int(session_opts.get('session.cookie_cache_max', 10000))
+
     def init_session(self, environ):
         data = None
         ttl = -2
@@ -213,10 +222,10 @@ class RedisSessionMiddleware(CookieGuard):
                     sesh_id, is_restricted = result
                     redis_key = self.key_template.format(sesh_id)
 
-                    result = self.redis.get(redis_key)
+                    result, result_ttl = self.load_session_data(redis_key)
                     if result:
-                        data = pickle.loads(base64.b64decode(result))
-                        ttl = self.redis.ttl(redis_key)
+                        data = self.decode_session(result)
+                        ttl = result_ttl
 
                         # no csrf for existing session?
                         # add and save
@@ -254,8 +263,11 @@ class RedisSessionMiddleware(CookieGuard):
         if session.curr_role == 'anon':
             session.template_params['anon_ttl'] = ttl
 
-            anon_user = session['anon']
-            self.redis.set('t:' + anon_user, sesh_id)
+            # only update anon user -> session mapping if changed
+            if data.get('t_id') != sesh_id:
+                anon_user = session['anon']
+                self.redis.set('t:' + anon_user, sesh_id)
+                session['t_id'] = sesh_id
 
         if self.auto_login_user:
             session.template_params['auto_login'] = True
@@ -312,7 +324,7 @@ class RedisSessionMiddleware(CookieGuard):
 
         if session.should_save:
             with redis_pipeline(self.redis) as pi:
-                data = base64.b64encode(pickle.dumps(session._sesh))
+                data = self.encode_session(session._sesh)
 
                 ttl = session.ttl
                 if ttl < 0:
@@ -382,15 +394,56 @@ class RedisSessionMiddleware(CookieGuard):
 
         sesh_cookie = sesh_cookie[len(self.sesh_key) + 1:]
 
-        serial = URLSafeTimedSerializer(self.secret_key)
+        if self.cookie_cache_secs:
+            cached = self.cookie_cache.get(sesh_cookie)
+            if cached and cached[1] > time.time():
+                return cached[0]
 
         try:
-            return serial.loads(sesh_cookie)
+            result = self.serializer.loads(sesh_cookie)
         except BadSignature as b:
             return None
 
+        if self.cookie_cache_secs:
+            self.add_cookie_cache(sesh_cookie, result)
+
+        return result
+
+    def add_cookie_cache(self, sesh_cookie, result):
+        now = time.time()
+
+        if len(self.cookie_cache) >= self.cookie_cache_max:
+            self.cookie_cache = dict((key, value) for key, value in self.cookie_cache.items()
+                                     if value[1] > now)
+
+            if len(self.cookie_cache) >= self.cookie_cache_max:
+                self.cookie_cache = {}
+
+        self.cookie_cache[sesh_cookie] = (result, now + self.cookie_cache_secs)
+
     def id_to_signed_cookie(self, sesh_id, is_restricted):
-        return URLSafeTimedSerializer(self.secret_key).dumps([sesh_id, is_restricted])
+        return self.serializer.dumps([sesh_id, is_restricted])
+
+    def load_session_data(self, redis_key):
+        """ Load session data and its ttl in one round trip
+        """
+        pi = self.redis.pipeline(transaction=False)
+        pi.get(redis_key)
+        pi.ttl(redis_key)
+        return pi.execute()
+
+    def encode_session(self, data):
+        return json.dumps(data, separators=(',', ':'))
+
+    def decode_session(self, value):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+
+        if value.startswith('{'):
+            return json.loads(value)
+
+        # sessions saved before json encoding
+        return pickle.loads(base64.b64decode(value))
 
     def make_id(self):
         return base64.b64encode(os.urandom(20)).decode('utf-8')
@@ -0,0 +1,147 @@
+import os
+import json
+import mmap
+import hashlib
+import logging
+
+
+# ============================================================================
+class IndexSegmentCache(object):
+    """ Per-input-file cache of parsed recording info and CDXJ lines.
+
+    Each segment is a single JSON header line, followed by the raw CDXJ
+    lines for all recordings in the file. Segments are keyed by a hash of
+    the input path, size and mtime, so that only new or changed files
+    need to be reindexed. When a changed file is saved, the segment for
+    its previous version is removed.
+    """
+    VERSION = '1'
+
+    SEGMENT_EXT = '.cdxj-seg'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+
+    def get_segment_path(self, filename):
+        filename = os.path.abspath(filename)
+        res = os.stat(filename)
+
+        key = '{0}:{1}:{2}'.format(filename, res.st_size, res.st_mtime)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir,
+                            self.get_path_prefix(filename) + key + self.SEGMENT_EXT)
+
+    def get_path_prefix(self, filename):
+        """ Prefix shared by all segments for filename, for any size and mtime
+        """
+        filename = os.path.abspath(filename)
+        return hashlib.sha1(filename.encode('utf-8')).hexdigest() + '-'
+
+    def remove_stale(self, filename, segment_path):
+        """ Remove any segments for older versions of filename
+        """
+        prefix = self.get_path_prefix(filename)
+
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith(prefix) or not name.endswith(self.SEGMENT_EXT):
+                continue
+
+            path = os.path.join(self.cache_dir, name)
+            if path == segment_path:
+                continue
+
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.debug('Index Segment Remove for {0} Failed: {1}'.format(filename, e))
+
+    def load(self, filename):
+        try:
+            segment_path = self.get_segment_path(filename)
+            if not os.path.isfile(segment_path):
+                return None
+
+            with open(segment_path, 'rb') as fh:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                header_end = mm.find(b'\n')
+                header = json.loads(mm[:header_end].decode('utf-8'))
+
+                assert(header['version'] == self.VERSION)
+
+                base = header_end + 1
+
+                cdx_lists = {}
+                for offset, (start, end) in header['segments'].items():
+                    cdx_lists[int(offset)] = mm[base + start:base + end].split(b'\n')
+
+            finally:
+                mm.close()
+
+        except Exception as e:
+            logging.debug('Index Segment Load for {0} Failed: {1}'.format(filename, e))
+            return None
+
+        infos = header['infos']
+        for info in infos:
+            if 'ra' in info:
+                info['ra'] = set(info['ra'])
+
+        return {'size': header['size'],
+                'index_filename': filename,
+                'infos': infos,
+                'cdx_lists': cdx_lists}
+
+    def save(self, filename, result):
+        # har conversions are temporary, not cached
+        if result.get('error') or result['index_filename'] != filename:
+            return False
+
+        segment_path = self.get_segment_path(filename)
+
+        segments = {}
+        buffs = []
+        pos = 0
+
+        for offset, cdx_list in result['cdx_lists'].items():
+            buff = b'\n'.join(cdx_list)
+            segments[offset] = [pos, pos + len(buff)]
+            buffs.append(buff)
+            pos += len(buff)
+
+        infos = []
+        for info in result['infos']:
+            info = dict(info)
+            if 'ra' in info:
+                info['ra'] = list(info['ra'])
+
+            infos.append(info)
+
+        header = {'version': self.VERSION,
+                  'size': result['size'],
+                  'infos': infos,
+                  'segments': segments}
+
+        temp_path = segment_path + '.tmp'
+
+        try:
+            with open(temp_path, 'wb') as fh:
+                fh.write(json.dumps(header).encode('utf-8') + b'\n')
+                for buff in buffs:
+                    fh.write(buff)
+
+            os.rename(temp_path, segment_path)
+
+        except Exception as e:
+            logging.debug('Index Segment Save for {0} Failed: {1}'.format(filename, e))
+            return False
+
+        self.remove_stale(filename, segment_path)
+        return True
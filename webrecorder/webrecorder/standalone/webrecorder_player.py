@@ -4,14 +4,16 @@ import os
 
 from webrecorder.standalone.standalone import StandaloneRunner
 from webrecorder.rec.webrecrecorder import WebRecRecorder
-from webrecorder.uploadcontroller import InplaceLoader
+from webrecorder.uploadcontroller import InplaceLoader, ParallelInplaceLoader
 from webrecorder.redisman import init_manager_for_cli
 from webrecorder.admin import create_user
 
 from webrecorder.standalone.serializefakeredis import FakeRedisSerializer
+from webrecorder.standalone.indexcache import IndexSegmentCache
 
 from gevent.threadpool import ThreadPool
 
+import multiprocessing
 import traceback
 import redis
 import fakeredis
@@ -24,7 +26,9 @@ class WebrecPlayerRunner(StandaloneRunner):
 
     def __init__(self, argres):
         self.inputs = argres.inputs
+        self.jobs = argres.jobs
         self.serializer = None
+        self.segment_cache = None
 
         super(WebrecPlayerRunner, self).__init__(argres)
 
@@ -51,6 +55,8 @@ class WebrecPlayerRunner(StandaloneRunner):
 
         self.serializer = FakeRedisSerializer(cache_db, self.inputs)
 
+        self.segment_cache = IndexSegmentCache(os.path.join(cache_dir, 'segments'))
+
     def admin_init(self):
         if self.load_cache():
             return
@@ -104,7 +110,11 @@ class WebrecPlayerRunner(StandaloneRunner):
 
         indexer = WebRecRecorder.make_wr_indexer(manager.config)
 
-        uploader = InplaceLoader(manager, indexer, '@INIT')
+        if self.jobs > 1 or self.segment_cache:
+            uploader = ParallelInplaceLoader(manager, indexer, '@INIT', self.jobs,
+                                             self.segment_cache)
+        else:
+            uploader = InplaceLoader(manager, indexer, '@INIT')
 
         files = list(self.get_archive_files(self.inputs))
 
@@ -148,11 +158,15 @@ class WebrecPlayerRunner(StandaloneRunner):
 
         parser.add_argument('--cache-dir')
 
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of processes to use for indexing archives')
+
 
 # ============================================================================
 webrecorder_player = WebrecPlayerRunner.main
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     webrecorder_player()
 
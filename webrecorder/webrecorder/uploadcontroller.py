@@ -5,11 +5,17 @@ from bottle import request
 from warcio.archiveiterator import ArchiveIterator
 from warcio.limitreader import LimitReader
 
-from har2warc.har2warc import HarParser
 from warcio.warcwriter import BufferWARCWriter, WARCWriter
+from warcio.timeutils import timestamp_now
+
+from io import BytesIO
 
 from pywb.warcserver.index.cdxobject import CDXObject
+from pywb.indexer.cdxindexer import write_cdx_index
+from pywb.indexer.archiveindexer import DefaultRecordParser
 
+import multiprocessing
+import bisect
 import traceback
 import json
 import requests
@@ -20,7 +26,13 @@ import os
 import gevent
 import redis
 
-from webrecorder.utils import SizeTrackingReader, CacheingLimitReader, redis_pipeline
+from gevent.pool import Pool
+
+from webrecorder.utils import SizeTrackingReader, CacheingLimitReader, PositionalReader
+from webrecorder.utils import redis_pipeline, get_bool
+from webrecorder.load.wamloader import WAMLoader
+from webrecorder.harparser import StreamingHarParser
+from webrecorder.rec.webrecrecorder import CDXJIndexer, WebRecRecorder
 
 import logging
 logger = logging.getLogger(__name__)
@@ -29,6 +41,9 @@ logger = logging.getLogger(__name__)
 BLOCK_SIZE = 16384 * 8
 EMPTY_DIGEST = '3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ'
 
+INPLACE_SUFFIX = '.uploading'
+ARCHIVE_EXTS = ('.warc.gz', '.warc', '.arc.gz', '.arc')
+
 
 # ============================================================================
 class UploadController(BaseController):
@@ -44,6 +59,18 @@ class UploadController(BaseController):
 
         self.max_detect_pages = config['max_detect_pages']
 
+        self.upload_inplace = get_bool(config['upload_inplace'])
+        self.record_root_dir = os.environ.get('RECORD_ROOT', '')
+        self.indexer = None
+
+        self.upload_concurrency = int(config['upload_concurrency'])
+
+        # pooled connections to the recorder, shared by all uploads
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(self.upload_concurrency, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def init_routes(self):
         @self.app.put('/_upload')
         def upload_file():
@@ -61,7 +88,6 @@ class UploadController(BaseController):
             return props
 
     def upload_file(self):
-        stream = None
         temp_file = None
         logger.debug('Upload Begin')
 
@@ -100,10 +126,21 @@ class UploadController(BaseController):
                 status = 'Collection {0} not found'.format(force_coll)
                 return {'error_message': status}
 
-        temp_file = SpooledTemporaryFile(max_size=BLOCK_SIZE)
-
         filename = request.query.getunicode('filename')
 
+        if self.upload_inplace and not filename.endswith('.har'):
+            temp_file = self._inplace_temp_file(user, filename)
+        else:
+            temp_file = SpooledTemporaryFile(max_size=BLOCK_SIZE)
+
+        # in place spool file not removed automatically, remove on any error
+        try:
+            return self._receive_upload(temp_file, filename, user, force_coll, expected_size)
+        except:
+            self._remove_inplace_file(temp_file)
+            raise
+
+    def _receive_upload(self, temp_file, filename, user, force_coll, expected_size):
         stream = request.environ['wsgi.input']
         stream = CacheingLimitReader(stream, expected_size, temp_file)
 
@@ -112,10 +149,20 @@ class UploadController(BaseController):
             temp_file.close()
             temp_file = stream
 
-        infos = self.parse_uploaded(stream, expected_size)
+        cdx_lists = None
+
+        # spooled in place, index while receiving
+        # only a single recording upload can be adopted, stop indexing if more found
+        if self._is_inplace_file(temp_file):
+            infos, cdx_lists = self.index_uploaded(stream, expected_size,
+                                                   self._get_inplace_base_name(temp_file),
+                                                   max_recs=1)
+        else:
+            infos = self.parse_uploaded(stream, expected_size)
 
         total_size = temp_file.tell()
         if total_size != expected_size:
+            self._remove_inplace_file(temp_file)
             return {'error_message': 'size mismatch: expected {0}, got {1}'.format(expected_size, total_size)}
 
         upload_id = self._get_upload_id()
@@ -130,10 +177,10 @@ class UploadController(BaseController):
             pi.hset(upload_key, 'files', 1)
 
         return self.handle_upload(temp_file, upload_id, upload_key, infos, filename,
-                                  user, force_coll, total_size)
+                                  user, force_coll, total_size, cdx_lists)
 
     def handle_upload(self, stream, upload_id, upload_key, infos, filename,
-                      user, force_coll, total_size):
+                      user, force_coll, total_size, cdx_lists=None):
 
         logger.debug('Begin handle_upload() from: ' + filename + ' force_coll: ' + str(force_coll))
 
@@ -151,6 +198,7 @@ class UploadController(BaseController):
         if not rec_infos:
             print('NO ARCHIVES!')
             #stream.close()
+            self._remove_inplace_file(stream)
             return {'error_message': 'No Archive Data Found'}
 
         with redis_pipeline(self.manager.redis) as pi:
@@ -159,13 +207,20 @@ class UploadController(BaseController):
             pi.hset(upload_key, 'filename', filename)
             pi.expire(upload_key, self.upload_exp)
 
-        self.launch_upload(self.run_upload,
-                           upload_key,
-                           filename,
-                           stream,
-                           user,
-                           rec_infos,
-                           total_size)
+        # already indexed and adopted, only redis updates left, finish before returning
+        if cdx_lists is not None and self.can_adopt_upload(stream, rec_infos):
+            launch_upload = lambda func, *args: func(*args)
+        else:
+            launch_upload = self.launch_upload
+
+        launch_upload(self.run_upload,
+                      upload_key,
+                      filename,
+                      stream,
+                      user,
+                      rec_infos,
+                      total_size,
+                      cdx_lists)
 
         return {'upload_id': upload_id,
                 'user': user
@@ -180,40 +235,40 @@ class UploadController(BaseController):
     def get_wam_loader(self):
         return self.manager.content_app.wam_loader if self.manager.content_app else None
 
-    def run_upload(self, upload_key, filename, stream, user, rec_infos, total_size):
+    def run_upload(self, upload_key, filename, stream, user, rec_infos, total_size,
+                   cdx_lists=None):
+        adopted_filename = None
+
         try:
-            count = 0
             num_recs = len(rec_infos)
             last_end = 0
 
             for info in rec_infos:
-                count += 1
-                logger.debug('Id: {0}, Uploading Rec {1} of {2}'.format(upload_key, count, num_recs))
+                diff = info['offset'] - last_end
+                last_end = info['offset'] + info['length']
+                if diff > 0:
+                    self._add_split_padding(diff, upload_key)
 
-                if info['length'] > 0:
-                    self.do_upload(upload_key,
-                                   filename,
-                                   stream,
-                                   user,
-                                   info['coll'],
-                                   info['rec'],
-                                   info['offset'],
-                                   info['length'])
-                else:
-                    logger.debug('SKIP upload for zero-length recording')
+            adopted_filename = self.adopt_upload(filename, stream, rec_infos)
 
+            if adopted_filename or self.upload_concurrency <= 1 or num_recs <= 1:
+                for count, info in enumerate(rec_infos, 1):
+                    self.ingest_recording(upload_key, filename, stream, user, info,
+                                          count, num_recs,
+                                          adopted_filename, cdx_lists)
 
-                pages = info.get('pages')
-                if pages is None:
-                    pages = self.detect_pages(user, info['coll'], info['rec'])
+            else:
+                # recordings are independent ranges of the file, each read with
+                # its own position and uploaded concurrently
+                fileno = stream.fileno()
 
-                if pages:
-                    self.manager.import_pages(user, info['coll'], info['rec'], pages)
+                pool = Pool(self.upload_concurrency)
+                for count, info in enumerate(rec_infos, 1):
+                    pool.spawn(self.ingest_recording, upload_key, filename,
+                               PositionalReader(fileno), user, info,
+                               count, num_recs)
 
-                diff = info['offset'] - last_end
-                last_end = info['offset'] + info['length']
-                if diff > 0:
-                    self._add_split_padding(diff, upload_key)
+                pool.join(raise_error=True)
 
         except:
             import traceback
@@ -221,9 +276,13 @@ class UploadController(BaseController):
 
         finally:
             # add remainder of file, assumed consumed/skipped, if any
-            last_end = stream.tell()
+            last_end = max([stream.tell()] +
+                           [info['offset'] + info['length'] for info in rec_infos])
             stream.close()
 
+            if not adopted_filename:
+                self._remove_inplace_file(stream)
+
             if last_end < total_size:
                 diff = total_size - last_end
                 self._add_split_padding(diff, upload_key)
@@ -232,9 +291,132 @@ class UploadController(BaseController):
                 pi.hincrby(upload_key, 'files', -1)
                 pi.hset(upload_key, 'done', 1)
 
+    def ingest_recording(self, upload_key, filename, stream, user, info, count, num_recs,
+                         adopted_filename=None, cdx_lists=None):
+        logger.debug('Id: {0}, Uploading Rec {1} of {2}'.format(upload_key, count, num_recs))
+
+        if info['length'] > 0 and adopted_filename:
+            self.do_inplace_upload(upload_key,
+                                   adopted_filename,
+                                   stream,
+                                   user,
+                                   info['coll'],
+                                   info['rec'],
+                                   info['offset'],
+                                   info['length'],
+                                   (cdx_lists or {}).get(info['offset']))
+
+        elif info['length'] > 0:
+            self.do_upload(upload_key,
+                           filename,
+                           stream,
+                           user,
+                           info['coll'],
+                           info['rec'],
+                           info['offset'],
+                           info['length'])
+        else:
+            logger.debug('SKIP upload for zero-length recording')
+
+        pages = info.get('pages')
+        if pages is None:
+            pages = self.detect_pages(user, info['coll'], info['rec'])
+
+        if pages:
+            self.manager.import_pages(user, info['coll'], info['rec'], pages)
+
     def _add_split_padding(self, diff, upload_key):
         self.manager.redis.hincrby(upload_key, 'size', diff * 2)
 
+    def _inplace_temp_file(self, user, filename):
+        user_dir = os.path.join(self.record_root_dir, user)
+        try:
+            os.makedirs(user_dir)
+        except OSError:
+            pass
+
+        # final name, once adopted, is the temp name without the suffix
+        ext = next((ext for ext in ARCHIVE_EXTS if filename.endswith(ext)), '.warc.gz')
+        prefix = 'upload-{0}-'.format(timestamp_now())
+
+        return NamedTemporaryFile(dir=user_dir, prefix=prefix, suffix=ext + INPLACE_SUFFIX,
+                                  delete=False)
+
+    def _get_inplace_base_name(self, stream):
+        return os.path.basename(stream.name)[:-len(INPLACE_SUFFIX)]
+
+    def _is_inplace_file(self, stream):
+        name = getattr(stream, 'name', None)
+        return isinstance(name, str) and name.endswith(INPLACE_SUFFIX)
+
+    def _remove_inplace_file(self, stream):
+        if not self._is_inplace_file(stream):
+            return
+
+        stream.close()
+
+        try:
+            os.remove(stream.name)
+        except OSError:
+            pass
+
+    def adopt_upload(self, filename, stream, rec_infos):
+        """ If upload was spooled under RECORD_ROOT and contains a single
+        recording, move it into place as that recording's WARC and return the
+        new path. Otherwise, return None and copy through the recorder
+        """
+        if not self.can_adopt_upload(stream, rec_infos):
+            return None
+
+        full_filename = stream.name[:-len(INPLACE_SUFFIX)]
+
+        os.rename(stream.name, full_filename)
+        return full_filename
+
+    def can_adopt_upload(self, stream, rec_infos):
+        return (self._is_inplace_file(stream) and
+                len([info for info in rec_infos if info['length'] > 0]) == 1)
+
+    def get_indexer(self):
+        if not self.indexer:
+            self.indexer = WebRecRecorder.make_wr_indexer(self.config)
+
+        return self.indexer
+
+    def do_inplace_upload(self, upload_key, full_filename, stream, user, coll, rec, offset, length,
+                          cdx_list=None):
+        stream.seek(offset)
+
+        logger.debug('do_inplace_upload(): {0} offset: {1}: len: {2}'.format(rec, offset, length))
+
+        params = {'param.user': user,
+                  'param.coll': coll,
+                  'param.rec': rec,
+                  'param.upid': upload_key,
+                 }
+
+        indexer = self.get_indexer()
+        indexer.add_warc_file(full_filename, params)
+
+        # index with offsets relative to the whole file, which may also
+        # contain a collection warcinfo before the recording
+        if cdx_list is None:
+            cdxout = BytesIO()
+            write_cdx_index(cdxout, LimitReader(stream, length),
+                            indexer._get_rel_or_base_name(full_filename, params),
+                            cdxj=True, append_post=True,
+                            writer_cls=CDXJIndexer)
+
+            cdx_list = cdxout.getvalue().rstrip().split(b'\n')
+
+        # skip past the recording, as if read
+        stream.seek(offset + length)
+
+        indexer.update_indexes(cdx_list, params, length)
+
+        # no copy through the recorder, count it as both parsed and written
+        self.manager.redis.hincrby(upload_key, 'size', length * 2)
+
     def _har2warc_temp_file(self):
         return SpooledTemporaryFile(max_size=BLOCK_SIZE)
 
@@ -242,19 +424,9 @@ class UploadController(BaseController):
         out = self._har2warc_temp_file()
         writer = WARCWriter(out)
 
-        buff_list = []
-        while True:
-            buff = stream.read()
-            if not buff:
-                break
-
-            buff_list.append(buff.decode('utf-8'))
-
-        #wrapper = TextIOWrapper(stream)
         try:
             rec_title = filename.rsplit('/', 1)[-1]
-            har = json.loads(''.join(buff_list))
-            HarParser(har, writer).parse(filename + '.warc.gz', rec_title)
+            StreamingHarParser(stream, writer).parse(filename + '.warc.gz', rec_title)
         finally:
             stream.close()
 
@@ -346,11 +518,16 @@ class UploadController(BaseController):
     def detect_pages(self, user, coll, rec):
         key = self.cdxj_key.format(user=user, coll=coll, rec=rec)
 
+        #for member, score in self.manager.redis.zscan_iter(key):
+        members = self.manager.redis.zrange(key, 0, -1)
+
+        return self.detect_pages_from_cdx(member.encode('utf-8') for member in members)
+
+    def detect_pages_from_cdx(self, cdx_lines):
         pages = []
 
-        #for member, score in self.manager.redis.zscan_iter(key):
-        for member in self.manager.redis.zrange(key, 0, -1):
-            cdxj = CDXObject(member.encode('utf-8'))
+        for line in cdx_lines:
+            cdxj = CDXObject(line)
 
             if ((not self.max_detect_pages or len(pages) < self.max_detect_pages)
                 and self.is_page(cdxj)):
@@ -398,9 +575,9 @@ class UploadController(BaseController):
                                              rec=rec,
                                              upid=upload_key)
 
-        r = requests.put(upload_url,
-                         headers=headers,
-                         data=stream)
+        r = self.session.put(upload_url,
+                             headers=headers,
+                             data=stream)
 
     def default_collection(self, user, filename):
         collection = self.upload_collection
@@ -426,65 +603,81 @@ class UploadController(BaseController):
                                       no_record_parse=True,
                                       verify_http=True,
                                       block_size=BLOCK_SIZE)
-        infos = []
 
-        last_indexinfo = None
-        indexinfo = None
-        is_first = True
-        remote_archives = None
+        info_parser = UploadInfoParser(self)
 
         for record in arciterator:
-            warcinfo = None
-            if record.rec_type == 'warcinfo':
-                try:
-                    warcinfo = self.parse_warcinfo(record)
-                except Exception as e:
-                    print('Error Parsing WARCINFO')
-                    traceback.print_exc()
-
-            elif remote_archives is not None:
-                source_uri = record.rec_headers.get('WARC-Source-URI')
-                if source_uri:
-                    wam_loader = self.get_wam_loader()
-                    if wam_loader:
-                        res = wam_loader.find_archive_for_url(source_uri)
-                        if res:
-                            remote_archives.add(res[2])
-
+            info_parser.parse_record(record, arciterator.offset)
             arciterator.read_to_end(record)
 
-            if last_indexinfo:
-                last_indexinfo['offset'] = arciterator.member_info[0]
-                last_indexinfo = None
+        infos = info_parser.finish(stream.tell())
+
+        self._consume_remainder(stream, expected_size)
+
+        return infos
+
+    def index_uploaded(self, stream, expected_size, base_filename, detect_pages=True,
+                       max_recs=None):
+        """ Parse recordings and build their cdx lines in a single pass.
+        Returns infos and cdx lines by recording offset.
+        If detect_pages, pages are also detected from the cdx lines
+        for recordings without pages.
+        If max_recs, indexing stops once more recordings are found,
+        the rest is only parsed and no cdx lines are returned
+        """
+        if not CDXJIndexer.wam_loader:
+            CDXJIndexer.wam_loader = self.get_wam_loader()
+
+        info_parser = UploadInfoParser(self)
+        record_parser = UploadRecordParser(info_parser,
+                                           max_recs=max_recs,
+                                           cdxj=True,
+                                           append_post=True,
+                                           verify_http=True)
+
+        cdxout = BytesIO()
+        entries = []
+
+        with CDXJIndexer(cdxout) as writer:
+            for entry in record_parser(stream):
+                pos = cdxout.tell()
+                writer.write(entry, base_filename)
+                if cdxout.tell() > pos:
+                    entries.append((int(entry['offset']), pos, cdxout.tell()))
 
-            if warcinfo:
-                self.add_index_info(infos, indexinfo, arciterator.member_info[0])
+        infos = info_parser.finish(stream.tell())
 
-                indexinfo = warcinfo.get('json-metadata')
-                indexinfo['offset'] = None
+        self._consume_remainder(stream, expected_size)
 
-                if 'title' not in indexinfo:
-                    indexinfo['title'] = 'Uploaded Recording'
+        if record_parser.max_recs_exceeded:
+            return infos, None
 
-                if 'type' not in indexinfo:
-                    indexinfo['type'] = 'recording'
+        recs = sorted(((info['offset'], info) for info in infos
+                       if info.get('type') == 'recording'),
+                      key=lambda rec: rec[0])
 
-                indexinfo['ra'] = set()
-                remote_archives = indexinfo['ra']
+        starts = [offset for offset, _ in recs]
 
-                last_indexinfo = indexinfo
+        cdx_lists = dict((offset, []) for offset in starts)
 
-            elif is_first:
-                indexinfo = {'type': 'recording',
-                             'title': 'Uploaded Recording',
-                             'offset': 0,
-                            }
+        buff = cdxout.getvalue()
 
-            is_first = False
+        for offset, start, end in entries:
+            i = bisect.bisect_right(starts, offset) - 1
+            if i < 0:
+                continue
 
-        if indexinfo:
-            self.add_index_info(infos, indexinfo, stream.tell())
+            rec_offset, info = recs[i]
+            if offset < rec_offset + info['length']:
+                cdx_lists[rec_offset].append(buff[start:end].rstrip(b'\n'))
 
+        for rec_offset, info in recs:
+            if detect_pages and info.get('pages') is None:
+                info['pages'] = self.detect_pages_from_cdx(sorted(cdx_lists[rec_offset]))
+
+        return infos, cdx_lists
+
+    def _consume_remainder(self, stream, expected_size):
         # if anything left over, likely due to WARC error, consume remainder
         if stream.tell() < expected_size:
             while True:
@@ -492,8 +685,6 @@ class UploadController(BaseController):
                 if not buff:
                     break
 
-        return infos
-
     def add_index_info(self, infos, indexinfo, curr_offset):
         if not indexinfo or indexinfo.get('offset') is None:
             return
@@ -520,6 +711,128 @@ class UploadController(BaseController):
         return warcinfo if valid else None
 
 
+# ============================================================================
+class UploadInfoParser(object):
+    """ Splits an uploaded archive into collection and recording infos,
+    from its warcinfo records, one record at a time
+    """
+    def __init__(self, controller):
+        self.controller = controller
+
+        self.infos = []
+        self.last_indexinfo = None
+        self.indexinfo = None
+        self.is_first = True
+        self.remote_archives = None
+
+        # recordings with at least one record, other than their warcinfo
+        self.num_recs = 0
+        self.counted_info = None
+
+    def parse_record(self, record, offset):
+        warcinfo = None
+        if record.rec_type == 'warcinfo':
+            try:
+                warcinfo = self.controller.parse_warcinfo(record)
+            except Exception as e:
+                print('Error Parsing WARCINFO')
+                traceback.print_exc()
+
+        elif self.remote_archives is not None:
+            source_uri = record.rec_headers.get('WARC-Source-URI')
+            if source_uri:
+                wam_loader = self.controller.get_wam_loader()
+                if wam_loader:
+                    res = wam_loader.find_archive_for_url(source_uri)
+                    if res:
+                        self.remote_archives.add(res[2])
+
+        if self.last_indexinfo:
+            self.last_indexinfo['offset'] = offset
+            self.last_indexinfo = None
+
+        if warcinfo:
+            self.controller.add_index_info(self.infos, self.indexinfo, offset)
+
+            self.indexinfo = warcinfo.get('json-metadata')
+            self.indexinfo['offset'] = None
+
+            if 'title' not in self.indexinfo:
+                self.indexinfo['title'] = 'Uploaded Recording'
+
+            if 'type' not in self.indexinfo:
+                self.indexinfo['type'] = 'recording'
+
+            self.indexinfo['ra'] = set()
+            self.remote_archives = self.indexinfo['ra']
+
+            self.last_indexinfo = self.indexinfo
+
+        elif self.is_first:
+            self.indexinfo = {'type': 'recording',
+                              'title': 'Uploaded Recording',
+                              'offset': 0,
+                             }
+
+        self.is_first = False
+
+        if (not warcinfo and self.indexinfo is not self.counted_info and
+            self.indexinfo.get('type') == 'recording'):
+            self.counted_info = self.indexinfo
+            self.num_recs += 1
+
+    def finish(self, end_offset):
+        if self.indexinfo:
+            self.controller.add_index_info(self.infos, self.indexinfo, end_offset)
+
+        return self.infos
+
+
+# ============================================================================
+class UploadRecordParser(DefaultRecordParser):
+    """ Index record parser which also passes every record, including those
+    not indexed, to an UploadInfoParser, to find recordings and their
+    cdx entries in the same pass.
+    If max_recs, records are no longer indexed once more recordings are found
+    """
+    def __init__(self, info_parser, max_recs=None, **options):
+        super(UploadRecordParser, self).__init__(**options)
+        self.info_parser = info_parser
+        self.max_recs = max_recs
+        self.max_recs_exceeded = False
+
+    def create_record_iter(self, raw_iter):
+        return super(UploadRecordParser, self).create_record_iter(
+                        ObservedArchiveIterator(raw_iter, self.observe_record))
+
+    def observe_record(self, record, offset):
+        self.info_parser.parse_record(record, offset)
+
+        if self.max_recs and self.info_parser.num_recs > self.max_recs:
+            self.max_recs_exceeded = True
+
+        return not self.max_recs_exceeded
+
+
+# ============================================================================
+class ObservedArchiveIterator(object):
+    """ Wraps an ArchiveIterator, calling callback with each record
+    and its offset before the record is read. Only records for which
+    callback returns True are passed on, others are skipped unread
+    """
+    def __init__(self, raw_iter, callback):
+        self.raw_iter = raw_iter
+        self.callback = callback
+
+    def __iter__(self):
+        for record in self.raw_iter:
+            if self.callback(record, self.raw_iter.offset):
+                yield record
+
+    def __getattr__(self, name):
+        return getattr(self.raw_iter, name)
+
+
 # ============================================================================
 class InplaceLoader(UploadController):
     def __init__(self, manager, indexer, upload_id):
@@ -527,6 +840,9 @@ class InplaceLoader(UploadController):
         self.indexer = indexer
         self.upload_id = upload_id
 
+        # indexed locally, in file order
+        self.upload_concurrency = 1
+
     def _get_upload_id(self):
         return self.upload_id
 
@@ -558,13 +874,15 @@ class InplaceLoader(UploadController):
         for filename in files:
             size = 0
             fh = None
+            tracking = None
             try:
                 size = os.path.getsize(filename)
                 fh = open(filename, 'rb')
 
                 self.manager.redis.hset(upload_key, 'filename', filename)
 
-                stream = SizeTrackingReader(fh, size, self.manager.redis, upload_key)
+                tracking = SizeTrackingReader(fh, size, self.manager.redis, upload_key)
+                stream = tracking
 
                 if filename.endswith('.har'):
                     stream, expected_size = self.har2warc(filename, stream)
@@ -574,6 +892,8 @@ class InplaceLoader(UploadController):
 
                 infos = self.parse_uploaded(stream, size)
 
+                tracking.tracker.flush()
+
                 res = self.handle_upload(fh, upload_id, upload_key, infos, filename,
                                          user, False, size)
 
@@ -582,6 +902,9 @@ class InplaceLoader(UploadController):
                 traceback.print_exc()
                 print('ERROR PARSING: ' + filename)
                 print(e)
+                if tracking:
+                    tracking.tracker.flush()
+
                 if fh:
                     rem = size - fh.tell()
                     if rem > 0:
@@ -627,3 +950,221 @@ class InplaceLoader(UploadController):
 
         return None
 
+
+
+# ============================================================================
+class ParallelInplaceLoader(InplaceLoader):
+    """ Parse and index archive files in a pool of worker processes,
+    then add the resulting indexes to redis in bulk, in original file order.
+    Files with an up-to-date entry in the segment cache, if any, are not reindexed
+    """
+    def __init__(self, manager, indexer, upload_id, jobs, segment_cache=None):
+        super(ParallelInplaceLoader, self).__init__(manager, indexer, upload_id)
+        self.jobs = jobs
+        self.segment_cache = segment_cache
+
+        # cdx lines by recording offset, for current file
+        self.cdx_lists = {}
+
+    def multifile_upload(self, user, files):
+        total_size = 0
+
+        for filename in files:
+            total_size += os.path.getsize(filename)
+
+        upload_id = self._get_upload_id()
+
+        upload_key = self.upload_key.format(user=user, upid=upload_id)
+
+        with redis_pipeline(self.manager.redis) as pi:
+            pi.hset(upload_key, 'size', 0)
+            pi.hset(upload_key, 'total_size', total_size * 2)
+            pi.hset(upload_key, 'total_files', len(files))
+            pi.hset(upload_key, 'files', len(files))
+            pi.expire(upload_key, 120)
+
+        # rel path only depends on user
+        params = {'param.user': user}
+
+        pool = None
+
+        try:
+            results = []
+
+            for filename in files:
+                result = None
+                if self.segment_cache:
+                    result = self.segment_cache.load(filename)
+
+                if result:
+                    results.append((result, False))
+                    continue
+
+                index_filename = self._get_index_filename(filename)
+                base_filename = self.indexer._get_rel_or_base_name(index_filename, params)
+
+                args = (filename, index_filename, base_filename)
+
+                if self.jobs > 1:
+                    if not pool:
+                        pool = multiprocessing.get_context('spawn').Pool(self.jobs)
+
+                    results.append((pool.apply_async(index_archive_file, args), True))
+                else:
+                    results.append((args, True))
+
+            for filename, (result, is_new) in zip(files, results):
+                if is_new:
+                    if isinstance(result, tuple):
+                        result = index_archive_file(*result)
+                    else:
+                        result = self._get_worker_result(filename, result)
+
+                    if self.segment_cache:
+                        self.segment_cache.save(filename, result)
+
+                self.add_indexed_file(user, upload_id, upload_key, filename, result)
+
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def _get_worker_result(self, filename, async_result):
+        """ Get indexing result from worker, treating a failed worker,
+        or result that could not be transferred, as an error for that file only
+        """
+        try:
+            return async_result.get()
+        except Exception as e:
+            traceback.print_exc()
+            return {'size': os.path.getsize(filename),
+                    'error': str(e)}
+
+    def _get_index_filename(self, filename):
+        if not filename.endswith('.har'):
+            return filename
+
+        with self._har2warc_temp_file() as fh:
+            index_filename = fh.name
+
+        atexit.register(lambda: os.remove(index_filename))
+        return index_filename
+
+    def add_indexed_file(self, user, upload_id, upload_key, filename, result):
+        size = result['size']
+
+        self.manager.redis.hset(upload_key, 'filename', filename)
+
+        if result.get('error'):
+            print('ERROR PARSING: ' + filename)
+            print(result['error'])
+
+            with redis_pipeline(self.manager.redis) as pi:
+                pi.hincrby(upload_key, 'size', size * 2)
+                pi.hincrby(upload_key, 'files', -1)
+            return
+
+        # parsing progress for whole file
+        self.manager.redis.hincrby(upload_key, 'size', size)
+
+        self.cdx_lists = result['cdx_lists']
+
+        fh = open(result['index_filename'], 'rb')
+
+        try:
+            res = self.handle_upload(fh, upload_id, upload_key, result['infos'], filename,
+                                     user, False, size)
+
+            assert('error_message' not in res)
+        except Exception as e:
+            traceback.print_exc()
+            print('ERROR PARSING: ' + filename)
+            print(e)
+
+            if not fh.closed:
+                rem = size - fh.tell()
+                if rem > 0:
+                    self.manager.redis.hincrby(upload_key, 'size', rem)
+                self.manager.redis.hincrby(upload_key, 'files', -1)
+                fh.close()
+        finally:
+            self.cdx_lists = {}
+
+    def do_upload(self, upload_key, filename, stream, user, coll, rec, offset, length):
+        cdx_list = self.cdx_lists.get(offset)
+        if cdx_list is None:
+            return super(ParallelInplaceLoader, self).do_upload(upload_key, filename,
+                                                                stream, user, coll, rec,
+                                                                offset, length)
+
+        params = {'param.user': user,
+                  'param.coll': coll,
+                  'param.rec': rec,
+                  'param.upid': upload_key,
+                 }
+
+        self.indexer.add_warc_file(stream.name, params)
+        self.indexer.update_indexes(cdx_list, params, length)
+
+        self.manager.redis.hincrby(upload_key, 'size', length)
+
+
+# ============================================================================
+class ArchiveFileIndexer(UploadController):
+    """ Parses and indexes a single archive file, without redis access,
+    for use in worker processes
+    """
+    def __init__(self):
+        self.wam_loader = WAMLoader()
+        CDXJIndexer.wam_loader = self.wam_loader
+
+        self.har_filename = None
+
+    def get_wam_loader(self):
+        return self.wam_loader
+
+    def _har2warc_temp_file(self):
+        return open(self.har_filename, 'w+b')
+
+    def __call__(self, filename, index_filename, base_filename):
+        size = os.path.getsize(filename)
+
+        result = {'size': size,
+                  'index_filename': index_filename}
+
+        fh = open(filename, 'rb')
+
+        try:
+            if filename.endswith('.har'):
+                self.har_filename = index_filename
+                stream, index_size = self.har2warc(filename, fh)
+            else:
+                stream, index_size = fh, size
+
+            with stream:
+                infos, cdx_lists = self.index_uploaded(stream, index_size, base_filename,
+                                                       detect_pages=False)
+
+            result['infos'] = infos
+            result['cdx_lists'] = cdx_lists
+
+        except Exception as e:
+            traceback.print_exc()
+            result['error'] = str(e)
+
+        finally:
+            fh.close()
+
+        return result
+
+
+# ============================================================================
+_file_indexer = None
+
+def index_archive_file(filename, index_filename, base_filename):
+    global _file_indexer
+    if not _file_indexer:
+        _file_indexer = ArchiveFileIndexer()
+
+    return _file_indexer(filename, index_filename, base_filename)
@@ -225,14 +225,13 @@ class UserController(BaseController):
             """API enpoint to create a user with schema validation"""
             available_roles = [x for x in self.manager.cork._store.roles]
             users = self.manager.get_users()
-            emails = [u[1]['email_addr'] for u in users.items()]
             data = request.json
             err = NewUserSchema().validate(data)
 
             if 'username' in data and data['username'] in users:
                 err.update({'username': 'Username already exists'})
 
-            if 'email' in data and data['email'] in emails:
+            if 'email' in data and self.manager.has_user_email(data['email']):
                 err.update({'email': 'Email already exists'})
 
             if 'role' in data and data['role'] not in available_roles:
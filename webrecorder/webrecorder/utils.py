@@ -2,7 +2,9 @@ from warcio.limitreader import LimitReader
 from pywb.utils.loaders import load_overlay_config
 from contextlib import contextmanager
 
+import os
 import re
+import time
 import gevent
 import logging
 
@@ -75,6 +77,97 @@ def redis_pipeline(redis_obj):
     p.execute()
 
 
+# ============================================================================
+def iter_zset_lex(redis_obj, key, page_size=10000):
+    """ Iterate over all members of a lex-ordered (all scores 0) sorted set
+    in order, loading at most page_size members at a time
+    """
+    start = '-'
+
+    while True:
+        page = redis_obj.zrangebylex(key, start, '+', 0, page_size)
+
+        for member in page:
+            yield member
+
+        if len(page) < page_size:
+            break
+
+        last = page[-1]
+        if isinstance(last, bytes):
+            last = last.decode('utf-8')
+
+        start = '(' + last
+
+
+# ============================================================================
+class BatchedHashCounter(object):
+    """ Accumulates increments to a single redis hash field locally and
+    applies them with one hincrby() once flush_size has accumulated or
+    flush_secs have passed since the last flush
+    """
+    def __init__(self, redis, key, field, flush_size=1024*1024, flush_secs=0.5):
+        self.redis = redis
+        self.key = key
+        self.field = field
+        self.flush_size = flush_size
+        self.flush_secs = flush_secs
+
+        self.pending = 0
+        self.flushed = 0
+        self.last_flush = time.time()
+
+    def incr(self, amount):
+        self.pending += amount
+
+        if (self.pending >= self.flush_size or
+            time.time() - self.last_flush >= self.flush_secs):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.redis.hincrby(self.key, self.field, self.pending)
+            self.flushed += self.pending
+            self.pending = 0
+
+        self.last_flush = time.time()
+
+
+# ============================================================================
+class PositionalReader(object):
+    """ Reader over an open file descriptor with its own position,
+    so that several readers can read the same file concurrently.
+    The descriptor is not owned, and not closed, by the reader
+    """
+    def __init__(self, fileno, offset=0):
+        self.fileno_ = fileno
+        self.pos = offset
+        self.closed = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = os.fstat(self.fileno_).st_size - self.pos
+
+        buff = os.pread(self.fileno_, size, self.pos)
+        self.pos += len(buff)
+        return buff
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += os.fstat(self.fileno_).st_size
+
+        self.pos = pos
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.closed = True
+
+
 # ============================================================================
 class CacheingLimitReader(LimitReader):
     def __init__(self, stream, length, out):
@@ -103,22 +196,25 @@ class CacheingLimitReader(LimitReader):
 
 
 # ============================================================================
-class SizeTrackingWriter(object):
-    def __init__(self, redis, key):
-        self.redis = redis
-        self.key = key
+class UploadProgressTracker(BatchedHashCounter):
+    """ Batched progress for the 'size' field of an upload status hash,
+    shared by the recorder write path and the indexing path
+    """
+    def __init__(self, redis, key, **kwargs):
+        super(UploadProgressTracker, self).__init__(redis, key, 'size', **kwargs)
 
     def write(self, buff):
         gevent.sleep(0)
 
-        self.redis.hincrby(self.key, 'size', len(buff))
+        self.incr(len(buff))
 
 
 # ============================================================================
 class SizeTrackingReader(CacheingLimitReader):
-    def __init__(self, stream, length, redis, key):
-        super(SizeTrackingReader, self).__init__(stream, length,
-                                                 SizeTrackingWriter(redis, key))
+    def __init__(self, stream, length, redis, key, tracker=None):
+        self.tracker = tracker or UploadProgressTracker(redis, key)
+
+        super(SizeTrackingReader, self).__init__(stream, length, self.tracker)
 
         self.closed = False
 
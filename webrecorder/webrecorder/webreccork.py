@@ -2,7 +2,7 @@ from cork import Cork, AAAException
 from datetime import datetime
 import os
 
-from webrecorder.redisutils import RedisTable
+from webrecorder.redisutils import RedisTable, RedisUserTable
 
 
 # ============================================================================
@@ -122,7 +122,7 @@ class WebRecCork(Cork):
 class RedisCorkBackend(object):
     def __init__(self, redis):
         self.redis = redis
-        self.users = RedisTable(self.redis, 'h:users')
+        self.users = RedisUserTable(self.redis, 'h:users')
         self.roles = RedisTable(self.redis, 'h:roles')
         self.pending_registrations = RedisTable(self.redis, 'h:register')
 